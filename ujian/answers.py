@@ -0,0 +1,253 @@
+"""
+Answer submission pipeline.
+
+Students autosave answer deltas ({question_id: value}) keyed by their
+session_hash. Deltas are validated against a short-lived cache of active
+sessions, queued in-process and appended to the answers table in batches
+with execute_values, so hundreds of autosaving clients cost a few
+transactions per second. The answers table is append-only: the latest row
+per (session_hash, question_id) is the current answer.
+
+The same flush merges every session's delta into sessions.answers, a jsonb
+snapshot of the current answers, so resuming a session (session_snapshot)
+is one row read instead of a scan of the log.
+
+Active-session markers live in the shared state backend (state.py), so
+every app node behind the load balancer sees the same sessions. Finishing
+flushes only the local queue: answers given before the session finished
+that another node writes later trigger a rescore in the same flush, and
+answers given after it are dropped.
+"""
+
+import json
+import logging
+import time
+
+from psycopg2.extras import execute_values
+from batching import WriteBehindQueue
+from config import ANSWER_FLUSH_INTERVAL, ANSWER_FLUSH_BATCH, SESSION_CACHE_TTL, EXAM_DURATION
+from db import db_cursor
+from queries import execute, SESSION_ACTIVE, SESSION_SNAPSHOT
+from state import state, StateError
+
+logger = logging.getLogger(__name__)
+
+MAX_DELTA_SIZE = 500
+
+# rows whose session vanished between queueing and flushing are dropped by the
+# join, and so are rows answered after their session finished (_write_batch
+# filters the same way, so the snapshot merge skips them too)
+INSERT_SQL = """
+INSERT INTO answers (session_hash, nis, subject, question_id, answer, answered_at)
+SELECT v.session_hash, v.nis, v.subject, v.question_id, v.answer, v.answered_at
+FROM (VALUES %s) AS v(session_hash, nis, subject, question_id, answer, answered_at)
+JOIN sessions s ON s.session_hash = v.session_hash AND s.nis = v.nis
+WHERE s.active OR v.answered_at <= s.finished_at
+"""
+INSERT_TEMPLATE = "(%s, %s, %s, %s, %s::jsonb, to_timestamp(%s))"
+
+# merge each session's delta into its sessions.answers snapshot (what a
+# resumed session is handed back), then send one progress event per session
+# for the proctor stream (events.py)
+SNAPSHOT_SQL = """
+WITH merged AS (
+    UPDATE sessions s SET answers = s.answers || v.delta
+    FROM (VALUES %s) AS v(session_hash, nis, delta)
+    WHERE s.session_hash = v.session_hash AND s.nis = v.nis
+    RETURNING s.nis, s.subject, s.answers
+)
+SELECT pg_notify('exam_events', json_build_object(
+    'type', 'progress', 'room', st.class, 'nis', m.nis, 'subject', m.subject,
+    'answered', (SELECT count(*) FROM jsonb_object_keys(m.answers)), 'at', now()
+)::text)
+FROM merged m JOIN students st ON st.nis = m.nis
+"""
+SNAPSHOT_TEMPLATE = "(%s, %s, %s::jsonb)"
+
+# the UPDATE above may visit sessions in any order the plan likes; taking the
+# row locks up front in session_hash order keeps workers flushing overlapping
+# sessions at the same time from deadlocking. It also says which sessions
+# have already finished, and when, so late rows can be kept or dropped.
+LOCK_SESSIONS_SQL = """
+SELECT s.session_hash, s.nis, COALESCE(NULLIF(st.grade, ''), st.class), s.subject, s.form_version,
+       s.active, extract(epoch FROM s.finished_at)
+FROM sessions s JOIN students st ON st.nis = s.nis
+WHERE s.session_hash = ANY(%s) ORDER BY s.session_hash FOR NO KEY UPDATE OF s
+"""
+
+
+class SessionCache:
+    """session_hash -> (nis, subject) for active sessions, kept for `ttl` seconds in the state backend.
+
+    The markers are shared, so a session opened on one node is recognised by
+    the others without a query; when the backend is unreachable every lookup
+    goes to the database.
+    """
+
+    def __init__(self, ttl=SESSION_CACHE_TTL, backend=state):
+        self.ttl = ttl
+        self.backend = backend
+
+    def _get(self, session_hash):
+        try:
+            value = self.backend.get("session:" + session_hash)
+        except StateError as e:
+            logger.warning("Session cache unavailable: %s", e)
+            return None
+        return value.split("\t", 1) if value else None
+
+    def remember(self, session_hash, nis, subject):
+        try:
+            self.backend.set("session:" + session_hash, "%s\t%s" % (nis, subject), ttl=self.ttl)
+        except StateError as e:
+            logger.warning("Session not cached: %s", e)
+
+    def lookup(self, session_hash, nis):
+        hit = self._get(session_hash)
+        if hit:
+            return hit[1] if hit[0] == str(nis) else None
+        with db_cursor() as (conn, cur):
+            execute(cur, SESSION_ACTIVE, (session_hash,))
+            row = cur.fetchone()
+        if not row:
+            self.forget(session_hash)
+            return None
+        self.remember(session_hash, row[0], row[1])
+        return row[1] if str(row[0]) == str(nis) else None
+
+    def forget(self, session_hash):
+        try:
+            self.backend.delete("session:" + session_hash)
+        except StateError as e:
+            logger.warning("Session marker not dropped: %s", e)
+
+
+def _session_deltas(rows):
+    """One (session_hash, nis, delta object) per session, sorted by session.
+
+    The newest answer to a question wins, as in latest_answers: the latest
+    answered_at, and of equal ones the later row.
+
+    Sorted so the statement is stable; the row locks themselves are taken
+    in order by LOCK_SESSIONS_SQL first.
+    """
+    deltas = {}
+    for session_hash, nis, _, question_id, answer, answered_at in rows:
+        delta = deltas.setdefault((session_hash, nis), {})
+        if question_id not in delta or answered_at >= delta[question_id][0]:
+            delta[question_id] = (answered_at, answer)
+    # answers are already JSON text, so the object is joined rather than re-encoded
+    return [
+        (session_hash, nis, "{" + ",".join(json.dumps(q) + ":" + a for q, (_, a) in delta.items()) + "}")
+        for (session_hash, nis), delta in sorted(deltas.items())
+    ]
+
+
+def _rescore(cur, sessions):
+    """Score finished sessions again, now that the answers they were missing are written.
+
+    examFinish only flushes its own node's queue, so an autosave still queued
+    on another node lands after the session was scored.
+    """
+    from results import record_score
+    for session_hash, nis, grade, subject, version in sessions:
+        # a scoring failure must not lose the answers of the whole batch
+        cur.execute("SAVEPOINT score")
+        try:
+            record_score(cur, session_hash, nis, grade, subject, version)
+        except Exception:
+            logger.exception("Failed to rescore session %s", session_hash)
+            cur.execute("ROLLBACK TO SAVEPOINT score")
+
+
+def _accepted(session, nis, answered_at):
+    """True if the locked session row takes an answer given at answered_at, as INSERT_SQL decides."""
+    if session is None or session[1] != str(nis):
+        return False
+    active, finished_at = session[5], session[6]
+    return active or (finished_at is not None and answered_at <= float(finished_at))
+
+
+def _write_batch(rows):
+    with db_cursor() as (conn, cur):
+        cur.execute(LOCK_SESSIONS_SQL, (sorted({row[0] for row in rows}),))
+        sessions = {row[0]: row for row in cur.fetchall()}
+        # an autosave queued before its session finished still counts; one a
+        # stale session marker let through afterwards must not change the score
+        rows = [row for row in rows if _accepted(sessions.get(row[0]), row[1], row[5])]
+        if not rows:
+            return
+        execute_values(cur, INSERT_SQL, rows, template=INSERT_TEMPLATE, page_size=1000)
+        execute_values(cur, SNAPSHOT_SQL, _session_deltas(rows), template=SNAPSHOT_TEMPLATE, page_size=1000)
+        late = sorted({row[0] for row in rows if not sessions[row[0]][5]})
+        if late:
+            _rescore(cur, [sessions[session_hash][:5] for session_hash in late])
+
+
+session_cache = SessionCache()
+answer_queue = WriteBehindQueue("answers", _write_batch, interval=ANSWER_FLUSH_INTERVAL, max_batch=ANSWER_FLUSH_BATCH)
+
+
+def submit_answers(session_hash, nis, deltas):
+    """Queue a delta for an active session.
+
+    Returns the number of answers queued, or None when the session is not
+    active for this nis. Raises ValueError for a malformed delta.
+    """
+    if not isinstance(deltas, dict):
+        raise ValueError("answers must be an object of question id -> answer")
+    if len(deltas) > MAX_DELTA_SIZE:
+        raise ValueError("too many answers in one delta")
+    rows = []
+    for qid, value in deltas.items():
+        encoded = json.dumps(value)
+        # Postgres text and jsonb cannot hold NUL; caught here rather than failing a whole flush
+        if "\x00" in str(qid) or "\\u0000" in encoded:
+            raise ValueError("answers must not contain NUL characters")
+        rows.append((str(qid), encoded))
+    subject = session_cache.lookup(session_hash, nis)
+    if subject is None:
+        return None
+    now = time.time()
+    answer_queue.extend((session_hash, nis, subject, qid, encoded, now) for qid, encoded in rows)
+    return len(rows)
+
+
+def remaining_time(elapsed):
+    """Seconds left of EXAM_DURATION after elapsed seconds, never negative."""
+    return max(0, int(EXAM_DURATION - float(elapsed or 0)))
+
+
+def session_snapshot(session_hash, nis):
+    """Current answers and remaining seconds of an active session, or None.
+
+    Deltas this process still has queued are flushed first, so the snapshot
+    holds everything the student saved here.
+    """
+    answer_queue.flush()
+    with db_cursor() as (conn, cur):
+        execute(cur, SESSION_SNAPSHOT, (session_hash, nis))
+        row = cur.fetchone()
+    if not row:
+        return None
+    return json.loads(row[0]), remaining_time(row[1])
+
+
+def latest_answers(cur, session_hashes):
+    """Return {session_hash: {question_id: answer}} from the append-only log.
+
+    Rows are not inserted in the order they were answered (a requeued batch,
+    or one flushed by another node, comes later), so the newest answered_at
+    wins and id only breaks ties.
+    """
+    result = {h: {} for h in session_hashes}
+    if not result:
+        return result
+    cur.execute(
+        "SELECT DISTINCT ON (session_hash, question_id) session_hash, question_id, answer "
+        "FROM answers WHERE session_hash = ANY(%s) ORDER BY session_hash, question_id, answered_at DESC, id DESC",
+        (list(result),),
+    )
+    for session_hash, question_id, answer in cur.fetchall():
+        result[session_hash][question_id] = answer
+    return result
@@ -12,17 +12,27 @@ configuration files and database schema as needed.
 ------------------------------------------------------
 """
 
-import logging, os, yaml, json, sys, atexit
-from db import close_db_pool
+import os, json, atexit
+from db import close_db_pool, init_pool, pool_stats
+from metrics import request_metrics, setup_logging, admin_allowed
+from answers import answer_queue
+from violations import violation_queue
+from formcache import form_cache
+from notify import listener
+from events import broker, CHANNEL as EVENTS_CHANNEL
+from results import on_forms_notify
+from janitor import janitor
+from schedule import prewarmer
 from routes.student import bp as student_bp
 from routes.teacher import bp as teacher_bp
 from flask import jsonify, request, Flask
 from flask_cors import CORS
-from config import APP_NAME, APP_VERSION, ROOT, ROUTESJSON
+from config import APP_NAME, APP_VERSION, ROOT, ROUTESJSON, FORM_CACHE_LISTEN, JANITOR_INTERVAL, SCHEDULE_RELOAD, HUB_PORT
 
 # ---------------------------- APP
 
 def create_app():
+    setup_logging()
     app = Flask(APP_NAME+' '+APP_VERSION, template_folder=os.path.join(ROOT, "htmls"))
     CORS(app)
     with open(ROUTESJSON, "r") as f:
@@ -30,7 +40,34 @@ def create_app():
     app.register_blueprint(student_bp, url_prefix=config.get('student'))
     app.register_blueprint(teacher_bp, url_prefix=config.get('teacher'))
 
+    init_pool(background=True)
     atexit.register(close_db_pool)
+    # registered after close_db_pool so they drain before the pool closes
+    atexit.register(answer_queue.stop)
+    atexit.register(violation_queue.stop)
+
+    if JANITOR_INTERVAL > 0:
+        janitor.start()
+        atexit.register(janitor.stop)
+
+    if SCHEDULE_RELOAD > 0:
+        prewarmer.start()
+        atexit.register(prewarmer.stop)
+
+    if FORM_CACHE_LISTEN:
+        listener.subscribe("exam_forms", form_cache.on_notify)
+        listener.subscribe("exam_forms", on_forms_notify)
+    # the live proctor stream has no polling fallback, so always listen
+    listener.subscribe(EVENTS_CHANNEL, broker.on_notify)
+    listener.start()
+    atexit.register(listener.stop)
+
+    request_metrics.install(app)
+
+    @app.context_processor
+    def hubSettings():
+        # exam pages hand the hub port to guard.js through <meta name="hub-port">
+        return {"hub_port": HUB_PORT}
 
     from functools import lru_cache
     @lru_cache(maxsize=128)
@@ -51,4 +88,10 @@ def create_app():
             "student-url": baseUrl + app.url_map._rules_by_endpoint['student.examLogin'][0].rule
         })
 
+    @app.route('/adminspoolstats', methods=['GET'])
+    def getPoolStats():
+        if not admin_allowed(request):
+            return jsonify({"ok": False, "message": "forbidden"}), 403
+        return jsonify({"ok": True, **pool_stats()})
+
     return app
\ No newline at end of file
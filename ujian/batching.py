@@ -0,0 +1,120 @@
+"""
+Write-behind batching.
+
+Request threads put() rows and return immediately; a daemon thread hands the
+accumulated rows to flush_fn every `interval` seconds, or as soon as
+`max_batch` rows are waiting.
+
+A flush that fails because of the rows themselves (a DataError or
+IntegrityError from the database, a ValueError raised before sending) is
+bisected until the rejected rows are found, and those are logged and
+dropped so they cannot block everything queued behind them. Any other
+failure (database down, pool exhausted, deadlock, or a schema or privilege
+mismatch after a deploy) keeps the rows queued for the next attempt, so it
+delays writes instead of losing them.
+"""
+
+import logging
+import threading
+import time
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+
+def rejected_rows(exc):
+    """True for failures caused by the rows, which retrying cannot fix."""
+    return isinstance(exc, (psycopg2.DataError, psycopg2.IntegrityError, ValueError))
+
+
+class WriteBehindQueue:
+    def __init__(self, name, flush_fn, interval=1.0, max_batch=500, rejected=rejected_rows):
+        self.name = name
+        self._flush_fn = flush_fn
+        self._rejected = rejected
+        self.interval = interval
+        self.max_batch = max_batch
+        self._items = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"flushed": 0, "batches": 0, "failures": 0, "dropped": 0, "last_flush": None}
+
+    def put(self, item):
+        self.extend((item,))
+
+    def extend(self, items):
+        with self._lock:
+            self._items.extend(items)
+            full = len(self._items) >= self.max_batch
+        if full:
+            self._wakeup.set()
+        self.start()
+
+    def pending(self):
+        with self._lock:
+            return len(self._items)
+
+    def flush(self):
+        """Write everything queued so far. Returns the number of rows written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._items = self._items, []
+            if not batch:
+                return 0
+            written = 0
+            chunks = [batch]  # stack, first rows on top
+            while chunks:
+                chunk = chunks.pop()
+                try:
+                    self._flush_fn(chunk)
+                except Exception as e:
+                    if not self._rejected(e):
+                        left = chunk + [row for c in reversed(chunks) for row in c]
+                        logger.exception("%s: flush of %d rows failed, requeueing", self.name, len(left))
+                        with self._lock:
+                            self._items[:0] = left
+                        self.stats["failures"] += 1
+                        break
+                    if len(chunk) == 1:
+                        logger.error("%s: dropping a row the database rejects (%s): %r", self.name, e, chunk[0])
+                        self.stats["dropped"] += 1
+                        continue
+                    # narrow down the rejected rows; the rest are written
+                    half = len(chunk) // 2
+                    chunks += [chunk[half:], chunk[:half]]
+                    continue
+                written += len(chunk)
+                self.stats["batches"] += 1
+            if written:
+                self.stats["flushed"] += written
+                self.stats["last_flush"] = time.time()
+            return written
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"writebehind-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and flush what is left."""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
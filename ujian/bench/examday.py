@@ -0,0 +1,356 @@
+"""
+Exam-day load test against a running server.
+
+Replays one compressed exam day for --students students taken from
+data/students.json. Each student:
+
+  - arrives at a random moment within --rush seconds of the bell and logs in
+    (examLogin);
+  - fetches the form (examDo);
+  - autosaves a few answers every --autosave seconds (examSubmit) until
+    --duration is over;
+  - finishes (examFinish).
+
+Meanwhile --teachers teachers poll the dashboard summary and a student
+listing every --poll seconds. Requests are paced by a scheduler and sent
+from a pool of --concurrency threads over keep-alive connections.
+
+For every endpoint it reports p50/p95/p99 latency, throughput, errors and
+DB round trips per request, read from the X-DB-Queries header
+(DB_QUERY_HEADER). Statements run outside any request, such as the batched
+answer writes, show up as "background", taken from /adminspoolstats.
+Counts come from whichever worker answered, so run the server with one
+worker for exact round trips:
+
+  python cli.py serve --workers 1 --bind 127.0.0.1:5000
+  python bench/examday.py --url http://127.0.0.1:5000 --students 200,400,800 --workers 1
+
+A run passes when every endpoint's p95 stays under --slo seconds with an
+error rate under 0.1%. The largest passing count divided by --workers is the
+"students per worker" figure to quote for a release.
+
+Point config.py at a scratch database. Logins need published forms
+(cli.py publish-form) and imported students. Before each run, active sessions
+left by the bench students are closed directly in the database, so a failed
+run does not 409 the next one (--no-reset skips this).
+"""
+
+import argparse
+import heapq
+import http.client
+import json
+import queue
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+# the ujian package root holds config.py/students.py
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from config import DB, ROUTESJSON, SERVER_WORKERS, ADMIN_TOKEN
+from students import iter_roster
+
+ERROR_BUDGET = 0.001
+
+
+# ---------------------------- HTTP
+
+class Client:
+    """One keep-alive connection per thread to the server under test."""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.https = parts.scheme == "https"
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        """Return (status, headers, body bytes, seconds); status 0 on a transport error."""
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = dict(headers or {})
+        if data is not None:
+            headers["Content-Type"] = "application/json"
+        started = time.perf_counter()
+        for attempt in (0, 1):
+            conn = self._conn()
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                payload = resp.read()
+                return resp.status, resp.headers, payload, time.perf_counter() - started
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                self._local.conn = None
+                # a keep-alive connection the server already closed is retried once
+                if attempt:
+                    return 0, {}, b"", time.perf_counter() - started
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}  # endpoint -> [(seconds, ok, db round trips)]
+        self.windows = {}  # endpoint -> [first sent, last done]
+        self.lag = []      # seconds requests were sent behind schedule
+
+    def add(self, endpoint, sent, seconds, ok, queries):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((seconds, ok, queries))
+            window = self.windows.setdefault(endpoint, [sent, sent + seconds])
+            window[0] = min(window[0], sent)
+            window[1] = max(window[1], sent + seconds)
+
+
+# ---------------------------- simulated users
+
+class Day:
+    def __init__(self, client, recorder, prefixes, args):
+        self.client = client
+        self.recorder = recorder
+        self.student_url = prefixes.get("student") or ""
+        self.teacher_url = prefixes.get("teacher") or ""
+        self.args = args
+        self.start = None
+        self.end = None
+        self.rng = random.Random(args.seed)
+        self._events = queue.Queue()
+
+    def call(self, endpoint, method, path, body=None, ok=(200, 202)):
+        sent = time.monotonic()
+        status, headers, payload, seconds = self.client.request(method, path, body)
+        queries = headers.get("X-DB-Queries") if status else None
+        self.recorder.add(endpoint, sent, seconds, status in ok, int(queries) if queries is not None else None)
+        return status, headers, payload
+
+    def student(self, student):
+        """Generator of student steps; each yields the delay before the next one."""
+        nis, _, _, class_, subject = student
+        status, _, payload = self.call("examLogin", "POST", self.student_url + "/",
+                                       {"class": class_, "subject": subject, "nis": nis})
+        if status != 200:
+            return
+        session = {"hash": json.loads(payload)["exam-hash"], "nis": nis}
+        yield 0
+
+        status, _, payload = self.call("examDo", "POST", self.student_url + "/exam", session)
+        if status != 200:
+            return
+        questions = exam_questions(json.loads(payload), subject)
+        rng = random.Random(nis)
+        while time.monotonic() + self.args.autosave < self.end:
+            yield self.args.autosave * rng.uniform(0.8, 1.2)
+            picked = rng.sample(questions, min(len(questions), self.args.answers)) if questions else []
+            deltas = {qid: rng.choice(options) if options else rng.randint(1, 4) for qid, options in picked}
+            self.call("examSubmit", "POST", self.student_url + "/submit", dict(session, answers=deltas))
+
+        yield rng.uniform(0, self.args.rush)
+        self.call("examFinish", "POST", self.student_url + "/finish", session)
+
+    def teacher(self, subject, grade):
+        listing = f"{self.teacher_url}/dashboard/{quote(subject)}/{quote(grade)}/students?limit=50"
+        while time.monotonic() < self.end:
+            self.call("teacherDashboard", "POST", self.teacher_url + "/dashboard", {})
+            self.call("teacherStudents", "GET", listing)
+            yield self.args.poll
+
+    def _step(self, due, n, steps):
+        self.recorder.lag.append(max(0.0, time.monotonic() - due))
+        try:
+            delay = next(steps)
+        except StopIteration:
+            self._events.put(None)
+            return
+        except Exception as e:
+            print(f"  user {n} failed: {e}")
+            self._events.put(None)
+            return
+        self._events.put((time.monotonic() + delay, n, steps))
+
+    def run(self, students, teachers):
+        self.start = time.monotonic()
+        self.end = self.start + self.args.rush + self.args.duration
+        heap = [(self.start + self.rng.uniform(0, self.args.rush), n, self.student(s)) for n, s in enumerate(students)]
+        heap += [(self.start + self.rng.uniform(0, self.args.poll), len(heap) + n, self.teacher(*t))
+                 for n, t in enumerate(teachers)]
+        heapq.heapify(heap)
+        active = len(heap)
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            while active:
+                while heap and heap[0][0] <= time.monotonic():
+                    pool.submit(self._step, *heapq.heappop(heap))
+                timeout = max(0.0, heap[0][0] - time.monotonic()) if heap else None
+                try:
+                    event = self._events.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                if event is None:
+                    active -= 1
+                else:
+                    heapq.heappush(heap, event)
+        return time.monotonic() - self.start
+
+
+def exam_questions(body, subject):
+    """[(question id, [option ids])] of subject's form in an examDo response."""
+    form = (body.get("forms") or {}).get(subject)
+    if not isinstance(form, dict):
+        return []
+    questions = []
+    for field in form.get("field") or []:
+        opsi = (field.get("jawab") or {}).get("opsi") or []
+        questions.append((str(field.get("id")), [o.get("id") for o in opsi if isinstance(o, dict)]))
+    return questions
+
+
+# ---------------------------- setup
+
+def published_subjects():
+    """{grade: [subject]} of every published form."""
+    import psycopg2
+    with psycopg2.connect(**DB) as conn, conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT grade, subject FROM exam_forms ORDER BY grade, subject")
+        subjects = {}
+        for grade, subject in cur.fetchall():
+            subjects.setdefault(grade, []).append(subject)
+    return subjects
+
+
+def pick_students(roster_path, count, subject, rng):
+    with open(roster_path, "r", encoding="utf-8") as f:
+        roster = [r for r in iter_roster(json.load(f)) if r[0] and r[2] and r[3]]
+    subjects = published_subjects()
+    roster = [r for r in roster if subject or subjects.get(r[2])]
+    if not roster:
+        raise SystemExit("no student in the roster has a published form for their grade")
+    rng.shuffle(roster)
+    picked = roster[:count]
+    if len(picked) < count:
+        print(f"  roster has only {len(picked)} eligible students, using all of them")
+    return [(nis, name, grade, class_, subject or rng.choice(subjects[grade])) for nis, name, grade, class_ in picked]
+
+
+def reset_sessions(students):
+    import psycopg2
+    with psycopg2.connect(**DB) as conn, conn.cursor() as cur:
+        cur.execute("UPDATE sessions SET active = FALSE, finished_at = NOW() WHERE active AND nis = ANY(%s)",
+                    ([s[0] for s in students],))
+        return cur.rowcount
+
+
+def server_statements(client):
+    headers = {"Authorization": f"Bearer {ADMIN_TOKEN}"} if ADMIN_TOKEN else None
+    status, _, payload, _ = client.request("GET", "/adminspoolstats", headers=headers)
+    if status != 200:
+        return None
+    return sum(q["calls"] for q in json.loads(payload).get("queries") or [])
+
+
+# ---------------------------- report
+
+def percentile(values, p):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+def report(recorder, elapsed, background, slo):
+    print(f"  {'endpoint':<18} {'requests':>8} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'db/req':>7}")
+    passed, total = True, 0
+    for endpoint, samples in sorted(recorder.samples.items()):
+        seconds = [s for s, _, _ in samples]
+        errors = sum(1 for _, ok, _ in samples if not ok)
+        queries = [q for _, _, q in samples if q is not None]
+        first, last = recorder.windows[endpoint]
+        p50, p95, p99 = (percentile(seconds, p) for p in (50, 95, 99))
+        total += len(samples)
+        passed &= p95 <= slo and errors <= ERROR_BUDGET * len(samples)
+        print(f"  {endpoint:<18} {len(samples):>8} {errors:>7} {len(samples) / max(last - first, 1e-9):>8.1f} "
+              f"{p50 * 1000:>8.1f} {p95 * 1000:>8.1f} {p99 * 1000:>8.1f} "
+              f"{statistics.fmean(queries) if queries else float('nan'):>7.2f}")
+    print(f"  {total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+    if background is not None:
+        print(f"  background statements (batched writes, listeners): {background}")
+    lag = sorted(recorder.lag)
+    if lag and percentile(lag, 95) > 1.0:
+        print(f"  warning: requests ran {percentile(lag, 95):.1f}s behind schedule at p95, raise --concurrency")
+    return passed
+
+
+def run(args, client, prefixes, count):
+    rng = random.Random(args.seed)
+    students = pick_students(args.roster, count, args.subject, rng)
+    if not args.no_reset:
+        closed = reset_sessions(students)
+        if closed:
+            print(f"  closed {closed} active session(s) left from an earlier run")
+    pairs = sorted({(s[4], s[2]) for s in students})
+    teachers = [pairs[n % len(pairs)] for n in range(args.teachers)]
+
+    print(f"\n{len(students)} students, {len(teachers)} teachers, "
+          f"{args.rush:.0f}s rush + {args.duration:.0f}s exam, {args.concurrency} client threads")
+    recorder = Recorder()
+    before = server_statements(client)
+    elapsed = Day(client, recorder, prefixes, args).run(students, teachers)
+    # let the answer queue drain before reading the server's totals
+    time.sleep(args.settle)
+    after = server_statements(client)
+    background = None
+    if before is not None and after is not None:
+        counted = sum(q for samples in recorder.samples.values() for _, _, q in samples if q is not None)
+        background = after - before - counted - 1  # the /adminspoolstats call itself
+    passed = report(recorder, elapsed, background, args.slo)
+    print(f"  {'PASS' if passed else 'FAIL'} (p95 <= {args.slo * 1000:.0f} ms, errors <= {ERROR_BUDGET:.1%})")
+    return len(students), passed
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Replay an exam day against a running server")
+    p.add_argument("--url", default="http://127.0.0.1:5000")
+    p.add_argument("--students", default="200", help="student count, or a comma-separated sweep (200,400,800)")
+    p.add_argument("--roster", default=str(ROOT / "data" / "students.json"))
+    p.add_argument("--subject", help="subject every student sits (default: a published one of their grade)")
+    p.add_argument("--teachers", type=int, default=5)
+    p.add_argument("--rush", type=float, default=30.0, help="seconds over which students arrive after the bell")
+    p.add_argument("--duration", type=float, default=120.0, help="seconds of exam after the rush")
+    p.add_argument("--autosave", type=float, default=15.0, help="seconds between a student's autosaves")
+    p.add_argument("--answers", type=int, default=3, help="answers per autosave")
+    p.add_argument("--poll", type=float, default=5.0, help="seconds between dashboard polls")
+    p.add_argument("--concurrency", type=int, default=200, help="client threads")
+    p.add_argument("--timeout", type=float, default=30.0)
+    p.add_argument("--settle", type=float, default=3.0, help="seconds to wait for queued writes after the day")
+    p.add_argument("--slo", type=float, default=0.5, help="p95 seconds every endpoint must stay under")
+    p.add_argument("--workers", type=int, default=SERVER_WORKERS, help="worker processes the server runs")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--no-reset", action="store_true", help="do not close leftover bench sessions first")
+    args = p.parse_args(argv)
+
+    with open(ROUTESJSON, "r") as f:
+        prefixes = json.load(f)
+    client = Client(args.url, args.timeout)
+    results = [run(args, client, prefixes, int(n)) for n in args.students.split(",")]
+
+    best = max((n for n, passed in results if passed), default=None)
+    if best is None:
+        print("\nNo run met the SLO.")
+        return 1
+    print(f"\nstudents per worker: {best / args.workers:.0f} ({best} students on {args.workers} worker(s))")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
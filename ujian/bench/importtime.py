@@ -0,0 +1,90 @@
+"""
+Import-time budget for the app's entry points.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for
+each target (cwd = the ujian directory), reports its cumulative import
+time and the slowest packages it pulls in directly. Nothing here needs a
+database: importing these modules must not connect to anything.
+
+Exits non-zero when a target exceeds its budget, so it can gate a deploy:
+  python bench/importtime.py
+  python bench/importtime.py --budget-ms 150 --top 15 app
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# module -> budget in milliseconds; cli and queries must stay free of flask/psycopg2/numpy
+TARGETS = {
+    "cli": 50,
+    "config": 30,
+    "app": 600,
+}
+
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+HEAVY = ("numpy", "qrcode", "PIL", "websockets", "gunicorn", "yaml")
+
+
+def measure(module):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    entries = []
+    for line in proc.stderr.splitlines():
+        m = LINE.match(line)
+        if m:
+            self_us, cumulative_us, indent, name = m.groups()
+            entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    # interpreter startup (site, encodings) is reported too; only count the target
+    total_us = sum(cum for name, _, cum, depth in entries if depth == 0 and name == module)
+    # a package is reported after everything it imported, so its direct
+    # children are the depth-1 lines since the previous top-level line
+    children, pending = [], []
+    for entry in entries:
+        if entry[3] == 1:
+            pending.append(entry)
+        elif entry[3] == 0:
+            if entry[0] == module:
+                children.extend(pending)
+            pending = []
+    return total_us / 1000.0, entries, children
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Check import time of the ujian entry points")
+    p.add_argument("modules", nargs="*", help="modules to measure (default: %s)" % ", ".join(TARGETS))
+    p.add_argument("--budget-ms", type=float, help="one budget for every module instead of the defaults")
+    p.add_argument("--top", type=int, default=10, help="slowest direct imports to list")
+    args = p.parse_args(argv)
+
+    failed = False
+    for module in args.modules or TARGETS:
+        budget = args.budget_ms or TARGETS.get(module, 500)
+        try:
+            total_ms, entries, children = measure(module)
+        except RuntimeError as e:
+            print(e)
+            failed = True
+            continue
+        heavy = sorted({name.split(".")[0] for name, _, _, _ in entries} & set(HEAVY))
+        status = "ok" if total_ms <= budget else "OVER BUDGET"
+        failed |= total_ms > budget
+        print(f"{module}: {total_ms:.1f} ms (budget {budget:.0f} ms) {status}")
+        if heavy:
+            print(f"  heavy imports pulled in: {', '.join(heavy)}")
+        top = sorted(children, key=lambda e: e[2], reverse=True)[:args.top]
+        for name, _, cumulative, _ in top:
+            print(f"  {cumulative / 1000.0:8.1f} ms  {name}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Per-request latency of the queries.py statements, plain vs prepared.
+
+Runs every read-only registry statement `--rounds` times on one direct
+connection, first as plain SQL (parsed and planned on every call, as before
+the registry) and then by name after PREPARE, and prints per-call latency
+percentiles in microseconds. Parameters are sampled from the live tables so
+the plans match what the routes see; statements that write are skipped.
+
+Usage (from the ujian directory):
+  python bench/prepared.py --rounds 5000
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# the ujian package root holds config.py/queries.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import psycopg2
+from config import DB
+from queries import STATEMENTS, STUDENT_NAME, SESSION_GRADE, SESSION_ACTIVE, FORMS_BY_GRADE, TEACHER_NAME, TOKEN_VALIDATE
+
+
+def sample_params(cur):
+    cur.execute("SELECT nis, COALESCE(NULLIF(grade, ''), class) FROM students LIMIT 1")
+    nis, grade = cur.fetchone() or ("0", "10")
+    cur.execute("SELECT session_hash, nis FROM sessions ORDER BY started_at DESC LIMIT 1")
+    session_hash, session_nis = cur.fetchone() or ("missing", nis)
+    cur.execute("SELECT id FROM teachers LIMIT 1")
+    teacher = (cur.fetchone() or (1,))[0]
+    cur.execute("SELECT token FROM tokens LIMIT 1")
+    token = (cur.fetchone() or ("XXXXX",))[0]
+    return {
+        STUDENT_NAME: (nis,),
+        SESSION_GRADE: (session_hash, session_nis),
+        SESSION_ACTIVE: (session_hash,),
+        FORMS_BY_GRADE: (grade,),
+        TEACHER_NAME: (teacher,),
+        TOKEN_VALIDATE: ("teacher", token),
+    }
+
+
+def timed(cur, sql, params, rounds):
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return {
+        "p50": samples[len(samples) // 2],
+        "p95": samples[int(len(samples) * 0.95)],
+        "mean": statistics.fmean(samples),
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--rounds", type=int, default=2000)
+    args = p.parse_args(argv)
+
+    conn = psycopg2.connect(**DB)
+    conn.autocommit = True
+    cur = conn.cursor()
+    params = sample_params(cur)
+
+    print("%-16s %10s %10s %10s %10s %8s" % ("statement", "plain p50", "prep p50", "plain p95", "prep p95", "gain"))
+    for name, args_ in params.items():
+        st = STATEMENTS[name]
+        timed(cur, st.sql, args_, 50)  # warm caches before measuring
+        plain = timed(cur, st.sql, args_, args.rounds)
+        cur.execute(st.prepare_sql)
+        prepared = timed(cur, st.execute_sql, args_, args.rounds)
+        cur.execute("DEALLOCATE %s" % name)
+        print("%-16s %10.1f %10.1f %10.1f %10.1f %7.1f%%" % (
+            name, plain["p50"], prepared["p50"], plain["p95"], prepared["p95"],
+            100.0 * (plain["mean"] - prepared["mean"]) / plain["mean"],
+        ))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
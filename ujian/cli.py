@@ -1,11 +1,20 @@
 def run_server():
     from app import create_app
     create_app().run(host="0.0.0.0", port=5000, debug=False)
+def serveProduction(workers=None, bind=None):
+
+    from server import serve
+
+    serve(workers=workers, bind=bind)
+def reloadServer():
+
+    from server import reload_server
+
+    return {"reloaded": reload_server()}
 def initStudents():
     
     from config import STUDENTSJSON
-    from db import getDB, putDB
-    import os
+    from students import iter_roster, load_students
     from pathlib import Path
 
     src = Path(STUDENTSJSON)
@@ -16,31 +25,13 @@ def initStudents():
     with src.open("r", encoding="utf-8") as f:
         students_data = json.load(f)
 
-    conn = getDB()
-    inserted = 0
-    try:
-        with conn:
-            with conn.cursor() as cur:
-                for student in students_data:
-                    try:
-                        sid = student.get("student_id") or student.get("nis") or student.get("id")
-                        name = student.get("name") or student.get("nama") or ""
-                        grade = student.get("grade") or None
-                        class_ = student.get("class") or None
-                        if sid is None:
-                            logger.warning("Skipping student with no id: %s", student)
-                            continue
-                        cur.execute(
-                            "INSERT INTO students (nis, name, grade, class) VALUES (%s, %s, %s, %s) ON CONFLICT (nis) DO NOTHING",
-                            (sid, name, grade, class_),
-                        )
-                        inserted += cur.rowcount
-                    except Exception:
-                        logger.exception("Failed to insert student record: %s", student)
-                        continue
-    finally:
-        putDB(conn)
-    return {"inserted": inserted, "total": len(students_data)}
+    return load_students(iter_roster(students_data))
+def importSiswa(path):
+
+    from data.studentimporter.extract_siswa import iter_students
+    from students import iter_roster, load_students
+
+    return load_students(iter_roster(iter_students(path)))
 def initTeachers():
     
     from config import SCHOOLJSON
@@ -82,77 +73,149 @@ def initTeachers():
     finally:
         putDB(conn)
     return {"inserted": inserted, "total": len(data["guru"])}
-def generateRoutes():
+def generateRoutes(qr=True):
     
     from config import ROUTESJSON, ROOT, FULL_PREFIX
-    import qrcode, os, uuid
+    import os, uuid
     
     studenturl = '/' + uuid.uuid4().hex[:8]
     teacherurl = '/' + uuid.uuid4().hex[:8]
 
-    with open(ROUTESJSON, "r") as f:
-        routes = json.load(f)
-    
-    # ensure qrcode output directory exists
-    qr_dir = os.path.join(ROOT, 'data', 'qrcodes')
-    os.makedirs(qr_dir, exist_ok=True)
-
-    studentimg = qrcode.make(FULL_PREFIX + routes['student_prefix'])
-    student_path = os.path.join(qr_dir, 'student_qr.png')
-    with open(student_path, "wb") as f:
-        studentimg.save(f)
-
-    teacherimg = qrcode.make(FULL_PREFIX + routes['teacher_prefix'])
-    teacher_path = os.path.join(qr_dir, 'teacher_qr.png')
-    with open(teacher_path, "wb") as f:
-        teacherimg.save(f)
-        
     with open(ROUTESJSON, "w") as f:
         json.dump({
             "student": studenturl,
             "teacher": teacherurl
         }, f, indent=2)
 
-    return {
+    result = {
         'student_url': studenturl,
         'teacher_url': teacherurl
     }
+    if not qr:
+        return result
+
+    # qrcode (and PIL behind it) is only imported when codes are wanted
+    import qrcode
+
+    # ensure qrcode output directory exists
+    qr_dir = os.path.join(ROOT, 'data', 'qrcodes')
+    os.makedirs(qr_dir, exist_ok=True)
+
+    for role, url in (("student", studenturl), ("teacher", teacherurl)):
+        path = os.path.join(qr_dir, f'{role}_qr.png')
+        with open(path, "wb") as f:
+            qrcode.make(FULL_PREFIX + url).save(f)
+        result[f'{role}_qr'] = path
+    return result
+def runHub():
+
+    from hub import run_hub
+
+    run_hub()
+def runStateServer(host=None, port=None):
+
+    from state_server import run_state_server
+    from config import STATE_SERVER_HOST, STATE_SERVER_PORT
+
+    run_state_server(host or STATE_SERVER_HOST, port or STATE_SERVER_PORT)
+def runJanitor(loop=False):
+
+    from janitor import janitor
+    import time
+
+    if not loop:
+        return janitor.run_once()
+    while True:
+        logger.info("janitor: %s", janitor.run_once())
+        time.sleep(janitor.interval)
+def publishForm(path, grade=None, subject=None):
+
+    from forms import publish_form
+
+    with open(path, "r", encoding="utf-8") as f:
+        form = json.load(f)
+    if "items" in form:
+        # raw Google Forms export, convert it first
+        from formexporter.converter import transform_form_json
+        form = transform_form_json(form)
+    return publish_form(form, grade=grade, subject=subject)
+def regradeExam(subject, grade):
+
+    from results import regrade
+
+    return regrade(subject, grade)
 
 import argparse, json, sys, logging
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-parser = argparse.ArgumentParser(prog="hiraform", description="Hira Form System CLI")
-sub = parser.add_subparsers(dest="cmd", required=True)
-
-p_students = sub.add_parser("init-students", help="Initialize students from JSON files")
-p_teachers = sub.add_parser("init-teachers", help="Initialize teachers from JSON files")
-p_run_server = sub.add_parser("run-server", help="Run the Flask development server for debugging")
-p_generate_routes = sub.add_parser("generate-routes", help="Generate new random routes for student and teacher access")
-
-args = parser.parse_args()
-
-setup_actions = {
-    "init-students": initStudents,
-    "run-server": run_server,
-    "init-teachers": initTeachers,
-    "generate-routes": generateRoutes,
-}
-
-func = setup_actions.get(args.cmd)
-if not func:
-    parser.print_help()
-    sys.exit(1)
-
-try:
-    result = func()
-    if isinstance(result, tuple):
-        ok, val = result
-        print(json.dumps({"ok": ok, "result": val}, indent=2))
-    else:
-        print(json.dumps({"ok": True, "result": result}, indent=2))
-except Exception as e:
-    logger.exception("CLI execution failed")
-    print(json.dumps({"ok": False, "error": str(e)}))
-    sys.exit(1)
\ No newline at end of file
+
+def main(argv=None):
+    # parsing happens here, not at import, so importing cli stays side-effect free
+    from metrics import setup_logging
+    setup_logging()
+    parser = argparse.ArgumentParser(prog="hiraform", description="Hira Form System CLI")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_students = sub.add_parser("init-students", help="Initialize students from JSON files")
+    p_import_siswa = sub.add_parser("import-siswa", help="Stream students from the school's SpreadsheetML export into the database")
+    p_import_siswa.add_argument("xml")
+    p_teachers = sub.add_parser("init-teachers", help="Initialize teachers from JSON files")
+    p_run_server = sub.add_parser("run-server", help="Run the Flask development server for debugging")
+    p_serve = sub.add_parser("serve", help="Run the app under gunicorn with SERVER_WORKERS workers (production)")
+    p_serve.add_argument("--workers", type=int, help="override SERVER_WORKERS")
+    p_serve.add_argument("--bind", help="override SERVER_HOST:SERVER_PORT")
+    p_reload_server = sub.add_parser("reload-server", help="Gracefully reload the workers of a running 'serve' master")
+    p_generate_routes = sub.add_parser("generate-routes", help="Generate new random routes for student and teacher access")
+    p_generate_routes.add_argument("--no-qr", dest="qr", action="store_false", help="only rewrite route.json, skip the QR images")
+    p_run_hub = sub.add_parser("run-hub", help="Run the real-time proctoring WebSocket hub")
+    p_state_server = sub.add_parser("run-state-server", help="Run the in-memory Redis stand-in that shares session, token and hub state between nodes on one machine")
+    p_state_server.add_argument("--host", help="override STATE_SERVER_HOST")
+    p_state_server.add_argument("--port", type=int, help="override STATE_SERVER_PORT")
+    p_janitor = sub.add_parser("janitor", help="Delete expired tokens and archive finished sessions in bounded batches")
+    p_janitor.add_argument("--loop", action="store_true", help="keep running every JANITOR_INTERVAL seconds")
+    p_publish_form = sub.add_parser("publish-form", help="Validate a form JSON (examtmp.json layout or raw Google Forms) and publish it as a new version")
+    p_publish_form.add_argument("path")
+    p_publish_form.add_argument("--grade", help="defaults to the form's 'kelas'")
+    p_publish_form.add_argument("--subject", help="defaults to the form's name")
+    p_regrade = sub.add_parser("regrade", help="Re-score every finished student of a subject/grade against the current form")
+    p_regrade.add_argument("subject")
+    p_regrade.add_argument("grade")
+
+    args = parser.parse_args(argv)
+
+    setup_actions = {
+        "init-students": initStudents,
+        "import-siswa": lambda: importSiswa(args.xml),
+        "run-server": run_server,
+        "serve": lambda: serveProduction(args.workers, args.bind),
+        "reload-server": reloadServer,
+        "init-teachers": initTeachers,
+        "generate-routes": lambda: generateRoutes(args.qr),
+        "run-hub": runHub,
+        "run-state-server": lambda: runStateServer(args.host, args.port),
+        "janitor": lambda: runJanitor(args.loop),
+        "publish-form": lambda: publishForm(args.path, args.grade, args.subject),
+        "regrade": lambda: regradeExam(args.subject, args.grade),
+    }
+
+    func = setup_actions.get(args.cmd)
+    if not func:
+        parser.print_help()
+        sys.exit(1)
+
+    try:
+        result = func()
+        if isinstance(result, tuple):
+            ok, val = result
+            print(json.dumps({"ok": ok, "result": val}, indent=2))
+        else:
+            print(json.dumps({"ok": True, "result": result}, indent=2))
+    except Exception as e:
+        logger.exception("CLI execution failed")
+        print(json.dumps({"ok": False, "error": str(e)}))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
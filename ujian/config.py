@@ -29,19 +29,100 @@ DB_NAME = "ujian_sman2cikpus"
 DB_USER = "ujian_sman2cikpus"
 DB_PASSWORD = "sman2cikarangpusat@paknanang"
 DB_PORT = 5432
+DB_CONNECT_TIMEOUT = 5  # seconds; an unreachable server fails fast instead of hanging boot
 DB = {
     "dbname": DB_NAME,
     "user": DB_USER,
     "password": DB_PASSWORD,
-    "host": DB_HOST
+    "host": DB_HOST,
+    "connect_timeout": DB_CONNECT_TIMEOUT
 }
 
+# connection pool
+DB_POOL_MIN = 2            # connections opened up front by init_pool()
+DB_POOL_MAX = 50           # per process, lowered by db.pool_max() to fit DB_CONNECTION_BUDGET
+DB_CONNECTION_BUDGET = 80  # connections all app workers of this node may hold together (pools plus LISTEN);
+                           # keep it below Postgres max_connections (default 100) minus the hub, janitor and psql
+DB_POOL_TIMEOUT = 10       # seconds a request waits for a free connection
+DB_CONN_MAX_AGE = 1800     # seconds before a connection is recycled
+DB_CONN_VALIDATE_IDLE = 30 # idle seconds after which a connection is pinged on checkout
+DB_SLOW_QUERY = 0.5        # seconds; slower statements are logged
+DB_QUERY_STATS_SIZE = 200  # distinct statements tracked by pool_stats()
+DB_QUERY_HEADER = True     # X-DB-Queries response header: statements run by the request (bench/examday.py)
+DB_PREPARE = True          # PREPARE the queries.py statements per connection; off behind pgbouncer transaction pooling
+
+# form cache
+FORM_CACHE_TTL = 30  # seconds, only used while LISTEN/NOTIFY is unavailable
+FORM_CACHE_LISTEN = True
+
+# answer autosave
+ANSWER_FLUSH_INTERVAL = 1.0  # seconds between batched answer writes
+ANSWER_FLUSH_BATCH = 2000    # flush early once this many answers are queued
+SESSION_CACHE_TTL = 60       # seconds an active session lookup is trusted
+VIOLATION_FLUSH_INTERVAL = 1.0  # seconds between coalesced violation writes
+
+# teacher dashboard
+DASHBOARD_CACHE_TTL = 2  # seconds; concurrent polls share one rollup read
+ROSTER_CACHE_TTL = 300   # seconds; class sizes and subject/grade pairs
+
+# token validation
+TOKEN_CACHE_TTL = 10      # seconds a validated token is trusted
+TOKEN_NEGATIVE_TTL = 5    # seconds an unknown token is remembered as invalid
+TOKEN_MISS_RATE = 50      # uncached token lookups allowed per second per client address, per process
+TOKEN_MISS_CLIENTS = 10000  # client addresses whose rate-limit buckets are remembered
+
+# maintenance
+JANITOR_INTERVAL = 300        # seconds between runs, 0 disables the in-app janitor
+JANITOR_BATCH = 500           # rows per delete/archive transaction
+JANITOR_BATCH_PAUSE = 0.05    # seconds between batches
+JANITOR_SESSION_GRACE = 3600  # finished sessions are kept this long before archiving
+
+# proctoring hub
+HUB_HOST = "0.0.0.0"
+HUB_PORT = 5001
+BAN_THRESHOLD = 1         # violations before a student is banned
+HUB_FLUSH_INTERVAL = 1.0  # seconds between write-behind batches
+
+# shared state (state.py): session markers, token cache and hub events across nodes
+STATE_URL = "local"         # "local" for one process, or "redis://host:port/db" (Redis or cli.py run-state-server)
+STATE_PREFIX = "hiraexam:"  # prefix of every key and channel, so deployments can share a server
+STATE_TIMEOUT = 2.0         # seconds to connect or wait for a reply
+STATE_LOCAL_SIZE = 100000   # entries kept by the local backend
+STATE_SERVER_HOST = "127.0.0.1"
+STATE_SERVER_PORT = 6379
+
+# live proctor stream
+EVENT_QUEUE_SIZE = 256  # undelivered events per client before it is told to resync
+EVENT_HEARTBEAT = 15    # seconds between keepalive comments on idle streams
+
 # logging
-LOG_FILE = USERDATA / "logs" / "app.log"
+LOG_FILE = USERDATA / "logs" / "app.log"  # shared by every process; rotate it externally (logrotate), never copytruncate
 LOG_LEVEL = "INFO"
 
+# admin endpoints (/metrics, /adminspoolstats): they expose SQL text and pool internals
+ADMIN_TOKEN = None                 # "Authorization: Bearer <token>" admits a request from anywhere
+ADMIN_ALLOW = ("127.0.0.1", "::1")  # addresses admitted without a token, unless the request came through a proxy
+
+# request metrics and profiling (metrics.py, served on /metrics)
+SLOW_REQUEST = 1.0                    # seconds; slower requests are logged with their pool/db/json split
+PROFILE_SAMPLE = 0.0                  # fraction of requests run under the profiler, 0 disables it
+PROFILER = "cprofile"                 # or "pyinstrument" when it is installed
+PROFILE_DIR = USERDATA / "profiles"   # profiles of sampled requests slower than SLOW_REQUEST
+PROFILE_KEEP = 50                     # newest profiles kept
+
 # exam flags
 ONGOING_EXAM = True
+EXAM_DURATION = 90 * 60  # seconds a session lasts; logins and resumes report what is left of it
+
+# exam schedule (schedule.py, data/exam/schedule.json)
+SCHEDULE_ENFORCE = True       # admit only subjects whose slot is open; a schedule without dates admits everything
+SCHEDULE_DAYS = []            # dates of day 1, 2, ... ("2025-12-01"), for days without their own "date"
+SCHEDULE_SLOTS = {1: "07:30", 2: "10:00", 3: "13:00"}  # slot ("count") start times, WIB
+SCHEDULE_OPEN_EARLY = 600     # seconds before a slot starts that its students may log in
+SCHEDULE_CLOSE_LATE = 600     # seconds after EXAM_DURATION that late sessions may still load the form
+SCHEDULE_PREWARM = 300        # seconds before a slot opens that its forms, answer keys and connections are warmed
+SCHEDULE_PREWARM_POOL = 20    # connections opened ahead of a slot
+SCHEDULE_RELOAD = 60          # seconds between schedule.json change checks and prewarm runs, 0 disables the thread
 
 # routes
 FULL_PREFIX = "https://ujian.sman2cikpus.sch.id"
@@ -50,3 +131,14 @@ FULL_PREFIX = "https://ujian.sman2cikpus.sch.id"
 SECRET_KEY = "movingforbrightfuture"
 SERVER_HOST = "0.0.0.0"
 SERVER_PORT = 5000
+
+# production server (cli.py serve)
+SERVER_WORKERS = 4                # processes; each has its own DB pool, sized by db.pool_max()
+SERVER_WORKER_CLASS = "gevent"    # "sync" or "gthread" when gevent is not installed
+SERVER_WORKER_CONNECTIONS = 1000  # concurrent clients per gevent worker (SSE streams included)
+SERVER_THREADS = 8                # per worker, gthread only
+SERVER_TIMEOUT = 60               # seconds before a silent worker is restarted
+SERVER_GRACEFUL_TIMEOUT = 30      # seconds workers get to finish requests on reload/stop
+SERVER_KEEPALIVE = 5
+SERVER_MAX_REQUESTS = 0           # recycle workers after this many requests, 0 never
+SERVER_PIDFILE = USERDATA / "server.pid"
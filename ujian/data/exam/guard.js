@@ -3,13 +3,41 @@ let sessionLocked = false;
 // ======================
 // Utility: Send Violation
 // ======================
+// Events are buffered and reported in batches to the exam blueprint's
+// ./violations endpoint; sendBeacon survives the page being closed.
+const violationBuffer = [];
+let violationTimer = null;
+
+function flushViolations() {
+    violationTimer = null;
+    if (!violationBuffer.length) return;
+    const body = JSON.stringify({
+        hash: localStorage.getItem('student-hash'),
+        nis: localStorage.getItem('student-nis'),
+        events: violationBuffer.splice(0)
+    });
+    if (!(navigator.sendBeacon && navigator.sendBeacon('./violations', body))) {
+        fetch('./violations', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body, keepalive: true })
+            .catch(() => {});
+    }
+}
+
+function reportViolation(eventType) {
+    violationBuffer.push({ type: eventType, ts: Date.now() });
+    if (!violationTimer) violationTimer = setTimeout(flushViolations, 1000);
+}
+window.addEventListener('pagehide', flushViolations);
+
 function sendViolation(eventType) {
     if (sessionLocked) return; // stop further calls
     sessionLocked = true;
 
-    // --- Implement your server reporting logic here ---
-    // e.g., WebSocket or fetch API
-    // fetch('/api/violation', { ... })
+    reportViolation(eventType);
+    flushViolations();  // the session is locked now, report right away
+    // let the proctoring hub ban/notify in real time
+    if (typeof ws !== 'undefined' && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({action: 'violation', reason: eventType, timestamp: Date.now()}));
+    }
 
     lockExam();       // lock UI immediately
     removeAllHandlers(); // stop all detection
@@ -130,8 +158,14 @@ window.addEventListener('load', () => {
 
 
 
-// Create a WebSocket connection to your server
-const ws = new WebSocket('wss://yourserver.example/ws?sessionId=' + sessionId);
+// Connect to the proctoring hub (ujian/hub.py, `cli.py run-hub`); the page
+// carries HUB_PORT in <meta name="hub-port">, without it the page's own port is used
+const hubPortMeta = document.querySelector('meta[name="hub-port"]');
+const hubPort = hubPortMeta ? hubPortMeta.content : location.port;
+const hubUrl = (location.protocol === 'https:' ? 'wss://' : 'ws://') + location.hostname + (hubPort ? ':' + hubPort : '') + '/'
+    + '?hash=' + encodeURIComponent(localStorage.getItem('student-hash') || '')
+    + '&nis=' + encodeURIComponent(localStorage.getItem('student-nis') || '');
+const ws = new WebSocket(hubUrl);
 
 // Connection opened
 ws.addEventListener('open', () => {
@@ -168,23 +202,3 @@ ws.addEventListener('message', (event) => {
 ws.addEventListener('close', () => {
     setTimeout(() => location.reload(), 3000); // simple reconnect
 });
-
-// Send client events to server
-function sendViolation(eventType) {
-    if (sessionLocked) return;
-    sessionLocked = true;
-    lockExam('Violation detected');
-
-    // Send violation to server
-    if (ws.readyState === WebSocket.OPEN) {
-        ws.send(JSON.stringify({userId, sessionId, eventType, timestamp: Date.now()}));
-    }
-
-    removeAllHandlers();
-}
-
-
-
-
-
-
@@ -1,71 +1,99 @@
-import xml.etree.ElementTree as ET
-import json
-
-"""
-school provides -> manual extract -> python process -> json -> sql
-"""
-
-XML_PATH = r"siswa sman2cikarangpusat.xml"
-OUT_PATH = r"siswa_sman2cikarangpusat.json"
-
-# Namespace used in the file for ss: attributes
-SS_NS = 'urn:schemas-microsoft-com:office:spreadsheet'
-TYPE_KEY = '{' + SS_NS + '}Type'
-
-# Parse and gather Data elements in document order
-tree = ET.parse(XML_PATH)
-datas = tree.findall('.//{{{ns}}}Data'.format(ns=SS_NS))
-
-records = []
-i = 0
-while i < len(datas):
-    t = datas[i].attrib.get(TYPE_KEY)
-    if t == 'Number':
-        num = datas[i].text.strip() if datas[i].text else ''
-        # search forward for the next String Data element
-        j = i + 1
-        while j < len(datas):
-            t2 = datas[j].attrib.get(TYPE_KEY)
-            if t2 == 'String':
-                name = datas[j].text.strip() if datas[j].text else ''
-                try:
-                    idv = int(num)
-                except Exception:
-                    idv = num
-                # Build id as a string for output, but keep numeric value for sorting
-                id_str = str(idv)
-                # Extract grade and class from the id string when possible
-                grade = id_str[:2] if len(id_str) >= 2 else ''
-                class_ = id_str[2:4] if len(id_str) >= 4 else ''
-                # Store a temporary numeric value to keep numeric sorting stable
-                records.append({"grade": grade, "class": class_, "id": id_str, "name": name, "_num": idv if isinstance(idv, int) else None})
-                i = j
-                break
-            j += 1
-    i += 1
-
-# Sort records: numeric IDs first (ascending), then any non-numeric IDs
-def _sort_key(rec):
-    # Prefer numeric sort when available (we kept a temporary _num key)
-    num = rec.get('_num')
-    if isinstance(num, int):
-        return (0, num)
-    # fallback: sort by id string
-    return (1, str(rec.get('id')))
-
-records.sort(key=_sort_key)
-
-# Remove internal helper keys before writing
-cleaned = []
-for rec in records:
-    rec_copy = {k: v for k, v in rec.items() if k != '_num'}
-    cleaned.append(rec_copy)
-
-# Write JSON
-with open(OUT_PATH, 'w', encoding='utf-8') as f:
-    json.dump(cleaned, f, ensure_ascii=False, indent=2)
-
-print(f"Wrote {len(cleaned)} records to {OUT_PATH}")
-# print a small preview
-for r in cleaned[:10]:
-    print(r)
+import xml.etree.ElementTree as ET
+import argparse
+import json
+import sys
+from pathlib import Path
+
+"""
+school provides -> manual extract -> python process -> sql
+
+The school's Excel export is SpreadsheetML (Excel 2003 XML). iter_students()
+streams it with iterparse, one <Row> at a time, and drops every row once it
+has been read, so memory stays flat however many sheets/years the export
+holds. Every Number cell (the student id) is paired with the next String
+cell in the same row (the name); a row carries one pair per class column.
+
+Usage:
+  python extract_siswa.py "siswa sman2cikarangpusat.xml" --load
+  python extract_siswa.py "siswa sman2cikarangpusat.xml" --json siswa_sman2cikarangpusat.json
+"""
+
+XML_PATH = r"siswa sman2cikarangpusat.xml"
+OUT_PATH = r"siswa_sman2cikarangpusat.json"
+
+# Namespace used in the file for ss: attributes
+SS_NS = 'urn:schemas-microsoft-com:office:spreadsheet'
+TYPE_KEY = '{' + SS_NS + '}Type'
+ROW_TAG = '{' + SS_NS + '}Row'
+TABLE_TAG = '{' + SS_NS + '}Table'
+DATA_TAG = '{' + SS_NS + '}Data'
+
+
+def _record(num, name):
+    try:
+        id_str = str(int(num))
+    except ValueError:
+        id_str = num
+    # Extract grade and class from the id string when possible
+    grade = id_str[:2] if len(id_str) >= 2 else ''
+    class_ = id_str[2:4] if len(id_str) >= 4 else ''
+    return {"grade": grade, "class": class_, "id": id_str, "name": name}
+
+
+def iter_students(path):
+    """Yield {"grade", "class", "id", "name"} for every student row in the export."""
+    table = None
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if elem.tag == TABLE_TAG:
+                table = elem
+            continue
+        if elem.tag != ROW_TAG:
+            continue
+        # a row holds one (Number id, String name) pair per class column
+        num = None
+        for data in elem.iter(DATA_TAG):
+            text = data.text.strip() if data.text else ''
+            kind = data.get(TYPE_KEY)
+            if kind == 'Number':
+                num = text
+            elif kind == 'String' and num:
+                yield _record(num, text)
+                num = None
+        # rows are finished once their end tag is seen; drop them
+        elem.clear()
+        if table is not None:
+            table.clear()
+
+
+def write_json(records, out_path):
+    """Stream records to a JSON array without holding them in memory."""
+    count = 0
+    with open(out_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for rec in records:
+            f.write((',\n  ' if count else '\n  ') + json.dumps(rec, ensure_ascii=False))
+            count += 1
+        f.write('\n]\n')
+    return count
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Import students from a SpreadsheetML export")
+    p.add_argument('xml', nargs='?', default=XML_PATH, help='path to the Excel XML export')
+    p.add_argument('--json', dest='json_out', help='write the records to a JSON file')
+    p.add_argument('--load', action='store_true', help='upsert the records straight into the students table')
+    args = p.parse_args(argv)
+
+    if args.load:
+        # the ujian package root holds db.py/students.py
+        sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+        from students import iter_roster, load_students
+        print(json.dumps(load_students(iter_roster(iter_students(args.xml))), indent=2))
+    else:
+        count = write_json(iter_students(args.xml), args.json_out or OUT_PATH)
+        print(f"Wrote {count} records to {args.json_out or OUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,378 @@
 
 import os
-import yaml
+import bisect
 import logging
+import threading
+import time
+from collections import deque
+import psycopg2
+import psycopg2.extensions
 from psycopg2 import pool
 from contextlib import contextmanager
-from config import DB
+from config import (DB, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_CONN_MAX_AGE,
+                    DB_CONN_VALIDATE_IDLE, DB_SLOW_QUERY, DB_QUERY_STATS_SIZE, DB_CONNECTION_BUDGET)
+from queries import prepare_connection
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# checkout wait buckets, seconds (the last bucket is everything slower)
+CHECKOUT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
 
 
-try:  # create DB pool
-    dbPool = pool.ThreadedConnectionPool(1, 50, **DB)
-except Exception:
-    logger.exception("Failed to create DB connection pool")
+class PoolTimeout(pool.PoolError):
+    """No connection became free within the checkout timeout."""
+
+
+class QueryStats:
+    """Per-statement call count and timings, keyed by the statement's leading text."""
+
+    def __init__(self, maxsize=DB_QUERY_STATS_SIZE, slow=DB_SLOW_QUERY):
+        self.maxsize = maxsize
+        self.slow = slow
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._request = threading.local()
+
+    @staticmethod
+    def key(query):
+        if isinstance(query, bytes):
+            query = query[:400].decode("utf-8", "replace")
+        # execute_values/literal batches differ only after the statement head
+        return " ".join(str(query).split())[:80]
+
+    def record(self, query, elapsed):
+        key = self.key(query)
+        if elapsed >= self.slow:
+            logger.warning("Slow query (%.3fs): %s", elapsed, key)
+        with self._lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                if len(self._stats) >= self.maxsize:
+                    return
+                entry = self._stats[key] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] = max(entry[2], elapsed)
+        request = self._request.__dict__.get("totals")
+        if request is not None:
+            request["queries"] += 1
+            request["db"] += elapsed
+
+    def record_wait(self, waited):
+        request = self._request.__dict__.get("totals")
+        if request is not None:
+            request["pool"] += waited
+
+    def begin_request(self):
+        """Start totalling the statements, DB time and pool waits of the current thread (one request)."""
+        self._request.totals = {"queries": 0, "db": 0.0, "pool": 0.0}
+
+    def end_request(self):
+        """{"queries", "db", "pool"} since begin_request(), or None when not counting."""
+        return self._request.__dict__.pop("totals", None)
+
+    def snapshot(self):
+        with self._lock:
+            items = [(k, v[0], v[1], v[2]) for k, v in self._stats.items()]
+        items.sort(key=lambda item: item[2], reverse=True)
+        return [
+            {"query": k, "calls": n, "total": round(total, 4), "mean": round(total / n, 5), "max": round(worst, 4)}
+            for k, n, total, worst in items
+        ]
+
+
+query_stats = QueryStats()
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            query_stats.record(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            query_stats.record(query, time.perf_counter() - started)
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that remembers which registry statements (queries.py) it has prepared."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.prepare_failed = set()
+
+
+class ManagedPool:
+    """Thread-safe connection pool that waits instead of failing when exhausted.
+
+    Connections are opened lazily up to maxconn (prewarm() opens minconn up
+    front), recycled after max_age seconds, pinged on checkout when they sat
+    idle for longer than validate_idle seconds, and rolled back on return so
+    no transaction leaks into the next borrower.
+    """
+
+    def __init__(self, dsn, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 max_age=DB_CONN_MAX_AGE, validate_idle=DB_CONN_VALIDATE_IDLE):
+        self._dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_age = max_age
+        self.validate_idle = validate_idle
+        self._idle = deque()   # (conn, created_at, returned_at), most recently used on the right
+        self._born = {}        # id(conn) -> created_at for checked-out connections
+        self._size = 0         # open connections plus ones being opened
+        self._waiters = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._histogram = [0] * (len(CHECKOUT_BUCKETS) + 1)
+        self.stats = {"checkouts": 0, "timeouts": 0, "created": 0, "recycled": 0, "broken": 0, "wait_total": 0.0}
+
+    # ---- connections
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(connection_factory=PooledConnection, cursor_factory=TimedCursor, **self._dsn)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self.stats["created"] += 1
+        return conn, time.monotonic()
+
+    def _discard(self, conn, reason):
+        self.stats[reason] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _usable(self, conn, created_at, returned_at):
+        now = time.monotonic()
+        if conn.closed:
+            self._discard(conn, "broken")
+            return False
+        if now - created_at > self.max_age:
+            self._discard(conn, "recycled")
+            return False
+        if now - returned_at > self.validate_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                self._discard(conn, "broken")
+                return False
+        return True
+
+    # ---- pool API
+
+    def getconn(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise pool.PoolError("connection pool is closed")
+                item = None
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        raise PoolTimeout("no database connection free after %.1fs" % timeout)
+                    self._waiters += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiters -= 1
+                    if self._closed:
+                        raise pool.PoolError("connection pool is closed")
+                if self._idle:
+                    item = self._idle.pop()
+                else:
+                    self._size += 1  # reserve the slot, connect outside the lock
+            if item is None:
+                conn, created_at = self._connect()
+            elif self._usable(*item):
+                conn, created_at = item[0], item[1]
+            else:
+                continue
+            break
+        waited = time.monotonic() - started
+        query_stats.record_wait(waited)
+        with self._cond:
+            self._born[id(conn)] = created_at
+            self._histogram[bisect.bisect_left(CHECKOUT_BUCKETS, waited)] += 1
+            self.stats["checkouts"] += 1
+            self.stats["wait_total"] += waited
+        return conn
+
+    def putconn(self, conn, close=False):
+        with self._cond:
+            created_at = self._born.pop(id(conn), None)
+        if created_at is None:
+            raise pool.PoolError("trying to put unkeyed connection")
+        if close or conn.closed or self._closed:
+            self._discard(conn, "broken" if conn.closed else "recycled")
+            return
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                self._discard(conn, "broken")
+                return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def prewarm(self, count=None):
+        """Open (and prepare) connections until at least count (default minconn) exist."""
+        count = self.minconn if count is None else min(count, self.maxconn)
+        opened = []
+        try:
+            while True:
+                with self._cond:
+                    if self._size >= count:
+                        break
+                    self._size += 1
+                conn, created_at = self._connect()  # gives its slot back when it fails
+                opened.append((conn, created_at))
+                # a warmed connection also has the registry prepared, like one that served a request
+                prepare_connection(conn)
+        except Exception:
+            # nothing half-warmed stays open or keeps its slot
+            for conn, _ in opened:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            with self._cond:
+                self._size -= len(opened)
+                self._cond.notify(len(opened))
+            raise
+        with self._cond:
+            now = time.monotonic()
+            self._idle.extendleft((conn, created_at, now) for conn, created_at in opened)
+            self._cond.notify(len(opened))
+        return len(opened)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def metrics(self):
+        with self._cond:
+            idle = len(self._idle)
+            in_use = len(self._born)
+            histogram = list(self._histogram)
+            stats = dict(self.stats)
+            waiters = self._waiters
+            size = self._size
+            oldest = min([c for _, c, _ in self._idle] + list(self._born.values()), default=None)
+        buckets, total = {}, 0
+        for bound, n in zip(CHECKOUT_BUCKETS + (float("inf"),), histogram):
+            total += n
+            buckets["+Inf" if bound == float("inf") else str(bound)] = total  # cumulative
+        return {
+            "size": size, "in_use": in_use, "idle": idle, "waiters": waiters,
+            "min": self.minconn, "max": self.maxconn,
+            "oldest_connection_age": round(time.monotonic() - oldest, 1) if oldest is not None else None,
+            "checkout_seconds": buckets,
+            **stats,
+        }
+
+
+# Created on first use in each process, never at import: a pool inherited
+# across fork() would share sockets between the parent and its workers.
+dbPool = None
+_pool_closed = False
+_pool_lock = threading.Lock()
+
+
+def _forget_pool_after_fork():
+    # the child must not close the parent's connections, only drop them
+    global dbPool, _pool_closed, _pool_lock
     dbPool = None
+    _pool_closed = False
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_pool_after_fork)
+
+
+# set by server.serve() for its workers; anything else runs as a single process
+WORKERS_ENV = "HIRAEXAM_WORKERS"
+
+
+def pool_max(workers=None):
+    """Pool size per process: DB_POOL_MAX, lowered so that every worker's pool
+    plus its LISTEN connection stays within DB_CONNECTION_BUDGET."""
+    workers = workers or int(os.environ.get(WORKERS_ENV) or 1)
+    return max(1, min(DB_POOL_MAX, DB_CONNECTION_BUDGET // workers - 1))
+
+
+def _ensure_pool():
+    global dbPool
+    if dbPool is None:
+        with _pool_lock:
+            if _pool_closed:
+                raise RuntimeError("DB pool is closed")
+            if dbPool is None:
+                dbPool = ManagedPool(DB, maxconn=pool_max())
+    return dbPool
+
+
+def init_pool(minconn=None, background=False):
+    """Create this process's pool and open the configured minimum of connections.
+
+    Call it once per process after any fork (create_app does, in the
+    background, so a worker boots without waiting on the database).
+    """
+    if background:
+        threading.Thread(target=init_pool, args=(minconn,), name="db-prewarm", daemon=True).start()
+        return 0
+    try:
+        return _ensure_pool().prewarm(minconn)
+    except Exception:
+        logger.exception("Failed to pre-warm DB connection pool")
+        return 0
+
+
+def pool_stats():
+    """Pool gauges, checkout histogram and per-statement timings."""
+    if not dbPool:
+        return {"pool": None, "queries": []}
+    return {"pool": dbPool.metrics(), "queries": query_stats.snapshot()}
 
 
 def getDB():
     """Get a connection from the pool.
 
-    Raises RuntimeError if pool isn't initialized.
+    Waits up to DB_POOL_TIMEOUT seconds for a free connection, then raises
+    PoolTimeout. Raises RuntimeError once the pool has been closed.
     """
-    if not dbPool:
-        raise RuntimeError("DB pool is not initialized")
-    return dbPool.getconn()
+    return _ensure_pool().getconn()
 
 
 def putDB(conn):
@@ -40,7 +387,8 @@ def putDB(conn):
 
 def close_db_pool():
     """Close the connection pool (call at shutdown)."""
-    global dbPool
+    global dbPool, _pool_closed
+    _pool_closed = True
     if not dbPool:
         return
     try:
@@ -60,10 +408,13 @@ def db_cursor(commit: bool = True):
           cur.execute(...)
 
     By default commits at exit when no exception; set commit=False to leave it to caller.
+    Statements run through the cursor are timed into pool_stats(), and the
+    connection has the queries.py statements prepared.
     """
     conn = getDB()
     cur = None
     try:
+        prepare_connection(conn)
         cur = conn.cursor()
         yield conn, cur
         if commit:
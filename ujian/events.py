@@ -0,0 +1,178 @@
+"""
+Live proctor event stream.
+
+Session start/finish and violation rows raise NOTIFY exam_events from
+triggers (schema.sql); the answer flush raises one progress notification per
+session it wrote. notify.listener hands every payload to the module broker,
+which fans it out to the Server-Sent Events streams subscribed to that room.
+An idle proctor page is one open response and no database work; the only
+query per connection is the initial room snapshot.
+
+Payloads are JSON objects with "type" (start, finish, violation, progress)
+and "room" (the student's class). After a listener reconnect, or when a slow
+client's queue overflows, the stream sends a fresh snapshot in place of the
+deltas it may have missed.
+"""
+
+import json
+import logging
+import queue
+import threading
+
+from config import EVENT_QUEUE_SIZE, EVENT_HEARTBEAT
+from db import db_cursor
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "exam_events"
+ALL_ROOMS = "*"
+RESET = {"type": "reset"}
+
+# DONE means finished one of the subjects being examined now (each a
+# primary-key probe on exam_results); the room and '*' variants are separate
+# statements so the room one can use students_class. Answered counts the keys
+# of the sessions.answers snapshot, as the progress events do (answers.py).
+SNAPSHOT_SQL = """
+SELECT st.nis, st.name, st.class, coalesce(s.subject, r.subject), s.started_at,
+       (SELECT count(*) FROM jsonb_object_keys(s.answers)) AS answered, v.violations,
+       CASE WHEN s.nis IS NOT NULL THEN 'EXAM'
+            WHEN r.finished_at IS NOT NULL THEN 'DONE'
+            ELSE 'ABSENT' END
+FROM students st
+LEFT JOIN sessions s ON s.nis = st.nis AND s.active = TRUE
+LEFT JOIN LATERAL (
+    SELECT subject, finished_at FROM exam_results
+    WHERE subject = ANY(%(subjects)s) AND nis = st.nis AND finished_at IS NOT NULL
+    ORDER BY finished_at DESC LIMIT 1
+) r ON s.nis IS NULL
+LEFT JOIN LATERAL (
+    SELECT sum(occurrences) AS violations FROM violations WHERE session_hash = s.session_hash
+) v ON TRUE
+{where}
+ORDER BY st.class, st.nis
+"""
+ROOM_SNAPSHOT_SQL = SNAPSHOT_SQL.format(where="WHERE st.class = %(room)s")
+ALL_SNAPSHOT_SQL = SNAPSHOT_SQL.format(where="")
+
+
+def _current_subjects():
+    """Subjects whose slot is open now; with none open (or no timetable), every subject with a form."""
+    from results import subject_grades
+    from schedule import timetable
+
+    open_now = {slot.subject for slot in timetable.upcoming(0)}
+    return sorted(open_now or subject_grades())
+
+
+class Subscription:
+    def __init__(self, room, maxsize=EVENT_QUEUE_SIZE):
+        self.room = room
+        self.queue = queue.Queue(maxsize)
+        self.lagged = False
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # the client will reload the snapshot instead
+            self.lagged = True
+
+    def get(self, timeout):
+        if self.lagged:
+            self.lagged = False
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            return RESET
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    def __init__(self):
+        self._rooms = {}  # room -> set of Subscription
+        self._lock = threading.Lock()
+        self.stats = {"published": 0, "malformed": 0}
+
+    def subscribe(self, room=ALL_ROOMS):
+        sub = Subscription(room)
+        with self._lock:
+            self._rooms.setdefault(room, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._rooms.get(sub.room)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._rooms[sub.room]
+
+    def subscribers(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._rooms.values())
+
+    def publish(self, event):
+        room = event.get("room")
+        with self._lock:
+            targets = list(self._rooms.get(ALL_ROOMS, ()))
+            if room is not None and room != ALL_ROOMS:
+                targets.extend(self._rooms.get(room, ()))
+        for sub in targets:
+            sub.push(event)
+        self.stats["published"] += 1
+
+    def on_notify(self, payload):
+        """notify.listener callback; None means notifications may have been lost."""
+        if payload is None:
+            with self._lock:
+                subs = [s for room in self._rooms.values() for s in room]
+            for sub in subs:
+                sub.lagged = True
+            return
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            self.stats["malformed"] += 1
+            logger.warning("Dropping malformed %s payload: %.80s", CHANNEL, payload)
+            return
+        self.publish(event)
+
+
+broker = EventBroker()
+
+
+def room_snapshot(room):
+    """Current state of every student in room ('*' for all rooms)."""
+    params = {"room": room, "subjects": _current_subjects()}
+    with db_cursor() as (conn, cur):
+        cur.execute(ALL_SNAPSHOT_SQL if room == ALL_ROOMS else ROOM_SNAPSHOT_SQL, params)
+        return [
+            {"nis": nis, "name": name, "room": class_, "subject": subject,
+             "started_at": started.isoformat() if started else None,
+             "answered": answered or 0, "violations": int(violations or 0), "status": status}
+            for nis, name, class_, subject, started, answered, violations, status in cur.fetchall()
+        ]
+
+
+def _sse(event, data):
+    return "event: %s\ndata: %s\n\n" % (event, json.dumps(data, default=str))
+
+
+def stream(room, heartbeat=EVENT_HEARTBEAT):
+    """Generator of SSE frames for room: a snapshot, then deltas as they arrive."""
+    sub = broker.subscribe(room)
+    try:
+        # subscribe first so nothing between the snapshot and the deltas is lost
+        yield "retry: 3000\n" + _sse("snapshot", room_snapshot(room))
+        while True:
+            event = sub.get(heartbeat)
+            if event is None:
+                yield ": keepalive\n\n"
+            elif event is RESET:
+                yield _sse("snapshot", room_snapshot(room))
+            else:
+                yield _sse(event.get("type", "message"), event)
+    finally:
+        broker.unsubscribe(sub)
@@ -0,0 +1,169 @@
+"""
+In-process cache of exam form responses.
+
+Entries are keyed by (grade, subject, version); subject None means "every
+form of the grade" and version None the latest published one. Sessions are
+pinned to the version that was latest when they started, so a publish
+during an exam only reaches students who log in afterwards. A pinned lookup
+is served from the latest entry while that is still the pinned version,
+and otherwise from an entry of its own that never goes stale.
+
+Each entry keeps the response body already serialized and compressed
+together with its ETag, so serving a cached form is a dict lookup and a
+bytes write. The rendered (answer-free) jsonb is read as text and spliced
+into the response without ever being parsed.
+
+Invalidation is driven by the exam_forms trigger (NOTIFY exam_forms, grade)
+through notify.listener. While the listener is not connected, entries
+fall back to expiring after FORM_CACHE_TTL seconds. invalidate() bumps a
+per-grade generation, so a load that was already running when the grade
+changed is handed to its waiters but not cached.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from flask import Response, request
+from config import FORM_CACHE_TTL
+from db import db_cursor
+from queries import execute, FORMS_BY_GRADE, FORMS_BY_GRADE_SUBJECT, FORM_VERSION
+from notify import listener
+from shuffle import form_shape
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class CachedForm:
+    __slots__ = ("body", "gzip", "br", "etag", "loaded_at", "shapes", "versions")
+
+    def __init__(self, body, shapes=None, versions=None):
+        self.body = body
+        self.shapes = shapes or {}  # subject -> shuffle.form_shape()
+        self.versions = versions or {}  # subject -> exam_forms version
+        self.gzip = gzip.compress(body, 6)
+        self.br = brotli.compress(body) if brotli else None
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.loaded_at = time.monotonic()
+
+
+def _build_body(grade, rows):
+    forms = {}
+    for subject, payload, _ in rows:
+        forms[subject] = payload  # one row per subject: its latest (or pinned) version
+    parts = [json.dumps(s, ensure_ascii=False) + ":" + p for s, p in forms.items()]
+    body = '{"status":200,"grade":%s,"forms":{%s}}' % (json.dumps(grade, ensure_ascii=False), ",".join(parts))
+    return body.encode("utf-8")
+
+
+class FormCache:
+    def __init__(self, ttl=FORM_CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._loading = {}
+        self._generations = {}  # grade -> count of invalidations
+        self._epoch = 0  # count of full resets
+        self._lock = threading.Lock()
+
+    def _generation(self, grade):
+        return self._epoch, self._generations.get(grade, 0)
+
+    def _fresh(self, key, entry):
+        if key[2] is not None or listener.connected:
+            # a pinned version never changes
+            return True
+        return time.monotonic() - entry.loaded_at < self.ttl
+
+    def get(self, grade, subject=None, version=None):
+        """Return the CachedForm for (grade, subject) at version (None: latest), loading it on a miss.
+
+        Concurrent misses for the same key wait for a single loader.
+        """
+        if version is not None:
+            with self._lock:
+                latest = self._entries.get((grade, subject, None))
+                if latest is not None and latest.versions.get(subject) == version \
+                        and self._fresh((grade, subject, None), latest):
+                    return latest
+        key = (grade, subject, version)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._fresh(key, entry):
+                    return entry
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = threading.Event()
+                    generation = self._generation(grade)
+                    break
+            loading.wait()
+        try:
+            entry = self._load(grade, subject, version)
+            with self._lock:
+                # invalidated mid-load: what was read may predate the change
+                if self._generation(grade) == generation:
+                    self._entries[key] = entry
+            return entry
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            loading.set()
+
+    def _load(self, grade, subject, version=None):
+        with db_cursor() as (conn, cur):
+            if subject is None:
+                execute(cur, FORMS_BY_GRADE, (grade,))
+            elif version is None:
+                execute(cur, FORMS_BY_GRADE_SUBJECT, (grade, subject))
+            else:
+                execute(cur, FORM_VERSION, (grade, subject, version))
+            rows = cur.fetchall()
+        # parsed once per load, so sessions can get their shuffle layout without a query
+        shapes = {subject: form_shape(json.loads(payload)) for subject, payload, _ in rows}
+        versions = {subject: version for subject, _, version in rows}
+        return CachedForm(_build_body(grade, rows), shapes, versions)
+
+    def invalidate(self, grade=None):
+        with self._lock:
+            if grade is None:
+                self._epoch += 1
+                self._entries.clear()
+            else:
+                self._generations[grade] = self._generations.get(grade, 0) + 1
+                for key in [k for k in self._entries if k[0] == grade]:
+                    del self._entries[key]
+
+    def on_notify(self, payload):
+        """Listener callback: payload is the grade that changed, None to reset."""
+        self.invalidate(payload)
+
+
+def cached_response(entry):
+    """Build a response for entry, honouring If-None-Match and Accept-Encoding."""
+    if request.if_none_match.contains_weak(entry.etag):
+        resp = Response(status=304)
+    else:
+        accept = request.accept_encodings
+        if entry.br is not None and accept["br"]:
+            resp = Response(entry.br, mimetype="application/json")
+            resp.headers["Content-Encoding"] = "br"
+        elif accept["gzip"]:
+            resp = Response(entry.gzip, mimetype="application/json")
+            resp.headers["Content-Encoding"] = "gzip"
+        else:
+            resp = Response(entry.body, mimetype="application/json")
+    resp.set_etag(entry.etag, weak=True)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+form_cache = FormCache()
@@ -1,6 +1,17 @@
 import json
 
-def transform_form_json(raw_data):
+
+def _normalize(text):
+    # Forms keys are copies of the option text; tolerate case and spacing drift
+    return " ".join(str(text).split()).casefold()
+
+
+def transform_form_json(raw_data, problems=None):
+    # problems, when a list is given, collects answer keys that could not be
+    # mapped (an unmatched key, or a PG question with several correct answers);
+    # forms.validate_form rejects such questions, so these say why
+    if problems is None:
+        problems = []
     # Initialize result with form info fields and empty lists
     result = {
         "nama": "",    # e.g., fill manually if desired
@@ -76,18 +87,29 @@ def transform_form_json(raw_data):
         # Multiple-choice or dropdown
         if "choiceQuestion" in q:
             qtype = q["choiceQuestion"]["type"]
-            tipe = "PG" if qtype in ("RADIO", "DROP_DOWN") else qtype
+            # CHECKBOX (several answers) is what forms.py and grading.py call MCMA
+            tipe = "PG" if qtype in ("RADIO", "DROP_DOWN") else "MCMA" if qtype == "CHECKBOX" else qtype
             opsi = []
             for idx, opt in enumerate(q["choiceQuestion"]["options"], start=1):
                 opsi.append({"id": idx, "text": opt.get("value", "")})
             # Determine correct answer(s) by matching values
-            ans_values = [ans["value"] for ans in q["grading"]["correctAnswers"]["answers"]]
+            ans_values = [ans["value"] for ans in q["grading"].get("correctAnswers", {}).get("answers", [])]
+            by_text = {}
+            for opt in opsi:
+                by_text.setdefault(_normalize(opt["text"]), opt["id"])
             ans_ids = []
             for val in ans_values:
-                for opt in opsi:
-                    if opt["text"] == val:
-                        ans_ids.append(opt["id"])
-            answer_field = ans_ids[0] if len(ans_ids) == 1 else ans_ids
+                opt_id = by_text.get(_normalize(val))
+                if opt_id is None:
+                    problems.append(f"question {q_id} ({title[:40]!r}): key {val!r} matches no option")
+                elif opt_id not in ans_ids:
+                    ans_ids.append(opt_id)
+            if not ans_values:
+                problems.append(f"question {q_id} ({title[:40]!r}): no answer key")
+            if tipe == "PG" and len(ans_ids) > 1:
+                problems.append(f"question {q_id} ({title[:40]!r}): {len(ans_ids)} correct answers for a single-choice question")
+            # PG keeps one id; MCMA, and anything left unresolved, a list
+            answer_field = ans_ids[0] if tipe == "PG" and len(ans_ids) == 1 else ans_ids
             result["field"].append({
                 "id": q_id,
                 "pertanyaan": title,
@@ -105,11 +127,13 @@ def transform_form_json(raw_data):
 
     return result
 
-# Example usage:
-with open("sdfg.json", "r", encoding="utf-8") as infile:
-    raw_form = json.load(infile)
-structured_data = transform_form_json(raw_form)
+# Example usage (importing this module has no side effects; forms.publish_form
+# stores the result, see `cli.py publish-form`):
+if __name__ == "__main__":
+    with open("sdfg.json", "r", encoding="utf-8") as infile:
+        raw_form = json.load(infile)
+    structured_data = transform_form_json(raw_form)
 
-# Write output JSON
-with open("structured_output.json", "w", encoding="utf-8") as outfile:
-    json.dump(structured_data, outfile, ensure_ascii=False, indent=2)
+    # Write output JSON
+    with open("structured_output.json", "w", encoding="utf-8") as outfile:
+        json.dump(structured_data, outfile, ensure_ascii=False, indent=2)
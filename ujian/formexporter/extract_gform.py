@@ -1,41 +1,80 @@
+"""
+Google Forms -> examtmp.json layout -> form store.
+
+Forms are fetched concurrently over the Forms REST API with a bounded
+thread pool. A sync first asks every form for its revisionId only (a
+partial response of a few bytes); forms whose revisionId matches the one
+recorded in STATE_FILE are skipped, and only changed forms are downloaded in
+full, run through converter.transform_form_json and either published
+(--publish, forms.publish_form) or written to OUTPUT_DIR.
+
+The API is spoken directly with urllib, so the client is thread-safe and
+--base-url can point it at a local fake (fake_forms.py) for offline runs:
+
+  python fake_forms.py --dir . --port 8765 &
+  python extract_gform.py --base-url http://127.0.0.1:8765 --token fake
+
+OAuth credentials are kept as JSON in TOKEN_FILE (the old pickled token.pkl
+is no longer read; authorise once again).
+"""
+
 import json
-import pickle
 import os
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+import sys
+import time
+import argparse
+import urllib.error
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from converter import transform_form_json
+
+# the ujian package root holds db.py/forms.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
 
 # ----------------------------
 # CONFIGURATION
 # ----------------------------
+# a form URL, or {"url": ..., "grade": "11", "subject": "Biologi"} to fill in
+# what the Google Form itself does not carry
 FORM_URLS = [
     "https://docs.google.com/forms/d/1il--mc2AvnFNU6aBKIbMQLc4yOm3Sxc_zV9dk9lEzWM/edit"
 ]
 
 SCOPES = ['https://www.googleapis.com/auth/forms.body.readonly']
 CREDENTIALS_FILE = "credentials.json"
-TOKEN_FILE = "token.pkl"
+TOKEN_FILE = "token.json"
+STATE_FILE = "sync_state.json"  # form id -> last synced revisionId
 OUTPUT_DIR = "forms_json"  # directory to save JSON files
+API_BASE = "https://forms.googleapis.com"
+WORKERS = 8
+RETRIES = 3
+TIMEOUT = 20
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 # ----------------------------
 # AUTHENTICATION
 # ----------------------------
 def authenticate():
+    """Return a valid OAuth access token, refreshing/authorising as needed."""
+    from google.oauth2.credentials import Credentials
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
     if os.path.exists(TOKEN_FILE):
-        with open(TOKEN_FILE, 'rb') as token:
-            creds = pickle.load(token)
+        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
             flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
             creds = flow.run_local_server(port=0)
-        with open(TOKEN_FILE, 'wb') as token:
-            pickle.dump(creds, token)
-    return creds
+        with open(TOKEN_FILE, 'w') as token:
+            token.write(creds.to_json())
+    return creds.token
+
 
 # ----------------------------
 # HELPER FUNCTION TO EXTRACT FORM ID
@@ -46,77 +85,175 @@ def get_form_id(url):
     else:
         raise ValueError(f"Invalid form URL: {url}")
 
+
+def form_entry(entry):
+    """Normalise a FORM_URLS entry to {"id", "grade", "subject"}."""
+    if isinstance(entry, str):
+        entry = {"url": entry}
+    return {"id": entry.get("id") or get_form_id(entry["url"]), "grade": entry.get("grade"), "subject": entry.get("subject")}
+
+
 # ----------------------------
-# FETCH FORM STRUCTURE
+# FORMS API CLIENT
 # ----------------------------
-def fetch_forms_structure():
-    creds = authenticate()
-    service = build('forms', 'v1', credentials=creds)
-
-    for url in FORM_URLS:
-        form_id = get_form_id(url)
-        form = service.forms().get(formId=form_id).execute()
-        form_title = form.get("info", {}).get("title", "Untitled Form")
-
-        form_data = {
-            "form_title": form_title,
-            "form_id": form_id,
-            "questions": []
-        }
-
-        with open(f"response_{form_title}.json", "w") as f:
-            json.dump(form, f)
-
-        for item in form.get("items", []):
-            question_title = item.get("title", "")
-            item_type = "DESCRIPTION"
-            points = 0
-            choices = []
-            correct_answers = []
-
-            if "questionItem" in item:
-                question = item["questionItem"]["question"]
-                item_type = question.get("questionType", "OTHER")
-                points = question.get("pointValue", 0)
-
-                # Multiple Choice / MCMA
-                if "choiceQuestion" in question:
-                    choices = [opt["value"] for opt in question["choiceQuestion"].get("options", [])]
-                    correct_answers = question["choiceQuestion"].get("correctAnswers", [])
-                elif "checkboxQuestion" in question:
-                    choices = [opt["value"] for opt in question["checkboxQuestion"].get("options", [])]
-                    correct_answers = question["checkboxQuestion"].get("correctAnswers", [])
-                elif "textQuestion" in question:
-                    # Short / Long answer
-                    choices = []
-                    correct_answers = question["textQuestion"].get("answers", [])
-                elif "scaleQuestion" in question:
-                    scale = question["scaleQuestion"]
-                    choices = [f"{scale.get('lowLabel','')} - {scale.get('low',0)}", f"{scale.get('highLabel','')} - {scale.get('high',0)}"]
-                elif "gridQuestion" in question:
-                    grid = question["gridQuestion"]
-                    choices = grid.get("rows", [])  # rows as choices
-                elif "dropdownQuestion" in question:
-                    choices = [opt["value"] for opt in question["dropdownQuestion"].get("options", [])]
-
-            form_data["questions"].append({
-                "question": question_title,
-                "type": item_type,
-                "points": points,
-                "choices": choices,
-                "correct_answers": correct_answers
-            })
-
-        # Save each form as separate JSON file
-        safe_title = "".join(c if c.isalnum() or c in "_-" else "_" for c in form_title)
-        output_file = os.path.join(OUTPUT_DIR, f"{safe_title}_{form_id}.json")
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(form_data, f, indent=4, ensure_ascii=False)
-
-        print(f"✅ Exported {form_title} → {output_file}")
+class FormsClient:
+    """Minimal, thread-safe Forms API v1 client (GET forms/{id} only)."""
+
+    def __init__(self, token, base_url=API_BASE, timeout=TIMEOUT, retries=RETRIES):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+
+    def get_form(self, form_id, fields=None):
+        url = f"{self.base_url}/v1/forms/{form_id}"
+        if fields:
+            url += "?fields=" + urllib.request.quote(fields, safe=",/()")
+        req = urllib.request.Request(url, headers={"Authorization": f"Bearer {self.token}", "Accept": "application/json"})
+        for attempt in range(self.retries + 1):
+            try:
+                with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                    return json.load(resp)
+            except urllib.error.HTTPError as e:
+                # rate limits and server errors are worth another try, the rest are not
+                if e.code != 429 and e.code < 500 or attempt == self.retries:
+                    raise
+            except urllib.error.URLError:
+                if attempt == self.retries:
+                    raise
+            time.sleep(0.5 * 2 ** attempt)
+
+
+# ----------------------------
+# SYNC
+# ----------------------------
+def load_state(path=STATE_FILE):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path=STATE_FILE):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _store(entry, raw, publish, output_dir):
+    problems = []
+    form = transform_form_json(raw, problems)
+    title = raw.get("info", {}).get("title", "Untitled Form")
+    form["nama"] = entry["subject"] or form["nama"] or title
+    if entry["grade"]:
+        form["kelas"] = entry["grade"]
+    if publish is not None:
+        try:
+            return dict(publish(form, grade=entry["grade"], subject=entry["subject"]), problems=problems)
+        except ValueError as e:
+            # forms.FormError: say which keys the converter could not map, too
+            e.problems = problems
+            raise
+    for problem in problems:
+        print(f"⚠️  {entry['id']}: {problem}")
+    safe_title = "".join(c if c.isalnum() or c in "_-" else "_" for c in title)
+    output_file = os.path.join(output_dir, f"{safe_title}_{entry['id']}.json")
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump(form, f, indent=4, ensure_ascii=False)
+    # the hash the store would record, so both paths agree on unchanged forms
+    from forms import content_hash
+    return {"file": output_file, "content_hash": content_hash(form), "problems": problems}
+
+
+def sync_forms(entries, client, state, publish=None, output_dir=OUTPUT_DIR, workers=WORKERS, force=False):
+    """Fetch, convert and store every changed form. Returns {form id: result}.
+
+    state ({form id: {"revisionId": ...}}) is updated in place for every
+    form stored successfully; failures are reported and retried next run. A
+    form the store rejects (forms.FormError) fails alone, with the questions
+    at fault listed, and the other forms are still published.
+    """
+    entries = [form_entry(e) for e in entries]
+    os.makedirs(output_dir, exist_ok=True)
+    results = {}
+
+    def check(entry):
+        return client.get_form(entry["id"], fields="revisionId")["revisionId"]
+
+    def sync_one(entry):
+        raw = client.get_form(entry["id"])
+        return entry, raw, _store(entry, raw, publish, output_dir)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        changed = []
+        for entry, future in [(e, pool.submit(check, e)) for e in entries]:
+            try:
+                revision = future.result()
+            except Exception as e:
+                print(f"❌ revision check failed for {entry['id']}: {e}")
+                continue
+            if not force and state.get(entry["id"], {}).get("revisionId") == revision:
+                results[entry["id"]] = {"skipped": True, "revisionId": revision}
+            else:
+                changed.append(entry)
+
+        for entry, future in [(e, pool.submit(sync_one, e)) for e in changed]:
+            try:
+                _, raw, result = future.result()
+            except Exception as e:
+                errors = getattr(e, "errors", None)  # forms.FormError lists every problem
+                problems = getattr(e, "problems", [])
+                if errors is None:
+                    print(f"❌ sync failed for {entry['id']}: {e}")
+                else:
+                    print(f"❌ {entry['id']} rejected by the form store:")
+                    for line in errors + problems:
+                        print(f"   - {line}")
+                results[entry["id"]] = {"failed": True, "errors": errors or [str(e)], "problems": problems}
+                continue
+            state[entry["id"]] = {"revisionId": raw.get("revisionId"), "title": raw.get("info", {}).get("title")}
+            results[entry["id"]] = dict(result, revisionId=raw.get("revisionId"))
+            print(f"✅ Synced {raw.get('info', {}).get('title', entry['id'])} ({entry['id']})")
+    return results
+
 
 # ----------------------------
 # RUN
 # ----------------------------
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Sync Google Forms into the exam form store")
+    p.add_argument("--forms", help="JSON file with a list of FORM_URLS-style entries (default: FORM_URLS)")
+    p.add_argument("--base-url", default=API_BASE, help="Forms API root, e.g. a fake_forms.py server")
+    p.add_argument("--token", help="bearer token to use instead of the OAuth flow")
+    p.add_argument("--workers", type=int, default=WORKERS)
+    p.add_argument("--state", default=STATE_FILE)
+    p.add_argument("--output-dir", default=OUTPUT_DIR)
+    p.add_argument("--force", action="store_true", help="ignore recorded revisionIds and sync everything")
+    p.add_argument("--publish", action="store_true", help="publish straight into exam_forms instead of writing JSON files")
+    args = p.parse_args(argv)
+
+    entries = FORM_URLS
+    if args.forms:
+        with open(args.forms, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+
+    publish = None
+    if args.publish:
+        from forms import publish_form as publish
+
+    client = FormsClient(args.token or authenticate(), base_url=args.base_url)
+    state = load_state(args.state)
+    started = time.monotonic()
+    results = sync_forms(entries, client, state, publish=publish, output_dir=args.output_dir,
+                         workers=args.workers, force=args.force)
+    save_state(state, args.state)
+    synced = sum(1 for r in results.values() if not r.get("skipped") and not r.get("failed"))
+    skipped = sum(1 for r in results.values() if r.get("skipped"))
+    print(f"{synced} synced, {skipped} unchanged, {len(entries) - synced - skipped} failed "
+          f"in {time.monotonic() - started:.1f}s")
+
+
 if __name__ == "__main__":
-    fetch_forms_structure()
+    main()
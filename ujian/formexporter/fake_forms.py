@@ -0,0 +1,88 @@
+"""
+Offline stand-in for the Google Forms API, for extract_gform.py runs without
+credentials or network.
+
+Serves GET /v1/forms/<formId> from the Forms API JSON dumps in --dir (any
+*.json file with a "formId", e.g. sdfg.json), re-read on every request so a
+dump can be edited to bump its revisionId. ?fields=a,b returns only those
+top-level keys, like the real partial responses. --latency adds a delay per
+request to see the concurrent sync at work.
+
+  python fake_forms.py --dir . --port 8765
+"""
+
+import os
+import json
+import time
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def load_forms(directory):
+    forms = {}
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if isinstance(data, dict) and data.get("formId"):
+            forms[data["formId"]] = data
+    return forms
+
+
+def make_handler(directory, latency):
+    class FormsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            parts = url.path.strip("/").split("/")
+            if len(parts) != 3 or parts[:2] != ["v1", "forms"]:
+                return self.reply(404, {"error": {"code": 404, "message": "Not found"}})
+            form = load_forms(directory).get(parts[2])
+            if form is None:
+                return self.reply(404, {"error": {"code": 404, "message": f"Requested entity was not found: {parts[2]}"}})
+            fields = parse_qs(url.query).get("fields")
+            if fields:
+                wanted = [f.strip() for f in fields[0].split(",")]
+                form = {k: v for k, v in form.items() if k in wanted}
+            if latency:
+                time.sleep(latency)
+            self.reply(200, form)
+
+        def reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, fmt, *args):
+            print(f"{self.address_string()} {fmt % args}")
+
+    return FormsHandler
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Serve Forms API JSON dumps for offline extract_gform.py runs")
+    p.add_argument("--dir", default=".", help="directory with Forms API JSON dumps")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response")
+    args = p.parse_args(argv)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.dir, args.latency))
+    print(f"Serving {len(load_forms(args.dir))} form(s) from {args.dir} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Exam form publishing.
+
+Forms follow the data/exam/examtmp.json layout (converter.py produces the
+same shape, with "nama" in place of "form"). publish_form() validates a
+form, then stores it as a new immutable version of (grade, subject) in
+exam_forms together with:
+
+  content_hash  sha256 of the canonical JSON, so re-publishing an unchanged
+                form is a no-op instead of a new version;
+  rendered      the student-facing copy with every answer key removed,
+                which is what examDo serves (formcache.py) as-is.
+
+Everything a request needs is computed here, once per publish; serving a
+form is a read of the latest rendered version. The insert fires the
+exam_forms trigger, which invalidates the form caches and compiled answer
+keys of every app process.
+"""
+
+import hashlib
+import json
+import logging
+
+from db import db_cursor
+
+logger = logging.getLogger(__name__)
+
+TYPES = ("PG", "MCMA", "TF", "SKALA")
+META_KEYS = ("kelas", "semester", "tahun")
+
+PUBLISH_SQL = """
+WITH latest AS (
+    SELECT version, content_hash FROM exam_forms
+    WHERE grade = %(grade)s AND subject = %(subject)s
+    ORDER BY version DESC LIMIT 1
+), created AS (
+    INSERT INTO exam_forms (grade, subject, version, content_hash, payload, rendered)
+    SELECT %(grade)s, %(subject)s, COALESCE((SELECT version FROM latest), 0) + 1, %(hash)s, %(payload)s, %(rendered)s
+    WHERE NOT EXISTS (SELECT 1 FROM latest WHERE content_hash = %(hash)s)
+    RETURNING version
+)
+SELECT version, TRUE FROM created
+UNION ALL
+SELECT version, FALSE FROM latest WHERE content_hash = %(hash)s
+"""
+
+
+class FormError(ValueError):
+    """A form that does not match the examtmp.json layout; .errors lists every problem."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def _check_question(field, where, errors):
+    jawab = field.get("jawab")
+    if not isinstance(jawab, dict):
+        errors.append(f"{where}: missing 'jawab'")
+        return
+    tipe = str(jawab.get("tipe") or "").upper()
+    if tipe not in TYPES:
+        errors.append(f"{where}: unknown tipe {jawab.get('tipe')!r}")
+        return
+    point = jawab.get("point", 0)
+    if not isinstance(point, (int, float)) or isinstance(point, bool) or point < 0:
+        errors.append(f"{where}: point must be a non-negative number")
+    answer = jawab.get("answer")
+
+    if tipe in ("PG", "MCMA"):
+        opsi = jawab.get("opsi")
+        if not isinstance(opsi, list) or not opsi:
+            errors.append(f"{where}: {tipe} needs a non-empty 'opsi' list")
+            return
+        ids = [opt.get("id") if isinstance(opt, dict) else None for opt in opsi]
+        if None in ids or len(set(ids)) != len(ids):
+            errors.append(f"{where}: every option needs a unique id")
+            return
+        picks = answer if isinstance(answer, list) else [answer]
+        if tipe == "PG" and isinstance(answer, list) and len(answer) != 1:
+            errors.append(f"{where}: PG takes exactly one answer")
+        if not picks or any(p not in ids for p in picks):
+            errors.append(f"{where}: answer {answer!r} is not one of the option ids")
+    elif tipe == "TF":
+        statements = jawab.get("pertanyaan")
+        if isinstance(statements, list):
+            rows = answer if isinstance(answer, list) else []
+            if any(not isinstance(r, int) or not 1 <= r <= len(statements) for r in rows):
+                errors.append(f"{where}: TF answer rows must be statement numbers 1..{len(statements)}")
+        elif str(answer).strip().lower() not in ("true", "false", "benar", "salah"):
+            errors.append(f"{where}: TF answer must be True or False")
+
+
+def validate_form(form):
+    """Raise FormError listing every problem; return the form's display name (may be empty)."""
+    errors = []
+    if not isinstance(form, dict):
+        raise FormError(["form must be a JSON object"])
+    name = form.get("form") or form.get("nama") or ""
+    for key in META_KEYS:
+        if key not in form:
+            errors.append(f"missing '{key}'")
+    fields = form.get("field")
+    if not isinstance(fields, list) or not fields:
+        errors.append("'field' must be a non-empty list")
+        fields = []
+    seen = set()
+    for n, field in enumerate(fields, start=1):
+        where = f"field[{n}]"
+        if not isinstance(field, dict):
+            errors.append(f"{where}: not an object")
+            continue
+        qid = field.get("id")
+        if qid is None or str(qid) in seen:
+            errors.append(f"{where}: missing or duplicate id {qid!r}")
+        seen.add(str(qid))
+        if not str(field.get("pertanyaan") or "").strip():
+            errors.append(f"{where}: empty 'pertanyaan'")
+        _check_question(field, where, errors)
+    for n, field in enumerate(form.get("metadata") or [], start=1):
+        if isinstance(field, dict):
+            _check_question(field, f"metadata[{n}]", errors)
+    if errors:
+        raise FormError(errors)
+    return str(name)
+
+
+def content_hash(form):
+    canonical = json.dumps(form, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def render_form(form):
+    """Student-facing copy of form: identical, minus every answer key."""
+    rendered = dict(form)
+    for section in ("field", "metadata"):
+        if section in form:
+            rendered[section] = [
+                dict(field, jawab={k: v for k, v in field["jawab"].items() if k != "answer"})
+                for field in form[section]
+            ]
+    return rendered
+
+
+def publish_form(form, grade=None, subject=None):
+    """Validate and store form as the next version of (grade, subject).
+
+    grade defaults to the form's "kelas" and subject to its name. Publishing
+    content identical to the latest version returns that version unchanged.
+    """
+    name = validate_form(form)
+    grade = str(grade or form["kelas"] or "")
+    subject = str(subject or name)
+    # converter.py leaves nama/kelas blank for the caller to fill in
+    missing = [f"missing {what}" for what, value in (("grade ('kelas')", grade), ("subject ('form' or 'nama')", subject)) if not value]
+    if missing:
+        raise FormError(missing)
+    digest = content_hash(form)
+    with db_cursor() as (conn, cur):
+        # serialize publishers of the same form so versions stay gapless
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"exam_forms:{grade}:{subject}",))
+        cur.execute(PUBLISH_SQL, {
+            "grade": grade, "subject": subject, "hash": digest,
+            "payload": json.dumps(form, ensure_ascii=False),
+            "rendered": json.dumps(render_form(form), ensure_ascii=False),
+        })
+        version, created = cur.fetchone()
+    if created:
+        logger.info("Published %s/%s version %s (%s)", grade, subject, version, digest[:12])
+    return {"grade": grade, "subject": subject, "version": version, "content_hash": digest, "created": created}
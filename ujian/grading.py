@@ -0,0 +1,202 @@
+"""
+Vectorized grading for the examtmp.json form schema.
+
+A form is compiled once into an AnswerKey: every gradable question becomes a
+contiguous run of columns, one per option for PG/MCMA and one per statement
+for TF. Student answers are encoded into a students x columns int8 matrix
+(1 selected / true, 0 not selected / false, -1 unanswered TF statement) and
+a whole class or grade is scored with a handful of NumPy reductions.
+
+Scoring rules, per question worth `point`:
+  PG    full point when exactly the correct option is selected.
+  MCMA  partial credit: (correct picks - wrong picks) / number of correct
+        options, clipped to [0, 1].
+  TF    fraction of statements answered correctly; a single-statement TF
+        ("answer": "True") is a one-column grid.
+
+The response matrix depends only on the form layout (question ids and
+option ids), not on the key, so after a key correction the same matrix can
+be re-scored against a recompiled AnswerKey without re-encoding.
+
+A PG or MCMA question whose key names none of its options cannot be scored
+(an empty key row would credit every unanswered sheet); it keeps its columns
+but is worth zero points and is listed in AnswerKey.unkeyed.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PG = "PG"
+MCMA = "MCMA"
+TF = "TF"
+
+_TRUE = {"true", "benar", "b", "ya", "1"}
+_FALSE = {"false", "salah", "s", "tidak", "0"}
+
+
+def _truth(value):
+    """Map a TF answer to 1/0, or -1 when it cannot be read."""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)) and value in (0, 1):
+        return int(value)
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return 1
+    if text in _FALSE:
+        return 0
+    return -1
+
+
+class AnswerKey:
+    def __init__(self, form):
+        self.question_ids = []
+        self.types = []
+        self._options = []  # per question: {option id: column offset}, None for TF
+        self.unkeyed = []  # PG/MCMA question ids whose key matches no option
+        starts, widths, points, n_correct, key = [], [], [], [], []
+
+        for field in form.get("field", []):
+            jawab = field.get("jawab") or {}
+            tipe = str(jawab.get("tipe") or PG).upper()
+            if tipe in (PG, MCMA):
+                ids = [opt.get("id") for opt in jawab.get("opsi", [])]
+                answer = jawab.get("answer")
+                correct = set(answer if isinstance(answer, list) else [answer])
+                cells = [1 if i in correct else 0 for i in ids]
+                options = {i: n for n, i in enumerate(ids)}
+            elif tipe == TF:
+                statements = jawab.get("pertanyaan")
+                if isinstance(statements, list):
+                    true_rows = set(jawab.get("answer") or [])
+                    cells = [1 if n in true_rows else 0 for n in range(1, len(statements) + 1)]
+                else:
+                    cells = [max(_truth(jawab.get("answer")), 0)]
+                options = None
+            else:
+                continue  # ungraded items such as SKALA metadata
+            if not cells:
+                continue
+            point = float(jawab.get("point") or 0)
+            if options is not None and not any(cells):
+                self.unkeyed.append(str(field.get("id")))
+                point = 0.0
+            self.question_ids.append(str(field.get("id")))
+            self.types.append(tipe)
+            self._options.append(options)
+            starts.append(len(key))
+            widths.append(len(cells))
+            points.append(point)
+            n_correct.append(sum(cells))
+            key.extend(cells)
+
+        if self.unkeyed:
+            logger.warning("Questions %s have no answer matching an option and score zero points",
+                           ", ".join(self.unkeyed))
+        self._position = {qid: n for n, qid in enumerate(self.question_ids)}
+        self.key = np.array(key, dtype=np.int8)
+        self.starts = np.array(starts, dtype=np.intp)
+        self.widths = np.array(widths, dtype=np.int16)
+        self.points = np.array(points, dtype=np.float64)
+        self.n_correct = np.maximum(np.array(n_correct, dtype=np.int16), 1)
+        types = np.array(self.types, dtype="U4")
+        self._is_pg = types == PG
+        self._is_mcma = types == MCMA
+        self._keyed = np.array([q not in self.unkeyed for q in self.question_ids], dtype=bool)
+        self._tf_columns = np.repeat(types == TF, self.widths) if len(key) else np.zeros(0, dtype=bool)
+
+    @property
+    def n_questions(self):
+        return len(self.question_ids)
+
+    @property
+    def n_columns(self):
+        return len(self.key)
+
+    @property
+    def max_score(self):
+        return float(self.points.sum())
+
+    def layout(self):
+        """Column layout signature; matrices are reusable across keys with the same layout."""
+        return tuple(zip(self.question_ids, self.types, (tuple(o or ()) for o in self._options), self.widths.tolist()))
+
+    def encode(self, responses):
+        """Encode a list of {question_id: answer} dicts into a response matrix."""
+        matrix = np.zeros((len(responses), self.n_columns), dtype=np.int8)
+        matrix[:, self._tf_columns] = -1
+        for row, answers in enumerate(responses):
+            for qid, value in (answers or {}).items():
+                q = self._position.get(str(qid))
+                if q is not None:
+                    self._encode_value(matrix[row], q, value)
+        return matrix
+
+    def _encode_value(self, row, q, value):
+        start = self.starts[q]
+        options = self._options[q]
+        if options is not None:
+            for picked in value if isinstance(value, list) else [value]:
+                offset = options.get(picked)
+                if offset is None and isinstance(picked, str) and picked.isdigit():
+                    offset = options.get(int(picked))
+                if offset is not None:
+                    row[start + offset] = 1
+            return
+        width = self.widths[q]
+        if isinstance(value, dict):  # {statement number: answer}
+            items = ((int(k) - 1, v) for k, v in value.items() if str(k).isdigit())
+        elif isinstance(value, list):
+            items = enumerate(value)
+        else:
+            items = [(0, value)]
+        for n, v in items:
+            if 0 <= n < width:
+                row[start + n] = _truth(v)
+
+    def score(self, matrix):
+        """Return the students x questions matrix of points earned."""
+        return self.fractions(matrix) * self.points
+
+    def fractions(self, matrix):
+        """Return the students x questions matrix of credit in [0, 1]."""
+        if not self.n_questions:
+            return np.zeros((matrix.shape[0], 0))
+        selected = matrix == 1
+        key = self.key == 1
+        hits = np.add.reduceat((selected & key).astype(np.int16), self.starts, axis=1)
+        wrong = np.add.reduceat((selected & ~key).astype(np.int16), self.starts, axis=1)
+        matches = np.add.reduceat((matrix == self.key).astype(np.int16), self.starts, axis=1)
+
+        exact = (matches == self.widths).astype(np.float64)
+        partial = np.clip((hits - wrong) / self.n_correct, 0.0, 1.0)
+        statements = matches / self.widths
+        credit = np.where(self._is_pg, exact, np.where(self._is_mcma, partial, statements))
+        return np.where(self._keyed, credit, 0.0)
+
+
+class GradeResult:
+    """Scores for a batch of students, in the order they were encoded."""
+
+    def __init__(self, key, fractions):
+        self.key = key
+        self.points = fractions * key.points
+        self.totals = self.points.sum(axis=1)
+        self.correct = (fractions >= 1.0).sum(axis=1)
+        max_score = key.max_score
+        self.percentage = np.round(self.totals / max_score * 100, 2) if max_score else np.zeros(len(fractions))
+
+    def rows(self):
+        """Yield (correct_answers, total_questions, score, score_percentage) per student."""
+        total = self.key.n_questions
+        for correct, score, pct in zip(self.correct.tolist(), self.totals.tolist(), self.percentage.tolist()):
+            yield correct, total, score, pct
+
+
+def grade(form_or_key, responses):
+    """Grade a list of answer dicts against a form payload or compiled AnswerKey."""
+    key = form_or_key if isinstance(form_or_key, AnswerKey) else AnswerKey(form_or_key)
+    return GradeResult(key, key.fractions(key.encode(responses)))
@@ -0,0 +1,370 @@
+"""
+Real-time proctoring hub.
+
+An asyncio WebSocket server that replaces the old sqlite/socket.io
+prototype in asd/. Ban state lives in memory: a violation, appeal or unban
+is handled without touching the database on the event loop, and the
+resulting rows are written behind in batches (batching.WriteBehindQueue)
+to the bans, appeals and revoked_sessions tables. Messages to a room are
+serialized once and fanned out with websockets.broadcast.
+
+Students connect with   ?hash=<session_hash>&nis=<nis>
+proctors connect with   ?role=proctor&token=<teacher token>[&room=<class>]
+(no room means every room). Messages are JSON objects with an "action":
+
+  student -> hub    violation {reason} | appeal {text} | ping
+  proctor -> hub    unban {nis}
+  hub -> student    connected | banned {reason} | appealed | appeal_sent
+  hub -> proctors   ban_notice | appeal_notice | unban_ack | unban_denied
+
+An unban also lifts the revocation of the student's sessions, so the
+student can reconnect. Proctors of one room can only unban its students.
+
+Several hubs can run behind one load balancer. Violations are counted in
+the shared state backend (state.py), whichever node each violation went
+to; a node that finds the count at BAN_THRESHOLD or over sets the
+hub:banned:<nis> marker with SET NX, and only the node that set it bans the
+student. That node queues the database writes and publishes the ban, appeal or
+unban on the "hub" channel; every hub, itself included, applies it to its
+memory and notifies the sockets it holds. After the channel reconnects a
+hub reloads its bans from the database. With the backend unreachable a hub
+counts and notifies on its own, as a single hub does.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import websockets
+from psycopg2.extras import execute_values
+from batching import WriteBehindQueue
+from config import HUB_HOST, HUB_PORT, BAN_THRESHOLD, HUB_FLUSH_INTERVAL
+from db import db_cursor
+from state import state, StateError
+from tokens import validate_token, VALID
+
+logger = logging.getLogger(__name__)
+
+ALL_ROOMS = "*"
+CHANNEL = "hub"
+
+
+class Ban:
+    __slots__ = ("violations", "banned_at", "reason")
+
+    def __init__(self, violations=0, banned_at=None, reason=None):
+        self.violations = violations
+        self.banned_at = banned_at
+        self.reason = reason
+
+
+# ---------------------------- write-behind
+
+def _flush_bans(ops):
+    """ops: ("ban", nis, Ban, revoked session_hash or None) or ("unban", nis, None, None), in order."""
+    final = {}
+    revokes = {}  # nis -> [(session_hash, revoked_at)] since its last unban in this batch
+    unrevoked = set()
+    for op, nis, ban, session_hash in ops:
+        final[nis] = ban if op == "ban" else None
+        if op == "unban":
+            revokes[nis] = []
+            unrevoked.add(nis)
+        elif session_hash is not None:
+            revokes.setdefault(nis, []).append((session_hash, ban.banned_at))
+    upserts = [(nis, b.violations, b.banned_at, b.reason) for nis, b in final.items() if b is not None]
+    deletes = [nis for nis, b in final.items() if b is None]
+    revocations = [row for rows in revokes.values() for row in rows]
+    with db_cursor() as (conn, cur):
+        if deletes:
+            cur.execute("DELETE FROM bans WHERE nis = ANY(%s)", (deletes,))
+        if unrevoked:
+            cur.execute("DELETE FROM revoked_sessions WHERE session_hash IN "
+                        "(SELECT session_hash FROM sessions WHERE nis = ANY(%s))", (list(unrevoked),))
+        if upserts:
+            execute_values(
+                cur,
+                "INSERT INTO bans (nis, violations, banned_at, reason) VALUES %s "
+                # a hub that has not yet heard of another hub's ban must not clear it
+                "ON CONFLICT (nis) DO UPDATE SET violations = GREATEST(bans.violations, EXCLUDED.violations), "
+                "banned_at = COALESCE(EXCLUDED.banned_at, bans.banned_at), "
+                "reason = COALESCE(EXCLUDED.reason, bans.reason)",
+                upserts,
+                template="(%s, %s, to_timestamp(%s), %s)",
+            )
+        if revocations:
+            execute_values(cur, "INSERT INTO revoked_sessions (session_hash, revoked_at) VALUES %s "
+                           "ON CONFLICT DO NOTHING", revocations, template="(%s, to_timestamp(%s))")
+
+
+def _flush_appeals(rows):
+    with db_cursor() as (conn, cur):
+        execute_values(cur, "INSERT INTO appeals (nis, appeal_text, created_at) VALUES %s", rows,
+                       template="(%s, %s, to_timestamp(%s))")
+
+
+# ---------------------------- blocking lookups, run in worker threads
+
+def _load_state():
+    with db_cursor() as (conn, cur):
+        cur.execute("SELECT nis, violations, extract(epoch FROM banned_at), reason FROM bans")
+        bans = {nis: Ban(v, float(at) if at is not None else None, r) for nis, v, at, r in cur.fetchall()}
+        cur.execute("SELECT r.session_hash, s.nis FROM revoked_sessions r "
+                    "LEFT JOIN sessions s ON s.session_hash = r.session_hash")
+        revoked = dict(cur.fetchall())
+    try:
+        # hubs started later, or after the backend lost its data, continue the stored counts
+        for nis, ban in bans.items():
+            state.set(_counter(nis), ban.violations, nx=True)
+            if ban.banned_at is not None:
+                state.set(_ban_marker(nis), 1, nx=True)
+    except StateError as e:
+        logger.warning("Violation counters not seeded: %s", e)
+    return bans, revoked
+
+
+def _counter(nis):
+    return "hub:violations:%s" % nis
+
+
+def _ban_marker(nis):
+    return "hub:banned:%s" % nis
+
+
+def _count_violation(nis):
+    """The student's violation count across every hub, or None when the state backend is down."""
+    try:
+        return state.incr(_counter(nis))
+    except StateError as e:
+        logger.warning("Counting violation locally: %s", e)
+        return None
+
+
+def _claim_ban(nis):
+    """True for the one hub that gets to ban the student; every hub, when the backend is down."""
+    try:
+        return state.set(_ban_marker(nis), 1, nx=True)
+    except StateError as e:
+        logger.warning("Banning %s without the shared marker: %s", nis, e)
+        return True
+
+
+def _reset_violations(nis):
+    try:
+        state.delete(_counter(nis), _ban_marker(nis))
+    except StateError as e:
+        logger.warning("Violation counter of %s not reset: %s", nis, e)
+
+
+def _class_of(nis):
+    with db_cursor() as (conn, cur):
+        cur.execute("SELECT class FROM students WHERE nis = %s", (nis,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _student_room(session_hash, nis):
+    with db_cursor() as (conn, cur):
+        cur.execute(
+            "SELECT st.class FROM sessions s JOIN students st ON st.nis = s.nis "
+            "WHERE s.session_hash = %s AND s.nis = %s AND s.active = TRUE",
+            (session_hash, nis),
+        )
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+class ProctorHub:
+    def __init__(self, ban_threshold=BAN_THRESHOLD, flush_interval=HUB_FLUSH_INTERVAL):
+        self.ban_threshold = ban_threshold
+        self.bans = {}
+        self.revoked = {}   # session_hash -> nis
+        self.students = {}  # nis -> set of sockets
+        self.rooms = {}     # room -> set of proctor sockets
+        self.ban_queue = WriteBehindQueue("bans", _flush_bans, interval=flush_interval)
+        self.appeal_queue = WriteBehindQueue("appeals", _flush_appeals, interval=flush_interval)
+        self._loop = None
+
+    # ---- fan-out
+
+    @staticmethod
+    def _send(sockets, action, **data):
+        if sockets:
+            websockets.broadcast(sockets, json.dumps(dict(data, action=action)))
+
+    def notify_student(self, nis, action, **data):
+        self._send(self.students.get(nis, ()), action, **data)
+
+    def notify_proctors(self, room, action, **data):
+        sockets = set(self.rooms.get(ALL_ROOMS, ()))
+        sockets.update(self.rooms.get(room, ()))
+        self._send(sockets, action, **data)
+
+    # ---- events
+
+    async def violation(self, nis, room, session_hash, reason):
+        count = await asyncio.to_thread(_count_violation, nis)
+        ban = self.bans.setdefault(nis, Ban())
+        shared = count is not None
+        if not shared:
+            count = ban.violations + 1
+        ban.violations = count
+        banning = count >= self.ban_threshold and ban.banned_at is None
+        if banning and shared:
+            # the count may pass the threshold on several hubs at once (or be
+            # counted twice); only the hub that sets the marker bans
+            banning = await asyncio.to_thread(_claim_ban, nis)
+        if banning:
+            banned_at = time.time()
+            ban.banned_at, ban.reason = banned_at, reason
+            self.ban_queue.put(("ban", nis, Ban(count, banned_at, reason), session_hash))
+            await self._publish(action="ban", nis=nis, room=room, session=session_hash, reason=reason,
+                                violations=count, at=banned_at)
+        else:
+            self.ban_queue.put(("ban", nis, Ban(count, ban.banned_at, ban.reason), None))
+
+    async def appeal(self, nis, room, text):
+        self.appeal_queue.put((nis, text, time.time()))
+        await self._publish(action="appeal", nis=nis, room=room, text=text)
+
+    async def unban(self, nis, room=None):
+        self.ban_queue.put(("unban", nis, None, None))
+        await asyncio.to_thread(_reset_violations, nis)
+        await self._publish(action="unban", nis=nis, room=room)
+
+    async def _publish(self, **event):
+        message = json.dumps(event)
+        try:
+            await asyncio.to_thread(state.publish, CHANNEL, message)
+        except StateError as e:
+            logger.warning("Hub event not shared with other nodes: %s", e)
+            self._apply(message)
+
+    def _received(self, message):
+        # subscriber thread -> event loop
+        self._loop.call_soon_threadsafe(self._apply, message)
+
+    def _apply(self, message):
+        """Apply a hub event from any node to this hub's memory and sockets."""
+        if message is None:
+            # the channel reconnected and events may have been missed
+            asyncio.ensure_future(self._reload())
+            return
+        event = json.loads(message)
+        action, nis, room = event.get("action"), event.get("nis"), event.get("room")
+        if action == "ban":
+            ban = self.bans.setdefault(nis, Ban())
+            ban.violations = max(ban.violations, event["violations"])
+            ban.banned_at, ban.reason = event["at"], event["reason"]
+            self.revoked[event["session"]] = nis
+            self.notify_student(nis, "banned", reason=ban.reason)
+            self.notify_proctors(room, "ban_notice", nis=nis, reason=ban.reason, violations=ban.violations)
+        elif action == "appeal":
+            self.notify_proctors(room, "appeal_notice", nis=nis, text=event.get("text", ""))
+        elif action == "unban":
+            self.bans.pop(nis, None)
+            # the student may reconnect with the session that was revoked
+            for session_hash in [h for h, owner in self.revoked.items() if owner == nis]:
+                del self.revoked[session_hash]
+            self.notify_student(nis, "appealed")
+            self.notify_proctors(room, "unban_ack", nis=nis)
+
+    async def _reload(self):
+        try:
+            self.bans, self.revoked = await asyncio.to_thread(_load_state)
+            logger.info("Hub state reloaded (%d bans)", len(self.bans))
+        except Exception:
+            logger.exception("Could not reload the hub state")
+
+    # ---- connections
+
+    async def _handler(self, ws):
+        request = getattr(ws, "request", None)
+        path = request.path if request is not None else ws.path
+        params = {k: v[0] for k, v in parse_qs(urlsplit(path).query).items()}
+        if params.get("role") == "proctor":
+            await self._proctor(ws, params)
+        else:
+            await self._student(ws, params)
+
+    async def _student(self, ws, params):
+        session_hash, nis = params.get("hash"), params.get("nis")
+        if not (session_hash and nis) or session_hash in self.revoked:
+            await ws.close(4403, "session rejected")
+            return
+        room = await asyncio.to_thread(_student_room, session_hash, nis)
+        if room is None:
+            await ws.close(4404, "session not found")
+            return
+
+        self.students.setdefault(nis, set()).add(ws)
+        try:
+            ban = self.bans.get(nis)
+            if ban is not None and ban.banned_at is not None:
+                await ws.send(json.dumps({"action": "banned", "reason": ban.reason or "banned"}))
+            else:
+                await ws.send(json.dumps({"action": "connected", "nis": nis}))
+            async for raw in ws:
+                try:
+                    msg = json.loads(raw)
+                except ValueError:
+                    continue
+                action = msg.get("action") or ("violation" if msg.get("eventType") else None)
+                if action == "violation":
+                    await self.violation(nis, room, session_hash, msg.get("reason") or msg.get("eventType") or "violation")
+                elif action == "appeal":
+                    await self.appeal(nis, room, str(msg.get("text", "")))
+                    await ws.send(json.dumps({"action": "appeal_sent", "ok": True}))
+                elif action == "ping":
+                    await ws.send('{"action":"pong"}')
+        finally:
+            sockets = self.students.get(nis)
+            if sockets is not None:
+                sockets.discard(ws)
+                if not sockets:
+                    del self.students[nis]
+
+    async def _proctor(self, ws, params):
+        token = params.get("token")
+        client = ws.remote_address[0] if ws.remote_address else None
+        if not token or await asyncio.to_thread(validate_token, "teacher", token, client) != VALID:
+            await ws.close(4401, "invalid token")
+            return
+        room = params.get("room") or ALL_ROOMS
+        self.rooms.setdefault(room, set()).add(ws)
+        try:
+            await ws.send(json.dumps({"action": "connected", "room": room}))
+            async for raw in ws:
+                try:
+                    msg = json.loads(raw)
+                except ValueError:
+                    continue
+                if msg.get("action") == "unban" and msg.get("nis"):
+                    nis = str(msg["nis"])
+                    # a room's proctor only unbans students of that room; the
+                    # ack goes to the student's room whoever sent the unban
+                    student_room = await asyncio.to_thread(_class_of, nis)
+                    if room != ALL_ROOMS and student_room != room:
+                        await ws.send(json.dumps({"action": "unban_denied", "nis": nis}))
+                        continue
+                    await self.unban(nis, student_room)
+        finally:
+            self.rooms.get(room, set()).discard(ws)
+
+    async def serve(self, host=HUB_HOST, port=HUB_PORT):
+        self._loop = asyncio.get_running_loop()
+        self.bans, self.revoked = await asyncio.to_thread(_load_state)
+        state.subscribe(CHANNEL, self._received)
+        logger.info("Proctor hub listening on %s:%s (%d bans loaded)", host, port, len(self.bans))
+        try:
+            async with websockets.serve(self._handler, host, port, max_size=2 ** 14):
+                await asyncio.Future()
+        finally:
+            for queue in (self.ban_queue, self.appeal_queue):
+                queue.stop()
+
+
+def run_hub(host=HUB_HOST, port=HUB_PORT):
+    asyncio.run(ProctorHub().serve(host, port))
@@ -0,0 +1,107 @@
+"""
+Background maintenance for the hot tables.
+
+Expired tokens are deleted and finished sessions are moved to
+sessions_archive in bounded batches, each in its own short transaction,
+so cleanup never holds a table-wide lock in the middle of an exam. Batches
+are picked with FOR UPDATE SKIP LOCKED, which keeps several app processes
+running the janitor at once from blocking each other.
+"""
+
+import logging
+import threading
+import time
+
+from config import JANITOR_INTERVAL, JANITOR_BATCH, JANITOR_SESSION_GRACE, JANITOR_BATCH_PAUSE
+from db import db_cursor
+
+logger = logging.getLogger(__name__)
+
+PURGE_TOKENS_SQL = """
+DELETE FROM tokens WHERE ctid = ANY(ARRAY(
+    SELECT ctid FROM tokens WHERE expires_at <= NOW() OR %(force)s
+    LIMIT %(limit)s FOR UPDATE SKIP LOCKED
+))
+"""
+
+ARCHIVE_SESSIONS_SQL = """
+WITH moved AS (
+    DELETE FROM sessions WHERE ctid = ANY(ARRAY(
+        SELECT ctid FROM sessions
+        WHERE %(force)s OR (active = FALSE AND COALESCE(finished_at, started_at) < NOW() - %(grace)s * interval '1 second')
+        LIMIT %(limit)s FOR UPDATE SKIP LOCKED
+    ))
+    RETURNING *
+)
+INSERT INTO sessions_archive SELECT moved.*, NOW() FROM moved
+"""
+
+
+def _batched(sql, params, batch_size, pause):
+    total = 0
+    while True:
+        with db_cursor() as (conn, cur):
+            cur.execute(sql, dict(params, limit=batch_size))
+            done = cur.rowcount
+        total += done
+        if done < batch_size:
+            return total
+        time.sleep(pause)
+
+
+def purge_tokens(force=False, batch_size=JANITOR_BATCH, pause=JANITOR_BATCH_PAUSE):
+    """Delete expired tokens (every token with force). Returns the number deleted."""
+    return _batched(PURGE_TOKENS_SQL, {"force": force}, batch_size, pause)
+
+
+def archive_sessions(force=False, grace=JANITOR_SESSION_GRACE, batch_size=JANITOR_BATCH, pause=JANITOR_BATCH_PAUSE):
+    """Move finished sessions (every session with force) to sessions_archive."""
+    return _batched(ARCHIVE_SESSIONS_SQL, {"force": force, "grace": grace}, batch_size, pause)
+
+
+class Janitor:
+    def __init__(self, interval=JANITOR_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None
+        self.runs = 0
+        self.failures = 0
+
+    def run_once(self):
+        started = time.time()
+        stats = {"started_at": started}
+        try:
+            stats["tokens_deleted"] = purge_tokens()
+            stats["sessions_archived"] = archive_sessions()
+        except Exception as e:
+            logger.exception("Janitor run failed")
+            self.failures += 1
+            stats["error"] = str(e)
+        stats["duration"] = round(time.time() - started, 3)
+        self.runs += 1
+        self.last_run = stats
+        return stats
+
+    def stats(self):
+        return {"interval": self.interval, "runs": self.runs, "failures": self.failures, "last_run": self.last_run}
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+
+janitor = Janitor()
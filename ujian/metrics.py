@@ -0,0 +1,340 @@
+"""
+Request instrumentation, sampled profiling and the /metrics endpoint.
+
+install() hooks every request of the app and splits its latency into:
+
+  pool  waiting for a pooled DB connection (db.ManagedPool.getconn);
+  db    running statements (db.TimedCursor);
+  json  encoding JSON bodies (jsonify, through a timed JSON provider);
+  app   everything else: handler code, templates, caches.
+
+Latency, the per-phase split and statements per request are kept as
+histograms per endpoint and served with the pool gauges and per-statement
+totals (db.pool_stats()) on /metrics in the Prometheus text format. Every
+worker process keeps its own numbers, so scrape each worker or run one.
+Streamed responses (the proctor SSE stream) are timed up to their headers.
+
+Requests slower than SLOW_REQUEST are logged with their split. With
+PROFILE_SAMPLE > 0 that fraction of requests also runs under cProfile (or
+pyinstrument), one request at a time per process; the profile of a sampled
+request that turns out slow is written to PROFILE_DIR.
+
+setup_logging() is the one place the logging handlers are configured.
+Every process (gunicorn workers, hub, janitor) appends to the same LOG_FILE
+through a WatchedFileHandler, which reopens the file after an external
+rotation; letting each process rotate it would leave the others writing to
+the renamed file.
+
+/metrics exposes statement text and pool internals, so it (like
+/adminspoolstats) only answers admin_allowed() requests: ADMIN_TOKEN as a
+bearer token, or a direct connection from an ADMIN_ALLOW address.
+"""
+
+import cProfile
+import hmac
+import logging
+import logging.handlers
+import os
+import random
+import threading
+import time
+
+from config import (LOG_FILE, LOG_LEVEL, DB_QUERY_HEADER, SLOW_REQUEST, PROFILE_SAMPLE, PROFILER,
+                    PROFILE_DIR, PROFILE_KEEP, ADMIN_TOKEN, ADMIN_ALLOW)
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+PHASES = ("pool", "db", "json", "app")
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"
+
+_logging_ready = False
+
+
+def setup_logging(level=LOG_LEVEL, log_file=LOG_FILE):
+    """Log to stderr and to LOG_FILE (rotated externally); later calls are no-ops."""
+    global _logging_ready
+    if _logging_ready:
+        return
+    _logging_ready = True
+    root = logging.getLogger()
+    root.setLevel(level)
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    failed = None
+    if log_file:
+        try:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            handlers.append(logging.handlers.WatchedFileHandler(log_file))
+        except OSError as e:
+            failed = e
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+    if failed is not None:
+        # reported once the stderr handler is in place
+        logger.warning("Not logging to %s: %s", log_file, failed)
+
+
+def admin_allowed(request, token=ADMIN_TOKEN, allow=ADMIN_ALLOW):
+    """True for a request carrying the admin bearer token, or made directly from an allowed address."""
+    header = request.headers.get("Authorization", "")
+    if token and header.startswith("Bearer ") and hmac.compare_digest(header[7:].encode(), str(token).encode()):
+        return True
+    # behind a reverse proxy remote_addr is the proxy itself, which proves nothing
+    return request.remote_addr in allow and "X-Forwarded-For" not in request.headers
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, **extra):
+    pairs = list(zip(names, values)) + list(extra.items())
+    return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in pairs) if pairs else ""
+
+
+class Histogram:
+    """Thread-safe histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, values, amount):
+        index = len(self.buckets)
+        for n, bound in enumerate(self.buckets):
+            if amount <= bound:
+                index = n
+                break
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += amount
+
+    def render(self):
+        with self._lock:
+            items = [(values, list(series)) for values, series in self._series.items()]
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, series in sorted(items):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                total += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, values, le=bound)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, values)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, values)} {total}")
+        return lines
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.latency = Histogram("exam_request_seconds", "Request latency up to the response headers.",
+                                 ("endpoint", "method"))
+        self.phases = Histogram("exam_request_phase_seconds", "Request time spent per phase (pool, db, json, app).",
+                                ("endpoint", "phase"))
+        self.queries = Histogram("exam_request_queries", "Statements run per request.", ("endpoint",),
+                                 QUERY_BUCKETS)
+        self.responses = {}  # (endpoint, method, status) -> count
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profiling = threading.Lock()
+
+    # ---- per request
+
+    def add_json(self, seconds):
+        if hasattr(self._local, "json"):
+            self._local.json += seconds
+
+    def _begin(self, query_stats):
+        self._local.started = time.perf_counter()
+        self._local.json = 0.0
+        self._local.profiler = self._start_profiler()
+        query_stats.begin_request()
+        with self._lock:
+            self.in_flight += 1
+
+    def _end(self, query_stats, endpoint, method, status, resp=None):
+        started = self._local.__dict__.pop("started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        json_seconds = self._local.__dict__.pop("json", 0.0)
+        profiler = self._local.__dict__.pop("profiler", None)
+        totals = query_stats.end_request() or {"queries": 0, "db": 0.0, "pool": 0.0}
+        with self._lock:
+            self.in_flight -= 1
+            key = (endpoint, method, str(status))
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+        split = {"pool": totals["pool"], "db": totals["db"], "json": json_seconds}
+        split["app"] = max(0.0, elapsed - sum(split.values()))
+        self.latency.observe((endpoint, method), elapsed)
+        for phase in PHASES:
+            self.phases.observe((endpoint, phase), split[phase])
+        self.queries.observe((endpoint,), totals["queries"])
+        if resp is not None and DB_QUERY_HEADER:
+            resp.headers["X-DB-Queries"] = str(totals["queries"])
+
+        slow = elapsed >= SLOW_REQUEST
+        if slow:
+            logger.warning("Slow request %s %s (%.3fs): %d statements, pool %.3fs, db %.3fs, json %.3fs, app %.3fs",
+                           method, endpoint, elapsed, totals["queries"], split["pool"], split["db"],
+                           split["json"], split["app"])
+        if profiler is not None:
+            self._stop_profiler(profiler, endpoint, elapsed if slow else None)
+
+    # ---- profiling
+
+    def _start_profiler(self):
+        if PROFILE_SAMPLE <= 0 or random.random() >= PROFILE_SAMPLE:
+            return None
+        # one profiler per process: they cannot nest, and a sample is plenty
+        if not self._profiling.acquire(blocking=False):
+            return None
+        try:
+            if PROFILER == "pyinstrument":
+                try:
+                    from pyinstrument import Profiler
+                except ImportError:
+                    pass
+                else:
+                    profiler = Profiler()
+                    profiler.start()
+                    return profiler
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        except Exception:
+            self._profiling.release()
+            logger.exception("Could not start the request profiler")
+            return None
+
+    def _stop_profiler(self, profiler, endpoint, slow_elapsed):
+        try:
+            if isinstance(profiler, cProfile.Profile):
+                profiler.disable()
+            else:
+                profiler.stop()
+            if slow_elapsed is None:
+                return
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            name = "%s-%d-%s-%dms" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid(), endpoint,
+                                      slow_elapsed * 1000)
+            path = os.path.join(PROFILE_DIR, name)
+            if isinstance(profiler, cProfile.Profile):
+                path += ".prof"
+                profiler.dump_stats(path)
+            else:
+                path += ".html"
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+            logger.info("Profile of slow %s written to %s", endpoint, path)
+            self._prune_profiles()
+        except Exception:
+            logger.exception("Could not save the request profile")
+        finally:
+            self._profiling.release()
+
+    @staticmethod
+    def _prune_profiles():
+        paths = [os.path.join(PROFILE_DIR, n) for n in os.listdir(PROFILE_DIR)]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[PROFILE_KEEP:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # ---- exposition
+
+    def render(self, stats):
+        lines = self.latency.render() + self.phases.render() + self.queries.render()
+        with self._lock:
+            responses = sorted(self.responses.items())
+            in_flight = self.in_flight
+        lines += ["# HELP exam_responses_total Responses by endpoint, method and status.",
+                  "# TYPE exam_responses_total counter"]
+        lines += [f"exam_responses_total{_labels(('endpoint', 'method', 'status'), key)} {n}" for key, n in responses]
+        lines += ["# TYPE exam_requests_in_flight gauge", f"exam_requests_in_flight {in_flight}"]
+
+        pool = stats.get("pool")
+        if pool:
+            lines.append("# TYPE exam_db_pool_connections gauge")
+            for state in ("in_use", "idle"):
+                lines.append(f'exam_db_pool_connections{{state="{state}"}} {pool[state]}')
+            lines += [f"exam_db_pool_waiters {pool['waiters']}", f"exam_db_pool_max {pool['max']}"]
+            for key in ("checkouts", "timeouts", "created", "recycled", "broken"):
+                lines += [f"# TYPE exam_db_pool_{key}_total counter", f"exam_db_pool_{key}_total {pool[key]}"]
+            lines.append("# TYPE exam_db_pool_checkout_seconds histogram")
+            lines += [f'exam_db_pool_checkout_seconds_bucket{{le="{le}"}} {n}'
+                      for le, n in pool["checkout_seconds"].items()]
+            lines += [f"exam_db_pool_checkout_seconds_sum {pool['wait_total']:.6f}",
+                      f"exam_db_pool_checkout_seconds_count {pool['checkouts']}"]
+        queries = stats.get("queries") or []
+        for metric, key, kind in (("exam_db_statement_calls_total", "calls", "counter"),
+                                  ("exam_db_statement_seconds_total", "total", "counter"),
+                                  ("exam_db_statement_max_seconds", "max", "gauge")):
+            lines.append(f"# TYPE {metric} {kind}")
+            lines += [f"{metric}{_labels(('query',), (q['query'],))} {q[key]}" for q in queries]
+        return "\n".join(lines) + "\n"
+
+    # ---- flask
+
+    def install(self, app):
+        """Time every request of app, expose /metrics and time JSON encoding."""
+        from flask import Response, request
+        from db import pool_stats, query_stats
+
+        self._time_json(app)
+
+        @app.before_request
+        def beginRequestMetrics():
+            self._begin(query_stats)
+
+        @app.after_request
+        def endRequestMetrics(resp):
+            self._end(query_stats, request.endpoint or "unmatched", request.method, resp.status_code, resp)
+            return resp
+
+        @app.teardown_request
+        def dropRequestMetrics(exc):
+            # after_request is skipped when a response could not be built at all
+            self._end(query_stats, request.endpoint or "unmatched", request.method, 500)
+
+        @app.route("/metrics", methods=["GET"])
+        def getMetrics():
+            if not admin_allowed(request):
+                return Response("forbidden\n", status=403, mimetype="text/plain")
+            return Response(self.render(pool_stats()), mimetype="text/plain; version=0.0.4")
+
+    def _time_json(self, app):
+        try:
+            from flask.json.provider import DefaultJSONProvider
+        except ImportError:
+            # Flask < 2.2: encoding time stays in the "app" phase
+            return
+        metrics = self
+
+        class TimedJSONProvider(DefaultJSONProvider):
+            def dumps(self, obj, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return super().dumps(obj, **kwargs)
+                finally:
+                    metrics.add_json(time.perf_counter() - started)
+
+        provider = TimedJSONProvider(app)
+        for setting in ("ensure_ascii", "sort_keys", "compact", "mimetype"):
+            setattr(provider, setting, getattr(app.json, setting))
+        app.json = provider
+
+
+request_metrics = RequestMetrics()
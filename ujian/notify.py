@@ -0,0 +1,107 @@
+"""
+Postgres LISTEN/NOTIFY listener.
+
+One dedicated connection (outside the pool) LISTENs on every subscribed
+channel and dispatches notifications to callbacks from a daemon thread.
+Callbacks receive the notification payload, or None after a reconnect when
+notifications may have been missed and subscribers should drop their state.
+"""
+
+import logging
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+from config import DB
+
+logger = logging.getLogger(__name__)
+
+
+class Listener:
+    def __init__(self, dsn=None, poll_timeout=5.0, retry_delay=2.0):
+        self._dsn = dsn or DB
+        self._poll_timeout = poll_timeout
+        self._retry_delay = retry_delay
+        self._handlers = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.connected = False
+
+    def subscribe(self, channel, callback):
+        """Register callback(payload) for channel. Safe to call after start()."""
+        with self._lock:
+            self._handlers.setdefault(channel, []).append(callback)
+            self._pending.add(channel)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="pg-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self._poll_timeout + 1)
+        self._thread = None
+
+    def _dispatch(self, channel, payload):
+        with self._lock:
+            handlers = list(self._handlers.get(channel, ()))
+        for cb in handlers:
+            try:
+                cb(payload)
+            except Exception:
+                logger.exception("Listener callback failed for channel %s", channel)
+
+    def _reset_all(self):
+        with self._lock:
+            channels = list(self._handlers)
+        for channel in channels:
+            self._dispatch(channel, None)
+
+    def _listen_pending(self, cur):
+        with self._lock:
+            channels, self._pending = self._pending, set()
+        for channel in channels:
+            cur.execute("LISTEN " + psycopg2.extensions.quote_ident(channel, cur))
+
+    def _run(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self._dsn)
+                conn.set_session(autocommit=True)
+                with self._lock:
+                    self._pending = set(self._handlers)
+                cur = conn.cursor()
+                self._listen_pending(cur)
+                self.connected = True
+                # anything cached before this connection may be stale
+                self._reset_all()
+                while not self._stop.is_set():
+                    if self._pending:
+                        self._listen_pending(cur)
+                    if select.select([conn], [], [], self._poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        note = conn.notifies.pop(0)
+                        self._dispatch(note.channel, note.payload)
+            except Exception:
+                logger.exception("LISTEN connection failed, retrying in %.1fs", self._retry_delay)
+            finally:
+                self.connected = False
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            self._stop.wait(self._retry_delay)
+
+
+listener = Listener()
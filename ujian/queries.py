@@ -0,0 +1,159 @@
+"""
+Prepared statements for the fixed per-request queries.
+
+The student and teacher routes run the same handful of SQL strings on every
+request. Each is registered here once under a name; db_cursor() PREPAREs the
+whole registry on a pooled connection the first time it hands that
+connection out, and execute() then runs the statement by name so Postgres
+skips parsing and planning. A statement that cannot be prepared (or every
+statement, with DB_PREPARE off, e.g. behind a transaction-pooling
+pgbouncer) is simply sent as plain SQL.
+
+Statements are written with psycopg2 %s placeholders; the $n form used for
+PREPARE is derived from them.
+"""
+
+import logging
+import re
+
+from config import DB_PREPARE
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER = re.compile(r"%s")
+
+
+class Statement:
+    __slots__ = ("name", "sql", "nargs", "prepare_sql", "execute_sql")
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.nargs = len(_PLACEHOLDER.findall(sql))
+        counter = iter(range(1, self.nargs + 1))
+        self.prepare_sql = "PREPARE %s AS %s" % (name, _PLACEHOLDER.sub(lambda m: "$%d" % next(counter), sql))
+        self.execute_sql = "EXECUTE %s" % name
+        if self.nargs:
+            self.execute_sql += " (%s)" % ", ".join(["%s"] * self.nargs)
+
+
+STATEMENTS = {}
+
+
+def statement(name, sql):
+    """Register sql under name and return the name."""
+    if name in STATEMENTS:
+        raise ValueError("statement %s already registered" % name)
+    STATEMENTS[name] = Statement(name, sql)
+    return name
+
+
+def prepare_connection(conn):
+    """PREPARE every registered statement this connection has not seen yet."""
+    seen = conn.prepared | conn.prepare_failed
+    if not DB_PREPARE or len(seen) >= len(STATEMENTS):
+        return
+    with conn.cursor() as cur:
+        for name, st in STATEMENTS.items():
+            if name in seen:
+                continue
+            try:
+                cur.execute(st.prepare_sql)
+                conn.commit()
+                conn.prepared.add(name)
+            except Exception:
+                conn.rollback()
+                conn.prepare_failed.add(name)
+                logger.exception("Could not prepare %s, it will run as plain SQL", name)
+
+
+def execute(cur, name, params=()):
+    """Run a registered statement, by name when the connection has it prepared."""
+    st = STATEMENTS[name]
+    if name in getattr(cur.connection, "prepared", ()):
+        cur.execute(st.execute_sql, params)
+    else:
+        cur.execute(st.sql, params)
+
+
+# ---------------------------- student routes
+
+# The partial unique index uniq_active_nis arbitrates concurrent logins:
+# a second active session for the same NIS is skipped instead of inserted,
+# and handed back instead (resumed) when the login carries its special key.
+STUDENT_LOGIN = statement("student_login", """
+WITH student AS (
+    SELECT nis, name, COALESCE(NULLIF(grade, ''), class) AS grade FROM students WHERE nis = %s AND class = %s
+), created AS (
+    INSERT INTO sessions (session_hash, nis, seed, started_at, active, subject, special_key, form_version)
+    SELECT %s, nis, %s, NOW(), TRUE, %s, %s,
+           (SELECT max(version) FROM exam_forms f WHERE f.grade = student.grade AND f.subject = %s)
+    FROM student
+    ON CONFLICT (nis) WHERE active = TRUE DO NOTHING
+    RETURNING nis
+), resumed AS (
+    SELECT s.session_hash, s.seed, s.subject, s.answers, extract(epoch FROM NOW() - s.started_at) AS elapsed
+    FROM sessions s JOIN student ON s.nis = student.nis
+    WHERE s.active = TRUE AND s.special_key = %s
+)
+SELECT student.name, created.nis IS NOT NULL, student.grade,
+       resumed.session_hash, resumed.seed, resumed.subject, resumed.answers::text, resumed.elapsed
+FROM student LEFT JOIN created ON created.nis = student.nis LEFT JOIN resumed ON TRUE
+""")
+
+STUDENT_NAME = statement("student_name", "SELECT name FROM students WHERE nis = %s")
+
+SESSION_GRADE = statement("session_grade", """
+SELECT COALESCE(NULLIF(st.grade, ''), st.class), st.class, s.subject, s.seed, s.layout, s.form_version
+FROM sessions s JOIN students st ON st.nis = s.nis
+WHERE s.session_hash = %s AND s.nis = %s AND s.active = TRUE
+""")
+
+# first writer wins; the layout is deterministic per seed anyway
+SESSION_LAYOUT = statement("session_layout", """
+UPDATE sessions SET layout = COALESCE(layout, %s) WHERE session_hash = %s RETURNING layout
+""")
+
+SESSION_SNAPSHOT = statement("session_snapshot", """
+SELECT answers::text, extract(epoch FROM NOW() - started_at) FROM sessions
+WHERE session_hash = %s AND nis = %s AND active = TRUE
+""")
+
+SESSION_ACTIVE = statement("session_active", "SELECT nis, subject FROM sessions WHERE session_hash = %s AND active = TRUE")
+
+# only an active session: finishing twice must not move finished_at or rescore
+SESSION_FINISH = statement("session_finish", """
+UPDATE sessions s SET active = FALSE, finished_at = NOW() FROM students st
+WHERE st.nis = s.nis AND s.session_hash = %s AND s.nis = %s AND s.active = TRUE
+RETURNING s.subject, COALESCE(NULLIF(st.grade, ''), st.class), s.form_version
+""")
+
+SESSION_FINISHED = statement("session_finished", """
+SELECT 1 FROM sessions WHERE session_hash = %s AND nis = %s AND finished_at IS NOT NULL
+""")
+
+# latest published version of each form, answer-free (forms.py)
+FORMS_BY_GRADE = statement("forms_by_grade", """
+SELECT DISTINCT ON (subject) subject, rendered::text, version FROM exam_forms
+WHERE grade = %s ORDER BY subject, version DESC
+""")
+
+FORMS_BY_GRADE_SUBJECT = statement("forms_by_grade_subject", """
+SELECT subject, rendered::text, version FROM exam_forms
+WHERE grade = %s AND subject = %s ORDER BY version DESC LIMIT 1
+""")
+
+# the version a session was pinned to at login
+FORM_VERSION = statement("form_version", """
+SELECT subject, rendered::text, version FROM exam_forms
+WHERE grade = %s AND subject = %s AND version = %s
+""")
+
+# ---------------------------- teacher routes
+
+TEACHER_NAME = statement("teacher_name", "SELECT name FROM teachers WHERE id = %s")
+
+TOKEN_VALIDATE = statement(
+    "token_validate",
+    "SELECT expires_at > NOW(), extract(epoch FROM expires_at) FROM tokens WHERE token_type = %s AND token = %s",
+)
@@ -0,0 +1,292 @@
+"""
+Exam progress and scores for the teacher dashboard.
+
+The sessions trigger track_exam_progress keeps two rollups current as
+students start and finish:
+
+  exam_results   one row per (subject, nis) with start/finish time and score
+  exam_progress  started/finished counters per (subject, grade, class)
+
+so dashboard reads are a scan of a few hundred counter rows or an index
+range over one grade, never a scan of sessions or answers. Scores are
+written when a session finishes, and regrade() re-scores a whole grade in
+one vectorized pass after a key correction.
+"""
+
+import logging
+import threading
+import time
+
+from psycopg2.extras import execute_values
+from answers import latest_answers
+from config import DASHBOARD_CACHE_TTL, ROSTER_CACHE_TTL
+from db import db_cursor
+
+logger = logging.getLogger(__name__)
+
+
+class _TimedValue:
+    """A value reloaded at most once per `ttl` seconds, shared by all threads."""
+
+    def __init__(self, ttl, loader):
+        self.ttl = ttl
+        self._loader = loader
+        self._value = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._value is None or time.monotonic() - self._loaded_at >= self.ttl:
+                self._value = self._loader()
+                self._loaded_at = time.monotonic()
+            return self._value
+
+    def clear(self):
+        with self._lock:
+            self._value = None
+
+
+def _load_roster():
+    """{grade: {class: total_students}} and {subject: set(grades)}."""
+    roster = {}
+    subject_grades = {}
+    with db_cursor() as (conn, cur):
+        cur.execute("SELECT grade, class, count(*) FROM students GROUP BY grade, class")
+        for grade, class_, total in cur.fetchall():
+            roster.setdefault(grade, {})[class_] = total
+        cur.execute("SELECT DISTINCT subject, grade FROM exam_forms UNION SELECT DISTINCT subject, grade FROM exam_progress")
+        for subject, grade in cur.fetchall():
+            subject_grades.setdefault(subject, set()).add(grade)
+    return roster, subject_grades
+
+
+def _load_progress():
+    with db_cursor() as (conn, cur):
+        cur.execute("SELECT subject, grade, class, started, finished FROM exam_progress")
+        return cur.fetchall()
+
+
+_roster = _TimedValue(ROSTER_CACHE_TTL, _load_roster)
+_progress = _TimedValue(DASHBOARD_CACHE_TTL, _load_progress)
+
+
+def subject_grades():
+    """{subject: set(grades)} of every form and every started exam, cached for ROSTER_CACHE_TTL."""
+    return _roster.get()[1]
+
+
+def _class_key(class_):
+    return (len(class_), class_)
+
+
+def dashboard_summary():
+    """Per-subject stats and room lists in the shape teacherdashboard.html renders."""
+    roster, subject_grades = _roster.get()
+    progress = {}
+    for subject, grade, class_, started, finished in _progress.get():
+        progress.setdefault(subject, {})[(grade, class_)] = (started, finished)
+
+    resources = []
+    for subject in sorted(set(subject_grades) | set(progress)):
+        counts = progress.get(subject, {})
+        grades = subject_grades.get(subject, set()) | {g for g, _ in counts}
+        total = sum(sum(roster.get(g, {}).values()) for g in grades)
+        started = sum(s for s, _ in counts.values())
+        finished = sum(f for _, f in counts.values())
+
+        grade_data = {}
+        for grade in sorted(grades, key=_class_key):
+            rooms = sorted(roster.get(grade, {}), key=_class_key)
+            submitted = [c for c in rooms if counts.get((grade, c), (0, 0))[1] > 0]
+            grade_data[grade] = {"rooms": rooms, "submitted": submitted}
+
+        resources.append({
+            "name": subject,
+            "data": {
+                "stats": [
+                    {"title": "Siswa Belum Mengerjakan", "value": max(total - started, 0)},
+                    {"title": "Siswa Mengerjakan", "value": started - finished},
+                    {"title": "Siswa Selesai", "value": finished},
+                ],
+                "gradeData": grade_data,
+            },
+        })
+    return resources
+
+
+def _student_row(nis, name, correct, total, pct, finished_at):
+    return {
+        "nis": nis,
+        "name": name,
+        "correct_answers": correct,
+        "total_questions": total,
+        "score_percentage": float(pct) if pct is not None else None,
+        "submission_time": finished_at.isoformat() if finished_at else None,
+    }
+
+
+def grade_results(subject, grade):
+    """Finished students of one subject/grade grouped by class."""
+    roster, _ = _roster.get()
+    classes = {c: [] for c in roster.get(grade, {})}
+    with db_cursor() as (conn, cur):
+        cur.execute(
+            "SELECT class, nis, name, correct_answers, total_questions, score_percentage, finished_at "
+            "FROM exam_results WHERE subject = %s AND grade = %s AND finished_at IS NOT NULL ORDER BY class, nis",
+            (subject, grade),
+        )
+        for class_, *row in cur.fetchall():
+            classes.setdefault(class_, []).append(_student_row(*row))
+    return [
+        {"class": c, "total_students": roster.get(grade, {}).get(c, len(students)), "students_submitted": students}
+        for c, students in sorted(classes.items(), key=lambda kv: _class_key(kv[0]))
+    ]
+
+
+_LISTING_COLUMNS = "class, nis, name, correct_answers, total_questions, score_percentage, finished_at"
+
+
+def _listing_query(subject, grade, classe, after):
+    """Keyset query over exam_results_listing, ordered by (class, nis)."""
+    sql = (
+        f"SELECT {_LISTING_COLUMNS} FROM exam_results "
+        "WHERE subject = %s AND grade = %s AND finished_at IS NOT NULL AND (class, nis) > (%s, %s)"
+    )
+    params = [subject, grade, *(after or ("", ""))]
+    if classe is not None:
+        sql += " AND class = %s"
+        params.append(classe)
+    return sql + " ORDER BY class, nis", params
+
+
+def _listing_row(class_, *row):
+    out = _student_row(*row)
+    out["class"] = class_
+    return out
+
+
+def parse_cursor(value):
+    """Decode an X-Next-Cursor value ("class,nis") into a keyset position."""
+    if not value:
+        return None
+    class_, sep, nis = value.partition(",")
+    if not sep:
+        raise ValueError("cursor must be 'class,nis'")
+    return class_, nis
+
+
+def student_page(subject, grade, classe=None, after=None, limit=50):
+    """One page of finished students and the cursor of the next page (or None)."""
+    sql, params = _listing_query(subject, grade, classe, after)
+    with db_cursor() as (conn, cur):
+        cur.execute(sql + " LIMIT %s", (*params, limit + 1))
+        rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1][0]},{rows[-1][1]}"
+    return [_listing_row(*r) for r in rows], next_cursor
+
+
+def iter_students(subject, grade, classe=None, after=None, itersize=500):
+    """Yield every finished student through a server-side cursor."""
+    sql, params = _listing_query(subject, grade, classe, after)
+    with db_cursor(commit=False) as (conn, cur):
+        named = conn.cursor(name="exam_results_listing")
+        named.itersize = itersize
+        try:
+            named.execute(sql, params)
+            for row in named:
+                yield _listing_row(*row)
+        finally:
+            named.close()
+
+
+# ---------------------------- scoring
+# grading pulls in numpy, so it is imported on the first score, not at boot
+
+_keys = {}
+_keys_lock = threading.Lock()
+
+
+def answer_key(cur, grade, subject, version=None):
+    """Compiled AnswerKey for (grade, subject) at version (None: the latest form), or None."""
+    from grading import AnswerKey
+    with _keys_lock:
+        key = _keys.get((grade, subject, version))
+    if key is not None:
+        return key
+    if version is None:
+        cur.execute(
+            "SELECT payload FROM exam_forms WHERE grade = %s AND subject = %s ORDER BY version DESC LIMIT 1",
+            (grade, subject),
+        )
+    else:
+        cur.execute("SELECT payload FROM exam_forms WHERE grade = %s AND subject = %s AND version = %s",
+                    (grade, subject, version))
+    row = cur.fetchone()
+    if not row:
+        return None
+    key = AnswerKey(row[0])
+    with _keys_lock:
+        _keys[(grade, subject, version)] = key
+    return key
+
+
+def on_forms_notify(payload):
+    """Listener callback for exam_forms: drop compiled keys of the changed grade."""
+    with _keys_lock:
+        for k in [k for k in _keys if payload is None or k[0] == payload]:
+            del _keys[k]
+
+
+_UPDATE_SCORES_SQL = """
+UPDATE exam_results r SET session_hash = v.session_hash, correct_answers = v.correct, total_questions = v.total,
+    score = v.score, score_percentage = v.pct
+FROM (VALUES %s) AS v(subject, nis, session_hash, correct, total, score, pct)
+WHERE r.subject = v.subject AND r.nis = v.nis
+"""
+
+
+def _write_scores(cur, subject, sessions, result):
+    """sessions: (nis, session_hash) per scored student; the row is pointed at the session it was scored from."""
+    rows = [(subject, nis, session_hash, *scores) for (nis, session_hash), scores in zip(sessions, result.rows())]
+    execute_values(cur, _UPDATE_SCORES_SQL, rows, template="(%s, %s, %s, %s, %s, %s::numeric, %s::numeric)")
+
+
+def record_score(cur, session_hash, nis, grade, subject, version=None):
+    """Score a finished session inside the caller's transaction, against the form version it was served."""
+    from grading import GradeResult
+    key = answer_key(cur, grade, subject, version)
+    if key is None:
+        logger.warning("No form for %s/%s, session %s left unscored", grade, subject, session_hash)
+        return None
+    answers = latest_answers(cur, [session_hash])[session_hash]
+    result = GradeResult(key, key.fractions(key.encode([answers])))
+    _write_scores(cur, subject, [(nis, session_hash)], result)
+    return next(result.rows())
+
+
+def regrade(subject, grade):
+    """Re-score every finished student of a subject/grade against the current key.
+
+    Unlike record_score this ignores the version each session was pinned to:
+    publishing a corrected key and regrading is how a correction is applied.
+    """
+    from grading import GradeResult
+    with db_cursor() as (conn, cur):
+        on_forms_notify(grade)
+        key = answer_key(cur, grade, subject)
+        if key is None:
+            raise ValueError(f"no exam form for {grade}/{subject}")
+        cur.execute(
+            "SELECT nis, session_hash FROM exam_results WHERE subject = %s AND grade = %s AND finished_at IS NOT NULL",
+            (subject, grade),
+        )
+        rows = cur.fetchall()
+        answers = latest_answers(cur, [h for _, h in rows])
+        result = GradeResult(key, key.fractions(key.encode([answers[h] for _, h in rows])))
+        if rows:
+            _write_scores(cur, subject, rows, result)
+    return {"subject": subject, "grade": grade, "graded": len(rows)}
@@ -1,11 +1,20 @@
 from flask import Blueprint, request, jsonify, render_template
 from db import db_cursor
-import hashlib, uuid, json
+from queries import execute, STUDENT_LOGIN, STUDENT_NAME, SESSION_GRADE, SESSION_LAYOUT, SESSION_FINISH, SESSION_FINISHED
+from shuffle import make_layout, layout_header
+from formcache import form_cache, cached_response
+from schedule import timetable
+from answers import answer_queue, session_cache, submit_answers, session_snapshot, remaining_time
+from results import record_score
+from violations import ingest as ingest_violations
+import hashlib, uuid, json, logging
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
 
 #url = '/' + hashlib.sha512(uuid.uuid4().hex.encode()).hexdigest()
 bp = Blueprint("student", __name__)
 
-
 @bp.route("/", methods=["GET", "POST"])  # directed to here
 def examLogin():
     if request.method != "POST":
@@ -16,39 +25,39 @@ def examLogin():
     class_ = req.get("class")
     subject = req.get("subject")
     nis = req.get("nis")
+    resume_key = req.get("special-key") or None
     if not (class_ and subject and nis):
         return jsonify({"ok": False, "error": " Kelas atau NIS atau Mata Pelajaran tidak boleh kosong"}), 400
 
-    with db_cursor() as (conn, cur):
-        # check the student exists
-        cur.execute("SELECT * FROM students WHERE nis = %s AND class = %s", (nis, class_))
-        if not cur.fetchone():
-            return jsonify({"status": 404, "message": f"Siswa dengan NIS {nis} tidak ditemukan dalam {class_}."}), 404
-
-        # Check the student does not have an active session
-        cur.execute("SELECT * FROM sessions WHERE nis = %s AND active = TRUE", (nis,))
-        if cur.fetchone():
-            return jsonify({"status": 409, "message": f"Siswa dengan NIS {nis} sudah memiliki sesi aktif."}), 409
-
+    seed = str(uuid.uuid4()).replace("-", "")
+    combined = ":".join(str([nis, class_, subject, seed]))
+    combined_hash = hashlib.sha512(combined.encode("utf-8")).hexdigest()
+    special_key = seed[:4] + combined_hash[:4]
 
-        cur.execute("SELECT name FROM students WHERE nis = %s", (nis,))
-        student_name = cur.fetchone()
-        if student_name:
-            student_name = student_name[0]
-        else:
-            student_name = "Unknown"
+    if resume_key:
+        # the snapshot handed back must include what this process still has queued
+        answer_queue.flush()
 
-        seed = str(uuid.uuid4()).replace("-", "")
-        combined = ":".join(str([nis, class_, student_name, subject, seed]))
-        combined_hash = hashlib.sha512(combined.encode("utf-8")).hexdigest()
-        special_key = seed[:4] + combined_hash[:4]
-        
-        cur.execute(
-            "INSERT INTO sessions (session_hash, nis, seed, started_at, active, subject, special_key) VALUES (%s, %s, %s, NOW(), %s, %s, %s)",
-            (combined_hash, nis, seed, True, subject, special_key),
-        )
+    with db_cursor() as (conn, cur):
+        # existence check, active-session conflict, insert and resume in one round trip
+        execute(cur, STUDENT_LOGIN, (nis, class_, combined_hash, seed, subject, special_key, subject, resume_key))
+        row = cur.fetchone()
+        if not row:
+            return jsonify({"status": 404, "message": f"Siswa dengan NIS {nis} tidak ditemukan dalam {class_}."}), 404
 
-        return jsonify({"status": 200, "message": f"Akses diterima, Halo {student_name}", "exam-hash": combined_hash, "exam-seed": seed, "exam-special-key": special_key}), 200
+        student_name, created, grade, resumed_hash, resumed_seed, resumed_subject, answers, elapsed = row
+        if created and not timetable.allows(grade, class_, subject):
+            # undo the insert: no session outside the subject's slot
+            conn.rollback()
+            return jsonify({"status": 403, "message": f"Ujian {subject} untuk kelas {class_} tidak sedang berlangsung."}), 403
+        if created:
+            # mark it active for every node, so the first autosave skips the session lookup
+            session_cache.remember(combined_hash, nis, subject)
+            return jsonify({"status": 200, "message": f"Akses diterima, Halo {student_name}", "exam-hash": combined_hash, "exam-seed": seed, "exam-special-key": special_key, "exam-remaining": remaining_time(0)}), 200
+        if resumed_hash:
+            session_cache.remember(resumed_hash, nis, resumed_subject)
+            return jsonify({"status": 200, "message": f"Sesi dilanjutkan, Halo {student_name}", "exam-hash": resumed_hash, "exam-seed": resumed_seed, "exam-special-key": resume_key, "exam-subject": resumed_subject, "exam-answers": json.loads(answers), "exam-remaining": remaining_time(elapsed)}), 200
+        return jsonify({"status": 409, "message": f"Siswa dengan NIS {nis} sudah memiliki sesi aktif. Masukkan kunci khusus untuk melanjutkan.", "resume": True}), 409
 
 @bp.route("/whoami", methods=["POST"])  # done
 def whoAmI():
@@ -60,7 +69,7 @@ def whoAmI():
     if not id:
         return jsonify({"ok": False, "error": "missing exam_id"}), 400
     with db_cursor() as (conn, cur):
-        cur.execute("SELECT name FROM students WHERE nis = %s", (id,))
+        execute(cur, STUDENT_NAME, (id,))
         student = cur.fetchone()
         if not student:
             return jsonify({"ok": False, "error": "student not found"}), 404
@@ -70,56 +79,104 @@ def whoAmI():
 def examDo():
     if request.method == "GET":
         return render_template("examsession.html")
-    
-    if request.method != "POST":
-        req = request.get_json(force=True)
-        session_hash = req.get("hash")
-        nis = req.get("nis")
 
-        if not (session_hash and nis):
-            return jsonify({"ok": False, "error": "missing"}), 400
+    req = request.get_json(force=True)
+    session_hash = req.get("hash")
+    nis = req.get("nis")
 
+    if not (session_hash and nis):
+        return jsonify({"ok": False, "error": "missing"}), 400
+
+    with db_cursor() as (conn, cur):
+        # validate active session and resolve the student's grade in one query
+        execute(cur, SESSION_GRADE, (session_hash, nis))
+        row = cur.fetchone()
+    if not row:
+        return jsonify({"status": 404, "message": "Exam session not found"}), 404
+    grade, class_, subject, seed, layout, version = row
+    if not grade:
+        return jsonify({"status": 404, "message": f"Grade not found for student {nis}"}), 404
+    if not timetable.allows(grade, class_, subject):
+        return jsonify({"status": 403, "message": f"Ujian {subject} tidak sedang berlangsung."}), 403
+
+    # only the session's own form, served pre-serialized from memory; the connection is already released
+    entry = form_cache.get(grade, subject, version)
+    if subject not in entry.shapes:
+        # an empty payload would leave the page on its built-in sample exam
+        return jsonify({"status": 404, "message": f"Form {subject} is not published"}), 404
+    if layout is None:
+        # once per session: shuffle from the seed and keep it for later requests
         with db_cursor() as (conn, cur):
-            # validate active session
-            cur.execute(
-                "SELECT 1 FROM sessions WHERE session_hash = %s AND nis = %s AND active = TRUE",
-                (session_hash, nis),
-            )
-            if not cur.fetchone():
-                return jsonify({"status": 404, "message": "Exam session not found"}), 404
-
-            # find student's grade (try common column names)
-            cur.execute("SELECT grade FROM students WHERE nis = %s", (nis,))
-            row = cur.fetchone()
-            grade = row[0] if row else None
-
-            if not grade:
-                cur.execute("SELECT class FROM students WHERE nis = %s", (nis,))
-                row = cur.fetchone()
-                grade = row[0] if row else None
-
-            if not grade:
-                return jsonify({"status": 404, "message": f"Grade not found for student {nis}"}), 404
-
-            # fetch all forms for the grade and embed JSON payloads
-            cur.execute("SELECT subject, payload FROM exam_forms WHERE grade = %s", (grade,))
-            rows = cur.fetchall()
-
-            forms = {}
-            for subject, payload in rows:
-                try:
-                    # payload may already be a dict (jsonb) or a JSON string
-                    if isinstance(payload, (str, bytes)):
-                        data = json.loads(payload)
-                    else:
-                        data = payload
-                except Exception:
-                    # fallback: return raw payload if parsing fails
-                    data = payload
-                forms[subject] = data
-
-            return jsonify({"status": 200, "grade": grade, "forms": forms}), 200
-    return jsonify({"ok": False, "message": "Method not allowed."}), 405
+            execute(cur, SESSION_LAYOUT, (make_layout(seed, entry.shapes[subject]), session_hash))
+            layout = cur.fetchone()[0]
+    resp = cached_response(entry)
+    resp.headers["X-Exam-Subject"] = quote(subject)
+    if layout is not None:
+        resp.headers["X-Exam-Layout"] = layout_header(layout)
+    return resp
+
+@bp.route("/resume", methods=["POST"])
+def examResume():
+    """
+    { "hash": "...", "nis": "2***" } -> { "answers": {...}, "remaining": seconds }
+    The page calls this after a reload to get back the answers saved so far.
+    """
+    req = request.get_json(force=True)
+    session_hash = req.get("hash")
+    nis = req.get("nis")
+
+    if not (session_hash and nis):
+        return jsonify({"ok": False, "error": "missing"}), 400
+
+    snapshot = session_snapshot(session_hash, nis)
+    if snapshot is None:
+        return jsonify({"status": 404, "message": "Exam session not found"}), 404
+    answers, remaining = snapshot
+    return jsonify({"ok": True, "answers": answers, "remaining": remaining}), 200
+
+@bp.route("/submit", methods=["POST"])
+def examSubmit():
+    """
+    { "hash": "...", "nis": "2***", "answers": {"1": 2, "2": [1, 3]}, "final": false }
+    """
+    req = request.get_json(force=True)
+    session_hash = req.get("hash")
+    nis = req.get("nis")
+
+    if not (session_hash and nis):
+        return jsonify({"ok": False, "error": "missing"}), 400
+
+    try:
+        queued = submit_answers(session_hash, nis, req.get("answers") or {})
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    if queued is None:
+        return jsonify({"status": 404, "message": "Exam session not found"}), 404
+
+    if req.get("final"):
+        answer_queue.flush()
+    return jsonify({"ok": True, "queued": queued}), 202
+
+@bp.route("/violations", methods=["POST"])
+def examViolations():
+    """
+    { "hash": "...", "nis": "2***", "events": [{"type": "windowBlur", "ts": 1700000000000}] }
+    Sent with navigator.sendBeacon, so the body may arrive as text/plain.
+    """
+    req = request.get_json(force=True, silent=True) or {}
+    session_hash = req.get("hash")
+    nis = req.get("nis")
+
+    if not (session_hash and nis):
+        return jsonify({"ok": False, "error": "missing"}), 400
+
+    try:
+        accepted = ingest_violations(session_hash, nis, req.get("events") or [])
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    if accepted is None:
+        return jsonify({"status": 404, "message": "Exam session not found"}), 404
+    return jsonify({"ok": True, "accepted": accepted}), 202
 
 @bp.route("/finish", methods=["POST"])  # done
 def examFinish():
@@ -133,11 +190,28 @@ def examFinish():
     if not (session_hash and nis):
         return jsonify({"ok": False, "error": "missing"}), 400
 
+    # make this node's queued autosaves durable before the session closes;
+    # ones still queued on other nodes rescore the session when they are written
+    answer_queue.flush()
+    session_cache.forget(session_hash)
+
     with db_cursor() as (conn, cur):
-        cur.execute("SELECT * FROM sessions WHERE session_hash = %s AND nis = %s", (session_hash, nis))
-        if not cur.fetchone():
+        execute(cur, SESSION_FINISH, (session_hash, nis))
+        row = cur.fetchone()
+        if not row:
+            # a repeated finish (a retry, a second tab) gets the same answer, unscored
+            execute(cur, SESSION_FINISHED, (session_hash, nis))
+            if cur.fetchone():
+                return jsonify({"status": 200, "message": "Exam already finished"}), 200
             return jsonify({"status": 404, "message": "Exam session not found"}), 404
 
-        cur.execute("UPDATE sessions SET active = FALSE WHERE session_hash = %s AND nis = %s", (session_hash, nis))
+        subject, grade, version = row
+        # scoring must never keep a student from finishing
+        cur.execute("SAVEPOINT score")
+        try:
+            record_score(cur, session_hash, nis, grade, subject, version)
+        except Exception:
+            logger.exception("Failed to score session %s", session_hash)
+            cur.execute("ROLLBACK TO SAVEPOINT score")
 
         return jsonify({"status": 200, "message": "Exam finished"}), 200
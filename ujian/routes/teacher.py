@@ -1,31 +1,13 @@
-from flask import Blueprint, request, jsonify, render_template
+from flask import Blueprint, Response, request, jsonify, render_template
 from db import db_cursor
-import hashlib, uuid, json
-import uuid
-import logging
-from zipfile import Path
-from flask import jsonify, request, render_template, send_from_directory
-from psycopg2 import pool, sql
-import psycopg2.extras as extras
-import json
-import sys
-import os
-from functools import lru_cache
-import yaml
-import hashlib
-import atexit
-import random
-import string
-from datetime import datetime, time, timezone, timedelta
-from contextlib import contextmanager
-from typing import Iterator, Tuple, Any, Dict, Optional
-from flask_cors import CORS
-import argparse
-from pathlib import Path
-from flask import Flask
-from flask_cors import CORS
-import logging, os, yaml, json
-from psycopg2 import pool
+from queries import execute, TEACHER_NAME
+from janitor import janitor, purge_tokens, archive_sessions
+from tokens import token_cache, validate_token, VALID, INVALID, EXPIRED, THROTTLED
+from events import stream as event_stream, ALL_ROOMS
+from forms import publish_form, FormError
+from results import dashboard_summary, grade_results, iter_students, parse_cursor, student_page
+import hashlib, uuid, json, random, string
+from datetime import datetime, timezone, timedelta
 
 #url = '/' + hashlib.sha512(uuid.uuid4().hex.encode()).hexdigest()
 bp = Blueprint("teacher", __name__)
@@ -52,16 +34,16 @@ def teacherLogin():
                 return jsonify({"ok": False, "message": "Coba lagi."}), 400
 
         try:
-            with db_cursor() as (conn, cur):
-                cur.execute("SELECT 1 FROM tokens WHERE token_type=%s AND token=%s", ("teacher", token))
-                if not cur.fetchone():
-                    return jsonify({"ok": False, "message": "Token tidak valid"}), 401
-                
-                cur.execute("SELECT 1 FROM tokens WHERE token_type=%s AND token=%s AND expires_at > NOW()", ("teacher", token))
-                if not cur.fetchone():
-                    return jsonify({"ok": False, "message": "Token telah kedaluwarsa"}), 401
+            status = validate_token("teacher", token, request.remote_addr)
+            if status == THROTTLED:
+                return jsonify({"ok": False, "message": "Terlalu banyak percobaan, coba lagi."}), 429
+            if status == INVALID:
+                return jsonify({"ok": False, "message": "Token tidak valid"}), 401
+            if status == EXPIRED:
+                return jsonify({"ok": False, "message": "Token telah kedaluwarsa"}), 401
 
-                cur.execute("SELECT name FROM teachers WHERE id=%s", (teacher,))
+            with db_cursor() as (conn, cur):
+                execute(cur, TEACHER_NAME, (teacher,))
                 row = cur.fetchone()
                 if not row:
                     return jsonify({"ok": False, "message": "Guru tidak ditemukan"}), 404
@@ -142,166 +124,7 @@ def teacherDashboard():
         """
     
     if request.method == 'POST':
-        resources = [
-            {
-                "name": "Matematika",
-                "data": {
-                    "stats": [
-                        {
-                            "title": "Siswa Belum Mengerjakan",
-                            "value": 280
-                        },
-                        {
-                            "title": "Siswa Mengerjakan",
-                            "value": 20
-                        }
-                    ],
-                    "gradeData": {
-                        "X": {
-                            "rooms": [
-                                "E1",
-                                "E2",
-                                "E3",
-                                "E4",
-                                "E5",
-                                "E6",
-                                "E7",
-                                "E8",
-                                "E9"
-                            ],
-                            "submitted": [
-                                "E1",
-                                "E2",
-                                "E3",
-                                "E4",
-                                "E5",
-                                "E6",
-                                "E7",
-                                "E8",
-                                "E9"
-                            ]
-                        },
-                        "XI": {
-                            "rooms": [
-                                "F1",
-                                "F2",
-                                "F3",
-                                "F4",
-                                "F5",
-                                "F6",
-                                "F7",
-                                "F8",
-                                "F9"
-                            ],
-                            "submitted": [
-                                "F1",
-                                "F2",
-                                "F3",
-                                "F4",
-                                "F5",
-                                "F6",
-                                "F7",
-                                "F8",
-                                "F9"
-                            ]
-                        },
-                        "XII": {
-                            "rooms": [
-                                "F1",
-                                "F2",
-                                "F3",
-                                "F4",
-                                "F5",
-                                "F6",
-                                "F7",
-                                "F8"
-                            ],
-                            "submitted": [
-                                "F1"
-                            ]
-                        }
-                    }
-                }
-            },
-            {
-                "name": "Bahasa Inggris",
-                "data": {
-                    "stats": [
-                        {
-                            "title": "Siswa Belum Mengerjakan",
-                            "value": 200
-                        },
-                        {
-                            "title": "Siswa Mengerjakan",
-                            "value": 100
-                        }
-                    ],
-                    "gradeData": {
-                        "X": {
-                            "rooms": [
-                                "E1",
-                                "E2",
-                                "E3",
-                                "E4",
-                                "E5",
-                                "E6",
-                                "E7",
-                                "E8",
-                                "E9"
-                            ],
-                            "submitted": [
-                                "E1",
-                                "E2",
-                                "E3",
-                                "E4",
-                                "E5",
-                                "E6",
-                                "E7",
-                                "E8",
-                                "E9"
-                            ]
-                        },
-                        "XI": {
-                            "rooms": [
-                                "F1",
-                                "F2",
-                                "F3",
-                                "F4",
-                                "F5",
-                                "F6",
-                                "F7",
-                                "F8",
-                                "F9"
-                            ],
-                            "submitted": [
-                                "F1",
-                                "F2",
-                                "F3",
-                                "F4",
-                                "F5"
-                            ]
-                        },
-                        "XII": {
-                            "rooms": [
-                                "F1",
-                                "F2",
-                                "F3",
-                                "F4",
-                                "F5",
-                                "F6",
-                                "F7",
-                                "F8"
-                            ],
-                            "submitted": [
-                                "F1"
-                            ]
-                        }
-                    }
-                }
-            }
-        ]
-        
-        return jsonify(resources), 200
+        return jsonify(dashboard_summary()), 200
     
     return jsonify({"ok": False, "message": "Method not allowed."}), 405
 
@@ -310,117 +133,46 @@ def teacherSubjectGrade(subject, grade):
     """
     Get list of classes for a specific subject and grade
     """
-    # Produce randomized students_submitted for each class
-    total_questions = 50
-    prefixes = ["2324100", "2425100", "2526100"]
-    used_nis = set()
-
-    classes = [
-        {"class": "E1", "total_students": 30},
-        {"class": "E2", "total_students": 32},
-        {"class": "E3", "total_students": 28},
-        {"class": "E4", "total_students": 28},
-        {"class": "E5", "total_students": 28},
-        {"class": "E6", "total_students": 28},
-        {"class": "E7", "total_students": 28},
-        {"class": "E8", "total_students": 28},
-        {"class": "E9", "total_students": 28},
-    ]
-
-    # Base submission time; each student's submission_time will be within 2 hours from here
-    base_time = datetime(2024, 6, 15, 10, 0, tzinfo=timezone.utc)
+    return jsonify(grade_results(subject, grade)), 200
 
-    data = []
-    for cls in classes:
-        # number of students who submitted for this class (1..min(10, total_students))
-        submitted_count = random.randint(1, min(random.randint(1, cls["total_students"]), cls["total_students"]))
-        students = []
-        for j in range(submitted_count):
-            # generate mostly-unique NIS for this dataset
-            attempts = 0
-            while True:
-                prefix = random.choice(prefixes)
-                suffix = f"{random.randint(0, 99):02d}"
-                nis_candidate = prefix + suffix
-                if nis_candidate not in used_nis:
-                    used_nis.add(nis_candidate)
-                    nis = nis_candidate
-                    break
-                attempts += 1
-                if attempts > 200:
-                    nis = f"{prefix}{suffix}{j}"
-                    break
-
-            correct = random.randint(0, total_questions)
-            offset_seconds = random.randint(0, 2 * 3600)
-            submission_time = (base_time + timedelta(seconds=offset_seconds)).isoformat()
-            # calculate percentage score (guard against division by zero)
-            score_percentage = round((correct / total_questions) * 100, 2) if total_questions else 0.0
+def _studentListing(subject, grade, classe=None):
+    """
+    ?after=<class,nis>&limit=50 -> one keyset page, next cursor in X-Next-Cursor
+    ?stream=1 -> the whole listing streamed as a JSON array
+    """
+    try:
+        after = parse_cursor(request.args.get("after"))
+        limit = min(max(int(request.args.get("limit", 50)), 1), 1000)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
 
-            students.append({
-                "nis": nis,
-                "name": f"Student {cls['class']}-{j+1}",
-                "correct_answers": correct,
-                "total_questions": total_questions,
-                "score_percentage": score_percentage,
-                "submission_time": submission_time
-            })
+    if request.args.get("stream") in ("1", "true"):
+        def generate():
+            yield "["
+            for n, row in enumerate(iter_students(subject, grade, classe, after)):
+                yield ("," if n else "") + json.dumps(row, ensure_ascii=False)
+            yield "]"
+        return Response(generate(), mimetype="application/json")
 
-        data.append({
-            "class": cls["class"],
-            "total_students": cls["total_students"],
-            "students_submitted": students
-        })
+    rows, next_cursor = student_page(subject, grade, classe, after, limit)
+    resp = jsonify(rows)
+    if next_cursor:
+        resp.headers["X-Next-Cursor"] = next_cursor
+    return resp, 200
 
-    return jsonify(data), 200
+@bp.route("/dashboard/<subject>/<grade>/students")
+def teacherSubjectGradeStudents(subject, grade):
+    """
+    Get every finished student of a subject and grade, ordered by class and NIS
+    """
+    return _studentListing(subject, grade)
 
-@bp.route("/dashboard/<subject>/<grade>/<class>")
+@bp.route("/dashboard/<subject>/<grade>/<classe>")
 def teacherSubjectGradeClass(subject, grade, classe):
     """
     Get list of students for a specific subject, grade, and class
     """
-    # Generate a randomized list of students (indices 0..50 inclusive)
-    total_questions = 50
-    entries_count = 50
-    prefixes = ["2324100", "2425100", "2526100"]
-    used_nis = set()
-    data = []
-
-    # Base submission time (example reference); submission_time will be within a 2-hour window
-    base_time = datetime(2024, 6, 15, 10, 0, tzinfo=timezone.utc)
-
-    for i in range(entries_count):
-        # create a (mostly) unique NIS using the given prefixes and a two-digit suffix
-        attempts = 0
-        while True:
-            prefix = random.choice(prefixes)
-            suffix = f"{random.randint(0, 99):02d}"
-            nis_candidate = prefix + suffix
-            if nis_candidate not in used_nis:
-                used_nis.add(nis_candidate)
-                nis = nis_candidate
-                break
-            attempts += 1
-            if attempts > 200:
-                nis = f"{prefix}{suffix}{i}"
-                break
-
-        correct = random.randint(0, total_questions)
-        offset_seconds = random.randint(0, 2 * 3600)
-        submission_time = base_time + timedelta(seconds=offset_seconds)
-        # calculate percentage score (guard against division by zero)
-        score_percentage = round((correct / total_questions) * 100, 2) if total_questions else 0.0
-
-        data.append({
-            "nis": nis,
-            "name": f"Student {i+1}",
-            "correct_answers": correct,
-            "total_questions": total_questions,
-            "score_percentage": score_percentage,
-            "submission_time": submission_time.isoformat()
-        })
-
-    return jsonify(data), 200
+    return _studentListing(subject, grade, classe)
 
 @bp.route("/tokens", methods=["POST"]) # need authentication
 def teacherToken():
@@ -455,31 +207,65 @@ def teacherTokenCreate():
             "INSERT INTO tokens(token, room, expires_at) VALUES (%s, %s, %s) ON CONFLICT (token) DO UPDATE SET room=EXCLUDED.room, expires_at=EXCLUDED.expires_at",
             (token, room, expires_at),
         )
-        return jsonify({"ok": True, "token": token, "expires_at": expires_at.isoformat()}), 200
+    token_cache.put("teacher", token, expires_at)
+    return jsonify({"ok": True, "token": token, "expires_at": expires_at.isoformat()}), 200
 
 @bp.route("/tokens/cleanup", methods=["POST"]) # need authentication
 def teacherTokenCleanup():
     args = request.get_json(force=False)
     force = bool(args.get("force", False)) if args else False
-    with db_cursor() as (conn, cur):
-        if force:
-            cur.execute("DELETE FROM tokens")
-        else:
-            cur.execute("DELETE FROM tokens WHERE expires_at <= NOW()")
-        deleted_count = cur.rowcount
-        return jsonify({"force": force, "deleted": deleted_count}), 200
+    deleted_count = purge_tokens(force=force)
+    token_cache.clear()
+    return jsonify({"force": force, "deleted": deleted_count}), 200
 
 @bp.route("/sessions/cleanup", methods=["POST"]) # need authentication
 def teacherSessionCleanup():
     args = request.get_json(force=False)
     force = bool(args.get("force", False)) if args else False
-    with db_cursor() as (conn, cur):
-        if force:
-            cur.execute("DELETE FROM sessions")
-        else:
-            cur.execute("DELETE FROM sessions WHERE active = FALSE")
-        deleted_count = cur.rowcount
-        return jsonify({"force": force, "deleted": deleted_count}), 200
+    archived_count = archive_sessions(force=force, grace=0)
+    return jsonify({"force": force, "deleted": archived_count, "archived": archived_count}), 200
+
+@bp.route("/maintenance", methods=["GET"]) # need authentication
+def teacherMaintenance():
+    return jsonify({"ok": True, "janitor": janitor.stats()}), 200
+
+@bp.route("/forms/publish", methods=["POST"]) # need authentication
+def teacherFormPublish():
+    """
+    { "form": {...examtmp.json layout...}, "grade": "11", "subject": "Biologi" } -> { "ok": true, "version": 3, ... }
+    grade and subject are optional and default to the form's kelas and name.
+    """
+    req = request.get_json(force=True)
+    form = req.get("form")
+    if not form:
+        return jsonify({"ok": False, "error": "missing form"}), 400
+    try:
+        published = publish_form(form, grade=req.get("grade"), subject=req.get("subject"))
+    except FormError as e:
+        return jsonify({"ok": False, "error": "invalid form", "errors": e.errors}), 400
+    return jsonify({"ok": True, **published}), 201 if published["created"] else 200
+
+@bp.route("/proctor", methods=["GET"]) # live room view
+def proctorView():
+    return render_template("mengawas.html"), 200
+
+@bp.route("/proctor/events", methods=["GET"])
+def proctorEvents():
+    """
+    ?token=AB12C&room=10A -> text/event-stream
+    snapshot (full room), then start / finish / violation / progress deltas
+    """
+    token = request.args.get("token")
+    if not token:
+        return jsonify({"ok": False, "error": "missing token"}), 400
+    status = validate_token("teacher", token, request.remote_addr)
+    if status == THROTTLED:
+        return jsonify({"ok": False, "message": "Terlalu banyak percobaan, coba lagi."}), 429
+    if status != VALID:
+        return jsonify({"ok": False, "message": "Token tidak valid"}), 401
+    room = request.args.get("room") or ALL_ROOMS
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(event_stream(room), mimetype="text/event-stream", headers=headers)
 
 @bp.route("/requestteacherjob", methods=["POST"])
 def requestTeacher():
@@ -0,0 +1,241 @@
+"""
+Exam timetable from data/exam/schedule.json.
+
+schedule.json lists, per exam day, which subject each grade sits in which
+slot ("count"), optionally limited to a range of rooms ("room": "1-3",
+matched against the number at the end of the class name, e.g. F2). Days are
+dated by their own "date" or by SCHEDULE_DAYS, slots start at the top-level
+"slots" times or SCHEDULE_SLOTS, all in WIB.
+
+A slot is open from SCHEDULE_OPEN_EARLY seconds before it starts until
+EXAM_DURATION + SCHEDULE_CLOSE_LATE seconds after. With SCHEDULE_ENFORCE,
+logins and examDo only admit a subject whose slot is open for the student's
+grade and room; a timetable without dated slots admits everything.
+
+Slots are indexed per grade, sorted by opening time, so a lookup is a
+bisect plus a look at the few slots open around that moment. The prewarmer
+thread re-reads schedule.json when it changes and, SCHEDULE_PREWARM seconds
+before a slot opens, loads its forms and answer keys into the caches and
+opens SCHEDULE_PREWARM_POOL database connections, so the login rush of the
+slot does not pay for cold caches.
+"""
+
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from config import (SCHEDULE, WIB, EXAM_DURATION, SCHEDULE_ENFORCE, SCHEDULE_DAYS, SCHEDULE_SLOTS,
+                    SCHEDULE_OPEN_EARLY, SCHEDULE_CLOSE_LATE, SCHEDULE_PREWARM, SCHEDULE_PREWARM_POOL,
+                    SCHEDULE_RELOAD)
+
+logger = logging.getLogger(__name__)
+
+_ROOM_NUMBER = re.compile(r"(\d+)\s*$")
+
+
+class Slot:
+    __slots__ = ("day", "slot", "grade", "subject", "rooms", "starts", "opens", "closes")
+
+    def __init__(self, day, slot, grade, subject, rooms, starts):
+        self.day = day
+        self.slot = slot
+        self.grade = grade
+        self.subject = subject
+        self.rooms = rooms  # (first, last) room number, or None for every room
+        self.starts = starts
+        self.opens = starts - SCHEDULE_OPEN_EARLY
+        self.closes = starts + EXAM_DURATION + SCHEDULE_CLOSE_LATE
+
+    def admits(self, class_):
+        if self.rooms is None:
+            return True
+        match = _ROOM_NUMBER.search(str(class_ or ""))
+        return bool(match) and self.rooms[0] <= int(match.group(1)) <= self.rooms[1]
+
+    def as_dict(self):
+        return {
+            "day": self.day, "slot": self.slot, "grade": self.grade, "subject": self.subject,
+            "rooms": "%d-%d" % self.rooms if self.rooms else None,
+            "starts": datetime.fromtimestamp(self.starts, WIB).isoformat(),
+        }
+
+
+def _rooms(value):
+    if value in (None, ""):
+        return None
+    first, _, last = str(value).partition("-")
+    return int(first), int(last or first)
+
+
+def _clock(value):
+    hours, minutes = str(value).split(":")
+    return timedelta(hours=int(hours), minutes=int(minutes))
+
+
+def parse_schedule(data, days=SCHEDULE_DAYS, slots=SCHEDULE_SLOTS):
+    """Slots of a schedule.json document; undated days and unknown slots are skipped with a warning."""
+    slots = {int(k): v for k, v in (data.get("slots") or slots).items()}
+    parsed = []
+    for entry in data.get("schedule") or []:
+        day = int(entry["day"])
+        when = entry.get("date") or (days[day - 1] if 0 < day <= len(days) else None)
+        if when is None:
+            logger.warning("Schedule day %s has no date, its slots are ignored", day)
+            continue
+        midnight = datetime.combine(date.fromisoformat(when), datetime.min.time(), WIB)
+        for subject in entry.get("subjects") or []:
+            slot = int(subject.get("count", 1))
+            if slot not in slots:
+                logger.warning("Schedule day %s has no start time for slot %s", day, slot)
+                continue
+            starts = (midnight + _clock(slots[slot])).timestamp()
+            parsed.append(Slot(day, slot, str(subject["grade"]), subject["subject"], _rooms(subject.get("room")), starts))
+    return parsed
+
+
+class Timetable:
+    def __init__(self, path=SCHEDULE, enforce=SCHEDULE_ENFORCE):
+        self.path = path
+        self.enforce = enforce
+        self._mtime = None
+        self._loaded = False
+        self._slots = []
+        self._by_grade = {}  # grade -> ([opens], [Slot]) sorted by opening time
+        self._longest = 0
+        self._lock = threading.Lock()
+
+    def load(self, slots):
+        by_grade = {}
+        for slot in sorted(slots, key=lambda s: s.opens):
+            opens, entries = by_grade.setdefault(slot.grade, ([], []))
+            opens.append(slot.opens)
+            entries.append(slot)
+        with self._lock:
+            self._slots = sorted(slots, key=lambda s: s.opens)
+            self._by_grade = by_grade
+            self._longest = max((s.closes - s.opens for s in slots), default=0)
+
+    def reload(self):
+        """Re-read the schedule file when it changed; returns True when it did."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if self._loaded and mtime == self._mtime:
+            return False
+        self._loaded = True
+        self._mtime = mtime
+        slots = []
+        if mtime is not None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    slots = parse_schedule(json.load(f))
+            except (OSError, ValueError, KeyError) as e:
+                logger.error("Could not read schedule %s: %s", self.path, e)
+                return False
+        self.load(slots)
+        logger.info("Loaded %d exam slot(s) from %s", len(slots), self.path)
+        return True
+
+    def _ensure_loaded(self):
+        # read on first use rather than at import
+        if not self._loaded:
+            self.reload()
+
+    @property
+    def enforcing(self):
+        self._ensure_loaded()
+        return self.enforce and bool(self._slots)
+
+    def open_slots(self, grade, class_=None, now=None):
+        """Slots open at now for grade (and class_'s room), most recently opened first."""
+        now = time.time() if now is None else now
+        self._ensure_loaded()
+        with self._lock:
+            opens, entries = self._by_grade.get(str(grade), ((), ()))
+            longest = self._longest
+        found = []
+        for n in range(bisect.bisect_right(opens, now) - 1, -1, -1):
+            slot = entries[n]
+            if slot.opens < now - longest:
+                break
+            if now < slot.closes and (class_ is None or slot.admits(class_)):
+                found.append(slot)
+        return found
+
+    def allows(self, grade, class_, subject, now=None):
+        if not self.enforcing:
+            return True
+        return any(slot.subject == subject for slot in self.open_slots(grade, class_, now))
+
+    def upcoming(self, within, now=None):
+        """Slots that are open or open in the next `within` seconds."""
+        now = time.time() if now is None else now
+        self._ensure_loaded()
+        with self._lock:
+            slots = self._slots
+        return [s for s in slots if s.opens <= now + within and now < s.closes]
+
+
+class Prewarmer:
+    def __init__(self, timetable, interval=SCHEDULE_RELOAD, lead=SCHEDULE_PREWARM, connections=SCHEDULE_PREWARM_POOL):
+        self.timetable = timetable
+        self.interval = interval
+        self.lead = lead
+        self.connections = connections
+        self._warmed = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def warm(self, slot):
+        from db import db_cursor, init_pool
+        from formcache import form_cache
+        from results import answer_key
+
+        entry = form_cache.get(slot.grade, slot.subject)
+        with db_cursor() as (conn, cur):
+            # the key sessions of this slot will be graded with: the version they get pinned to
+            answer_key(cur, slot.grade, slot.subject, entry.versions.get(slot.subject))
+        opened = init_pool(self.connections)
+        logger.info("Pre-warmed %s/%s (day %s slot %s): form and answer key cached, %d connection(s) opened",
+                    slot.grade, slot.subject, slot.day, slot.slot, opened)
+
+    def run_once(self):
+        self.timetable.reload()
+        for slot in self.timetable.upcoming(self.lead):
+            key = (slot.grade, slot.subject, slot.starts)
+            if key in self._warmed:
+                continue
+            try:
+                self.warm(slot)
+                self._warmed.add(key)
+            except Exception:
+                logger.exception("Pre-warming %s/%s failed", slot.grade, slot.subject)
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="schedule-prewarm", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            self.run_once()
+            if self._stop.wait(self.interval):
+                return
+
+
+timetable = Timetable()
+prewarmer = Prewarmer(timetable)
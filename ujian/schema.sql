@@ -7,19 +7,42 @@ CREATE TABLE students (
     class VARCHAR(10) NOT NULL
 );
 
+-- room snapshots of the proctor stream (events.room_snapshot)
+CREATE INDEX students_class ON students(class, nis);
+
 CREATE TABLE teachers (
     id SERIAL PRIMARY KEY,
     name VARCHAR(100) NOT NULL,
     job jsonb NOT NULL
 );
 
+-- one immutable row per published version (forms.py); payload keeps the
+-- answer key, rendered is the answer-free copy served to students
 CREATE TABLE exam_forms (
   id uuid PRIMARY KEY DEFAULT uuid_generate_v4(),
   grade text NOT NULL,
   subject text NOT NULL,
-  payload jsonb NOT NULL
+  version integer NOT NULL DEFAULT 1,
+  content_hash text NOT NULL,
+  payload jsonb NOT NULL,
+  rendered jsonb NOT NULL,
+  updated_at timestamptz NOT NULL DEFAULT now()
 );
 
+-- the latest version of a form is the first entry of its range
+CREATE UNIQUE INDEX exam_forms_version ON exam_forms(grade, subject, version DESC);
+
+CREATE TABLE tokens (
+  token text PRIMARY KEY,
+  token_type text NOT NULL DEFAULT 'teacher',
+  room text,
+  expires_at timestamptz NOT NULL,
+  created_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- validation lookups are answered from this index alone
+CREATE INDEX tokens_validate ON tokens(token_type, token, expires_at);
+
 CREATE TABLE sessions (
   id uuid PRIMARY KEY DEFAULT uuid_generate_v4(),
   nis text NOT NULL REFERENCES students(nis),
@@ -28,18 +51,205 @@ CREATE TABLE sessions (
   seed text NOT NULL,
   session_hash text NOT NULL UNIQUE,
   special_key text NOT NULL,
-  started_at timestamptz NOT NULL DEFAULT now()
+  started_at timestamptz NOT NULL DEFAULT now(),
+  finished_at timestamptz,
+  layout bytea,  -- question/option shuffle, written on the first form request (shuffle.py)
+  answers jsonb NOT NULL DEFAULT '{}',  -- latest answer per question id, merged on every answer flush (answers.py)
+  form_version integer  -- exam_forms version current at login, served and graded for the whole session
 );
 
+-- finished sessions are moved here by the janitor (janitor.py)
+CREATE TABLE sessions_archive (
+  LIKE sessions INCLUDING DEFAULTS,
+  archived_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX sessions_archive_hash ON sessions_archive(session_hash);
+
+-- append-only answer log; per (session_hash, question_id) the latest
+-- answered_at wins, then the latest id (rows are not inserted in answer order).
+-- No foreign key to sessions so answers survive session cleanup/archival;
+-- the batched insert joins sessions instead.
 CREATE TABLE answers (
-  id uuid PRIMARY KEY REFERENCES sessions(id) ON DELETE CASCADE,
-  nis text NOT NULL REFERENCES students(nis),
-  session_hash text NOT NULL REFERENCES sessions(session_hash),
+  id bigserial PRIMARY KEY,
+  session_hash text NOT NULL,
+  nis text NOT NULL,
   subject text NOT NULL,
-  answers jsonb NOT NULL,
-  submitted_at timestamptz NOT NULL DEFAULT now()
+  question_id text NOT NULL,
+  answer jsonb NOT NULL,
+  answered_at timestamptz NOT NULL DEFAULT now()
 );
 
+CREATE INDEX answers_session ON answers(session_hash, question_id, answered_at, id);
 
 -- prevent more than one active session per nis
 CREATE UNIQUE INDEX uniq_active_nis ON sessions(nis) WHERE active = true;
+
+
+-- bump exam_forms.updated_at and tell in-process form caches which grade changed
+CREATE OR REPLACE FUNCTION exam_forms_changed() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' THEN
+    PERFORM pg_notify('exam_forms', OLD.grade);
+  END IF;
+  IF TG_OP = 'DELETE' THEN
+    RETURN OLD;
+  END IF;
+  NEW.updated_at := now();
+  PERFORM pg_notify('exam_forms', NEW.grade);
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER exam_forms_notify
+  BEFORE INSERT OR UPDATE OR DELETE ON exam_forms
+  FOR EACH ROW EXECUTE FUNCTION exam_forms_changed();
+
+-- published versions are never edited in place; publish a new version instead
+CREATE OR REPLACE FUNCTION exam_forms_immutable() RETURNS trigger AS $$
+BEGIN
+  RAISE EXCEPTION 'exam_forms version % of %/% is immutable', OLD.version, OLD.grade, OLD.subject;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER exam_forms_frozen
+  BEFORE UPDATE OF grade, subject, version, content_hash, payload, rendered ON exam_forms
+  FOR EACH ROW EXECUTE FUNCTION exam_forms_immutable();
+
+
+-- dashboard rollups, maintained by the sessions trigger below
+CREATE TABLE exam_results (
+  subject text NOT NULL,
+  nis text NOT NULL REFERENCES students(nis),
+  name text NOT NULL,
+  grade text NOT NULL,
+  class text NOT NULL,
+  session_hash text NOT NULL,
+  started_at timestamptz NOT NULL DEFAULT now(),
+  finished_at timestamptz,
+  correct_answers integer,
+  total_questions integer,
+  score numeric,
+  score_percentage numeric,
+  PRIMARY KEY (subject, nis)
+);
+
+-- covering index for the keyset-paginated (class, nis) listings
+CREATE INDEX exam_results_listing ON exam_results(subject, grade, class, nis)
+  INCLUDE (name, correct_answers, total_questions, score_percentage, finished_at)
+  WHERE finished_at IS NOT NULL;
+
+CREATE TABLE exam_progress (
+  subject text NOT NULL,
+  grade text NOT NULL,
+  class text NOT NULL,
+  started integer NOT NULL DEFAULT 0,
+  finished integer NOT NULL DEFAULT 0,
+  PRIMARY KEY (subject, grade, class)
+);
+
+-- counts each student once per subject, however many sessions they open
+CREATE OR REPLACE FUNCTION track_exam_progress() RETURNS trigger AS $$
+DECLARE
+  st record;
+  n integer;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT name, grade, class INTO st FROM students WHERE nis = NEW.nis;
+    INSERT INTO exam_results (subject, nis, name, grade, class, session_hash, started_at)
+    VALUES (NEW.subject, NEW.nis, st.name, st.grade, st.class, NEW.session_hash, NEW.started_at)
+    ON CONFLICT (subject, nis) DO NOTHING;
+    GET DIAGNOSTICS n = ROW_COUNT;
+    IF n > 0 THEN
+      INSERT INTO exam_progress (subject, grade, class, started) VALUES (NEW.subject, st.grade, st.class, 1)
+      ON CONFLICT (subject, grade, class) DO UPDATE SET started = exam_progress.started + 1;
+    END IF;
+  ELSIF OLD.active AND NOT NEW.active THEN
+    -- every finish points the row at its session (the score written next is
+    -- that session's); only the first one counts towards exam_progress
+    SELECT grade, class, finished_at IS NULL AS first INTO st FROM exam_results
+    WHERE subject = NEW.subject AND nis = NEW.nis FOR UPDATE;
+    IF FOUND THEN
+      UPDATE exam_results SET finished_at = now(), session_hash = NEW.session_hash
+      WHERE subject = NEW.subject AND nis = NEW.nis;
+      IF st.first THEN
+        UPDATE exam_progress SET finished = finished + 1
+        WHERE subject = NEW.subject AND grade = st.grade AND class = st.class;
+      END IF;
+    END IF;
+  END IF;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sessions_progress
+  AFTER INSERT OR UPDATE OF active ON sessions
+  FOR EACH ROW EXECUTE FUNCTION track_exam_progress();
+
+-- live proctor stream (events.py); payloads are delivered on commit.
+-- NEW.* fields are only touched in the branch for their own table.
+CREATE OR REPLACE FUNCTION notify_exam_event() RETURNS trigger AS $$
+DECLARE
+  payload jsonb;
+BEGIN
+  IF TG_TABLE_NAME = 'violations' THEN
+    payload := jsonb_build_object('type', 'violation', 'event_type', NEW.event_type, 'occurrences', NEW.occurrences);
+  ELSIF TG_OP = 'INSERT' THEN
+    payload := jsonb_build_object('type', 'start', 'subject', NEW.subject);
+  ELSIF OLD.active AND NOT NEW.active THEN
+    payload := jsonb_build_object('type', 'finish', 'subject', NEW.subject);
+  ELSE
+    RETURN NULL;
+  END IF;
+  PERFORM pg_notify('exam_events', (payload || jsonb_build_object(
+    'room', (SELECT class FROM students WHERE nis = NEW.nis),
+    'nis', NEW.nis,
+    'at', now()
+  ))::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER sessions_events
+  AFTER INSERT OR UPDATE OF active ON sessions
+  FOR EACH ROW EXECUTE FUNCTION notify_exam_event();
+
+
+-- client anti-cheat events, coalesced per (session, event type) per flush
+CREATE TABLE violations (
+  id bigserial PRIMARY KEY,
+  session_hash text NOT NULL,
+  nis text NOT NULL,
+  event_type text NOT NULL,
+  occurrences integer NOT NULL DEFAULT 1,
+  first_at timestamptz NOT NULL,
+  last_at timestamptz NOT NULL,
+  received_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX violations_session ON violations(session_hash);
+
+CREATE TRIGGER violations_events
+  AFTER INSERT ON violations
+  FOR EACH ROW EXECUTE FUNCTION notify_exam_event();
+
+-- proctoring hub state (hub.py keeps it in memory and writes behind)
+CREATE TABLE bans (
+  nis text PRIMARY KEY,
+  violations integer NOT NULL DEFAULT 0,
+  banned_at timestamptz,
+  reason text
+);
+
+CREATE TABLE appeals (
+  id bigserial PRIMARY KEY,
+  nis text NOT NULL,
+  appeal_text text NOT NULL,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  resolved boolean NOT NULL DEFAULT false
+);
+
+CREATE TABLE revoked_sessions (
+  session_hash text PRIMARY KEY,
+  revoked_at timestamptz NOT NULL DEFAULT now()
+);
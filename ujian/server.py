@@ -0,0 +1,105 @@
+"""
+Production serving.
+
+Runs create_app() under gunicorn with SERVER_WORKERS worker processes
+(gevent by default, so SSE streams and autosave bursts do not each hold an
+OS thread). The app is not preloaded: every worker imports and builds it
+after the fork, so the DB pool, the LISTEN connection and the write-behind
+threads are per worker. The master writes SERVER_PIDFILE; SIGHUP to it
+(cli.py reload-server) starts fresh workers with the new code and retires the
+old ones after at most SERVER_GRACEFUL_TIMEOUT seconds.
+
+Each worker's pool is sized so all of them together, LISTEN connections
+included, stay within DB_CONNECTION_BUDGET (db.pool_max()); the schedule
+prewarm never opens more than that either. During a reload old and new
+workers overlap, so leave Postgres room for up to twice the budget or reload
+outside exam slots.
+"""
+
+import logging
+import os
+import signal
+
+from gunicorn.app.base import BaseApplication
+from config import (SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_WORKER_CLASS, SERVER_WORKER_CONNECTIONS,
+                    SERVER_THREADS, SERVER_TIMEOUT, SERVER_GRACEFUL_TIMEOUT, SERVER_KEEPALIVE,
+                    SERVER_MAX_REQUESTS, SERVER_PIDFILE, DB_CONNECTION_BUDGET)
+
+logger = logging.getLogger(__name__)
+
+
+def _green_psycopg():
+    # without a wait callback every query would block the whole gevent worker;
+    # it must be installed before the pool opens its first connection
+    try:
+        from gevent import monkey
+    except ImportError:
+        return
+    if not monkey.is_module_patched("socket"):
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        logger.warning("psycogreen is not installed; database calls will block the gevent worker")
+        return
+    patch_psycopg()
+
+
+class ExamServer(BaseApplication):
+    def __init__(self, options=None):
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        # runs inside each worker, after the fork
+        _green_psycopg()
+        from app import create_app
+        return create_app()
+
+
+def server_options(workers=None, bind=None, worker_class=None):
+    return {
+        "bind": bind or f"{SERVER_HOST}:{SERVER_PORT}",
+        "workers": workers or SERVER_WORKERS,
+        "worker_class": worker_class or SERVER_WORKER_CLASS,
+        "worker_connections": SERVER_WORKER_CONNECTIONS,
+        "threads": SERVER_THREADS,
+        "timeout": SERVER_TIMEOUT,
+        "graceful_timeout": SERVER_GRACEFUL_TIMEOUT,
+        "keepalive": SERVER_KEEPALIVE,
+        "max_requests": SERVER_MAX_REQUESTS,
+        "max_requests_jitter": SERVER_MAX_REQUESTS // 10,
+        "pidfile": str(SERVER_PIDFILE),
+        "preload_app": False,
+    }
+
+
+def serve(workers=None, bind=None, worker_class=None):
+    from db import WORKERS_ENV, pool_max
+
+    options = server_options(workers, bind, worker_class)
+    workers = options["workers"]
+    # every worker needs its LISTEN connection and at least one pooled one
+    if workers * 2 > DB_CONNECTION_BUDGET:
+        raise RuntimeError(f"{workers} workers need at least {workers * 2} database connections, "
+                           f"DB_CONNECTION_BUDGET is {DB_CONNECTION_BUDGET}")
+    # inherited by the workers, which size their pools from it
+    os.environ[WORKERS_ENV] = str(workers)
+    logger.info("Serving with %d workers, each with a pool of up to %d connections (budget %d)",
+                workers, pool_max(workers), DB_CONNECTION_BUDGET)
+    ExamServer(options).run()
+
+
+def reload_server(pidfile=SERVER_PIDFILE):
+    """Ask the running master for a graceful reload. Returns its pid."""
+    try:
+        pid = int(open(pidfile).read().strip())
+    except (OSError, ValueError):
+        raise RuntimeError(f"no running server (pidfile {pidfile})")
+    os.kill(pid, signal.SIGHUP)
+    return pid
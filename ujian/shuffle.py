@@ -0,0 +1,70 @@
+"""
+Per-session question and option shuffling.
+
+Every session gets a permutation of the form's questions and, for PG/MCMA
+questions, of their options, drawn from a random.Random seeded with the
+session's seed (str seeds are hashed with SHA-512, so the draw is the same in
+every process and Python version). It is computed once, on the session's
+first form request, and stored in sessions.layout as a few bytes per
+question:
+
+  width (1 or 2 bytes per big-endian index), n, question order[n],
+  then for each canonical question i: k_i, option order[k_i]
+
+The cached form body stays shared by every student; examDo only adds the
+layout as the X-Exam-Layout header (base64url) and the page reorders itself.
+Answers keep referencing the canonical question and option ids, so the
+grader reads them unchanged whatever order they were displayed in.
+"""
+
+import base64
+import random
+import struct
+
+SHUFFLED_TYPES = ("PG", "MCMA")
+
+
+def form_shape(form):
+    """Option count per question of form, in canonical order (0 = options stay put)."""
+    shape = []
+    for field in form.get("field", []):
+        jawab = field.get("jawab") or {}
+        if str(jawab.get("tipe") or "PG").upper() in SHUFFLED_TYPES:
+            shape.append(len(jawab.get("opsi") or []))
+        else:
+            shape.append(0)
+    return shape
+
+
+def make_layout(seed, shape):
+    """Deterministic permutation of shape for seed, packed as bytes."""
+    rng = random.Random(seed)
+    n = len(shape)
+    order = list(range(n))
+    rng.shuffle(order)
+    values = [n] + order
+    for k in shape:
+        options = list(range(k))
+        rng.shuffle(options)
+        values += [k] + options
+    width = 1 if max(values) < 256 else 2
+    return bytes([width]) + struct.pack(">%d%s" % (len(values), "B" if width == 1 else "H"), *values)
+
+
+def read_layout(blob):
+    """Unpack make_layout() bytes into (question order, [option order per canonical question])."""
+    blob = bytes(blob)
+    width = blob[0]
+    values = struct.unpack(">%d%s" % ((len(blob) - 1) // width, "B" if width == 1 else "H"), blob[1:])
+    n = values[0]
+    order = list(values[1:1 + n])
+    options, pos = [], 1 + n
+    for _ in range(n):
+        k = values[pos]
+        options.append(list(values[pos + 1:pos + 1 + k]))
+        pos += 1 + k
+    return order, options
+
+
+def layout_header(blob):
+    return base64.urlsafe_b64encode(bytes(blob)).decode("ascii").rstrip("=")
@@ -0,0 +1,350 @@
+"""
+Shared state for running several app nodes behind a plain load balancer.
+
+What one process used to keep to itself and another node would need to see
+goes through the module's `state` backend instead:
+
+  session:<hash>          active-session markers (answers.SessionCache)
+  token:<type>:<token>    token validity (tokens.TokenCache)
+  hub channel             proctor hub events, so bans, appeals and unbans
+                          reach the sockets on every hub node (hub.py)
+
+Postgres stays the source of truth; these keys are caches with a TTL and
+the channel carries notifications only. Proctor SSE events already reach
+every node through Postgres NOTIFY (events.py).
+
+STATE_URL picks the backend:
+
+  "local"               LocalState: an in-process dict and callbacks. The
+                        same behaviour as before, for a single process.
+  "redis://host:port/db"  RedisState: a minimal RESP client, good for Redis
+                        or for the stand-in server (state_server.py,
+                        cli.py run-state-server) on one machine.
+
+Both expose get/set/delete/delete_prefix/incr and publish/subscribe with
+the same semantics. Subscribers get each message as text, and None after a
+reconnect, when messages may have been missed (as with notify.listener).
+"""
+
+import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from config import STATE_URL, STATE_PREFIX, STATE_TIMEOUT, STATE_LOCAL_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class StateError(RuntimeError):
+    """The shared-state backend failed or is unreachable."""
+
+
+class LocalState:
+    """In-process backend: a size-bounded dict with expiry and synchronous pub/sub."""
+
+    def __init__(self, maxsize=STATE_LOCAL_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()  # key -> (value, expires_at or None)
+        self._handlers = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key, time.monotonic())
+            if item is None:
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl=None, nx=False):
+        now = time.monotonic()
+        with self._lock:
+            if nx and self._live(key, now) is not None:
+                return False
+            self._data[key] = (str(value), now + ttl if ttl else None)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            keys = [k for k in self._data if k.startswith(prefix)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def incr(self, key):
+        with self._lock:
+            item = self._live(key, time.monotonic())
+            value = int(item[0]) + 1 if item else 1
+            self._data[key] = (str(value), item[1] if item else None)
+            return value
+
+    def publish(self, channel, message):
+        with self._lock:
+            handlers = list(self._handlers.get(channel, ()))
+        for callback in handlers:
+            try:
+                callback(message)
+            except Exception:
+                logger.exception("State subscriber failed for channel %s", channel)
+        return len(handlers)
+
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._handlers.setdefault(channel, []).append(callback)
+
+    def close(self):
+        pass
+
+
+# ---------------------------- RESP
+
+def _encode(args):
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+def _read_reply(rfile):
+    line = rfile.readline()
+    if not line.endswith(b"\r\n"):
+        raise StateError("connection closed by the state server")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode("utf-8")
+    if kind == b"-":
+        raise StateError(rest.decode("utf-8", "replace"))
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = rfile.read(size + 2)
+        return data[:-2].decode("utf-8")
+    if kind == b"*":
+        size = int(rest)
+        return None if size < 0 else [_read_reply(rfile) for _ in range(size)]
+    raise StateError("unexpected reply %r" % line[:20])
+
+
+class _Connection:
+    def __init__(self, host, port, db, password, timeout):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile("rb")
+        if password:
+            self.command("AUTH", password)
+        if db:
+            self.command("SELECT", db)
+
+    def send(self, *args):
+        self.sock.sendall(_encode(args))
+
+    def command(self, *args):
+        self.send(*args)
+        return _read_reply(self.rfile)
+
+    def close(self):
+        try:
+            self.rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisState:
+    """RESP backend for Redis or the stand-in server; thread-safe, connections are pooled."""
+
+    def __init__(self, url, prefix=STATE_PREFIX, timeout=STATE_TIMEOUT, retry_delay=2.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.db = int(parts.path.strip("/") or 0)
+        self.password = parts.password
+        self.prefix = prefix
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self._idle = []
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._sub_conn = None
+        self._sub_lock = threading.Lock()
+        self._sub_thread = None
+        self._stop = threading.Event()
+
+    def _connect(self, timeout=None):
+        try:
+            return _Connection(self.host, self.port, self.db, self.password, timeout or self.timeout)
+        except OSError as e:
+            raise StateError("cannot reach state server %s:%s: %s" % (self.host, self.port, e)) from e
+
+    def _command(self, *args, retry=True):
+        # resent on a fresh connection only if it never reached the server (the
+        # send failed) or, with retry, if a pooled connection the server had
+        # dropped answered with EOF; a non-idempotent command (INCR, SET NX,
+        # PUBLISH) passes retry=False, since it may have been applied already
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        for attempt in (0, 1):
+            if conn is None:
+                conn = self._connect()
+            try:
+                conn.send(*args)
+            except OSError as e:
+                conn.close()
+                conn = None
+                if attempt:
+                    raise StateError(str(e)) from e
+                continue
+            try:
+                reply = _read_reply(conn.rfile)
+            except StateError as e:
+                if "closed" not in str(e):
+                    # an error reply: the connection itself is fine
+                    with self._lock:
+                        self._idle.append(conn)
+                    raise
+                conn.close()
+                conn = None
+                if attempt or not retry:
+                    raise
+                continue
+            except OSError as e:
+                # a timeout or reset after sending: never resent
+                conn.close()
+                raise StateError(str(e)) from e
+            with self._lock:
+                self._idle.append(conn)
+            return reply
+
+    def get(self, key):
+        return self._command("GET", self.prefix + key)
+
+    def set(self, key, value, ttl=None, nx=False):
+        args = ["SET", self.prefix + key, value]
+        if ttl:
+            args += ["PX", int(ttl * 1000)]
+        if nx:
+            args.append("NX")
+        return self._command(*args, retry=not nx) is not None
+
+    def delete(self, *keys):
+        return self._command("DEL", *[self.prefix + k for k in keys]) if keys else 0
+
+    def delete_prefix(self, prefix):
+        deleted, cursor = 0, "0"
+        while True:
+            cursor, keys = self._command("SCAN", cursor, "MATCH", self.prefix + prefix + "*", "COUNT", 500)
+            if keys:
+                deleted += self._command("DEL", *keys)
+            if str(cursor) == "0":
+                return deleted
+
+    def incr(self, key):
+        return self._command("INCR", self.prefix + key, retry=False)
+
+    def publish(self, channel, message):
+        return self._command("PUBLISH", self.prefix + channel, message, retry=False)
+
+    # ---- subscriber
+
+    def subscribe(self, channel, callback):
+        with self._sub_lock:
+            new = channel not in self._handlers
+            self._handlers.setdefault(channel, []).append(callback)
+            if new and self._sub_conn is not None:
+                try:
+                    self._sub_conn.send("SUBSCRIBE", self.prefix + channel)
+                except OSError:
+                    pass  # the reader reconnects and subscribes everything
+            if self._sub_thread is None:
+                self._stop.clear()
+                self._sub_thread = threading.Thread(target=self._listen, name="state-subscriber", daemon=True)
+                self._sub_thread.start()
+
+    def _dispatch(self, channel, message):
+        with self._sub_lock:
+            handlers = list(self._handlers.get(channel, ()))
+        for callback in handlers:
+            try:
+                callback(message)
+            except Exception:
+                logger.exception("State subscriber failed for channel %s", channel)
+
+    def _listen(self):
+        reconnected = False
+        while not self._stop.is_set():
+            conn = None
+            try:
+                # no read timeout: the connection sits idle between messages
+                conn = _Connection(self.host, self.port, self.db, self.password, self.timeout)
+                conn.sock.settimeout(None)
+                with self._sub_lock:
+                    self._sub_conn = conn
+                    channels = list(self._handlers)
+                conn.send("SUBSCRIBE", *[self.prefix + c for c in channels])
+                if reconnected:
+                    for channel in channels:
+                        self._dispatch(channel, None)
+                reconnected = True
+                while not self._stop.is_set():
+                    reply = _read_reply(conn.rfile)
+                    if isinstance(reply, list) and reply and reply[0] == "message":
+                        self._dispatch(reply[1][len(self.prefix):], reply[2])
+            except (OSError, StateError) as e:
+                if not self._stop.is_set():
+                    logger.warning("State subscriber connection lost (%s), retrying in %.1fs", e, self.retry_delay)
+            finally:
+                with self._sub_lock:
+                    self._sub_conn = None
+                if conn is not None:
+                    conn.close()
+            self._stop.wait(self.retry_delay)
+
+    def close(self):
+        self._stop.set()
+        with self._sub_lock:
+            conn = self._sub_conn
+        if conn is not None:
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def open_state(url=STATE_URL):
+    if url in (None, "", "local"):
+        return LocalState()
+    if url.startswith("redis://"):
+        return RedisState(url)
+    raise ValueError("unknown STATE_URL %r" % url)
+
+
+# connects lazily, on the first command or subscription
+state = open_state()
@@ -0,0 +1,213 @@
+"""
+Stand-in for Redis when one machine runs several app or hub processes.
+
+An asyncio server speaking the subset of RESP that state.RedisState uses:
+PING, GET, SET (EX/PX/NX), DEL, INCR, SCAN (MATCH/COUNT), PUBLISH,
+SUBSCRIBE, UNSUBSCRIBE, SELECT, AUTH and QUIT. Everything is kept in
+memory and lost on restart, which the callers tolerate: the keys are
+caches, the counters are re-seeded from the database and subscribers reload
+after reconnecting. Use a real Redis when the nodes are separate machines.
+
+  python cli.py run-state-server [--host H] [--port P]
+"""
+
+import asyncio
+import fnmatch
+import logging
+import time
+
+from config import STATE_SERVER_HOST, STATE_SERVER_PORT
+
+logger = logging.getLogger(__name__)
+
+
+def _bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _array(items):
+    return b"*%d\r\n" % len(items) + b"".join(items)
+
+
+def _int(value):
+    return b":%d\r\n" % value
+
+
+OK = b"+OK\r\n"
+
+# how often keys past their TTL are dropped without being read again
+SWEEP_INTERVAL = 1.0
+
+
+class StateServer:
+    def __init__(self):
+        self.data = {}  # key -> (value bytes, expires_at or None)
+        self.expiring = {}  # key -> expires_at, for the keys with a TTL
+        self.channels = {}  # channel -> set of subscriber writers
+
+    def _get(self, key):
+        item = self.data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.monotonic():
+            self._drop(key)
+            return None
+        return item
+
+    def _put(self, key, value, expires):
+        self.data[key] = (value, expires)
+        if expires is None:
+            self.expiring.pop(key, None)
+        else:
+            self.expiring[key] = expires
+
+    def _drop(self, key):
+        self.expiring.pop(key, None)
+        return self.data.pop(key, None)
+
+    def sweep(self):
+        """Drop every key past its TTL; keys that are never read again would otherwise stay forever."""
+        now = time.monotonic()
+        expired = [key for key, expires in self.expiring.items() if expires <= now]
+        for key in expired:
+            self._drop(key)
+        return len(expired)
+
+    async def _sweeper(self, interval=SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+    # ---- commands, each returning the encoded reply
+
+    def cmd_ping(self, args):
+        return _bulk(args[0]) if args else b"+PONG\r\n"
+
+    def cmd_get(self, args):
+        item = self._get(args[0])
+        return _bulk(item[0] if item else None)
+
+    def cmd_set(self, args):
+        key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+        expires = None
+        n = 0
+        while n < len(options):
+            if options[n] in (b"EX", b"PX"):
+                amount = float(options[n + 1])
+                expires = time.monotonic() + (amount if options[n] == b"EX" else amount / 1000)
+                n += 2
+                continue
+            if options[n] == b"NX" and self._get(key) is not None:
+                return _bulk(None)
+            n += 1
+        self._put(key, value, expires)
+        return OK
+
+    def cmd_del(self, args):
+        return _int(sum(1 for key in args if self._get(key) is not None and self._drop(key)))
+
+    def cmd_incr(self, args):
+        item = self._get(args[0])
+        try:
+            value = int(item[0]) + 1 if item else 1
+        except ValueError:
+            return b"-ERR value is not an integer or out of range\r\n"
+        self._put(args[0], b"%d" % value, item[1] if item else None)
+        return _int(value)
+
+    def cmd_scan(self, args):
+        # one pass over everything: the cursor is always 0 afterwards
+        options = [a.upper() if n % 2 == 0 else a for n, a in enumerate(args[1:])]
+        pattern = None
+        for n in range(0, len(options) - 1, 2):
+            if options[n] == b"MATCH":
+                pattern = options[n + 1].decode("utf-8")
+        keys = [k for k in list(self.data) if self._get(k) is not None
+                and (pattern is None or fnmatch.fnmatchcase(k.decode("utf-8"), pattern))]
+        return _array([_bulk("0"), _array([_bulk(k) for k in keys])])
+
+    def cmd_publish(self, args):
+        channel, message = args
+        subscribers = self.channels.get(channel, ())
+        frame = _array([_bulk("message"), _bulk(channel), _bulk(message)])
+        for writer in list(subscribers):
+            writer.write(frame)
+        return _int(len(subscribers))
+
+    def cmd_select(self, args):
+        return OK
+
+    def cmd_auth(self, args):
+        return OK
+
+    # ---- connections
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # inline command, e.g. typed into telnet
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if not args:
+                    continue
+                name = args[0].decode("utf-8", "replace").lower()
+                if name == "quit":
+                    writer.write(OK)
+                    break
+                if name in ("subscribe", "unsubscribe"):
+                    for channel in args[1:]:
+                        if name == "subscribe":
+                            subscribed.add(channel)
+                            self.channels.setdefault(channel, set()).add(writer)
+                        else:
+                            subscribed.discard(channel)
+                            self.channels.get(channel, set()).discard(writer)
+                        writer.write(_array([_bulk(name), _bulk(channel), _int(len(subscribed))]))
+                else:
+                    handler = getattr(self, "cmd_" + name, None)
+                    if handler is None:
+                        writer.write(b"-ERR unknown command '%s'\r\n" % name.encode("utf-8"))
+                    else:
+                        try:
+                            writer.write(handler(args[1:]))
+                        except (IndexError, ValueError):
+                            writer.write(b"-ERR wrong arguments for '%s'\r\n" % name.encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.channels.get(channel, set()).discard(writer)
+            writer.close()
+
+    async def serve(self, host=STATE_SERVER_HOST, port=STATE_SERVER_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info("State server listening on %s:%s", host, port)
+        sweeper = asyncio.ensure_future(self._sweeper())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            sweeper.cancel()
+
+
+def run_state_server(host=STATE_SERVER_HOST, port=STATE_SERVER_PORT):
+    try:
+        asyncio.run(StateServer().serve(host, port))
+    except KeyboardInterrupt:
+        pass
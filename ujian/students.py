@@ -0,0 +1,114 @@
+"""
+Bulk student import.
+
+Roster files come in two shapes: the flat list written by the spreadsheet
+extractor (siswa.json: grade/class/id/name) and the nested
+grades -> classes -> list produced by data/merge.py (students.json, X.json).
+iter_roster() flattens either (or a stream of flat records, e.g. from
+data/studentimporter/extract_siswa.py) into (nis, name, grade, class) and
+load_students() streams any such iterable through COPY into a temp table,
+then upserts it with a single INSERT ... SELECT ... ON CONFLICT.
+"""
+
+import csv
+import io
+import logging
+
+from db import db_cursor
+
+logger = logging.getLogger(__name__)
+
+UPSERT_SQL = """
+WITH upserted AS (
+    INSERT INTO students (nis, name, grade, class)
+    SELECT DISTINCT ON (nis) nis, name, grade, class FROM tmp_students ORDER BY nis
+    ON CONFLICT (nis) DO UPDATE SET name = EXCLUDED.name, grade = EXCLUDED.grade, class = EXCLUDED.class
+    WHERE (students.name, students.grade, students.class) IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.grade, EXCLUDED.class)
+    RETURNING xmax = 0 AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM upserted
+"""
+
+# VARCHAR sizes of students (schema.sql): one longer value would abort the whole COPY
+FIELD_LIMITS = (("nis", 20), ("name", 100), ("grade", 10), ("class", 10))
+
+
+def _flat_record(rec, grade=None, class_=None):
+    nis = rec.get("student_id") or rec.get("nis") or rec.get("id")
+    name = rec.get("name") or rec.get("nama") or ""
+    return (
+        str(nis).strip() if nis is not None else None,
+        str(name).strip(),
+        rec.get("grade") or grade,
+        rec.get("class") or class_,
+    )
+
+
+def iter_roster(data):
+    """Yield (nis, name, grade, class) from a grades/classes roster or any iterable of flat records."""
+    if not isinstance(data, dict):
+        for rec in data:
+            if isinstance(rec, dict):
+                yield _flat_record(rec)
+        return
+    grades = data.get("grades")
+    if grades is None and "classes" in data:
+        grades = {data.get("grade"): data}
+    for grade, grade_data in (grades or {}).items():
+        for class_, records in (grade_data.get("classes") or {}).items():
+            for rec in records:
+                if isinstance(rec, dict):
+                    yield _flat_record(rec, grade, class_)
+
+
+class _CsvStream:
+    """File-like view of records as CSV, produced on demand for copy_expert."""
+
+    def __init__(self, records):
+        self._records = iter(records)
+        self._buf = io.StringIO()
+        self._writer = csv.writer(self._buf)
+        self._pending = ""
+        self.total = 0
+        self.invalid = 0
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            rec = next(self._records, None)
+            if rec is None:
+                break
+            self.total += 1
+            nis, name, grade, class_ = rec
+            if not (nis and grade and class_):
+                self.invalid += 1
+                logger.warning("Skipping student with missing nis/grade/class: %s", rec)
+                continue
+            too_long = [field for (field, limit), value in zip(FIELD_LIMITS, rec) if len(str(value)) > limit]
+            if too_long:
+                self.invalid += 1
+                logger.warning("Skipping student with too long %s: %s", "/".join(too_long), rec)
+                continue
+            self._writer.writerow((nis, name, grade, class_))
+            self._pending += self._buf.getvalue()
+            self._buf.seek(0)
+            self._buf.truncate()
+        if size < 0:
+            size = len(self._pending)
+        out, self._pending = self._pending[:size], self._pending[size:]
+        return out
+
+
+def load_students(records):
+    """COPY records into a temp table and upsert them into students in one statement."""
+    stream = _CsvStream(records)
+    with db_cursor() as (conn, cur):
+        cur.execute("CREATE TEMP TABLE tmp_students (LIKE students) ON COMMIT DROP")
+        cur.copy_expert("COPY tmp_students (nis, name, grade, class) FROM STDIN WITH (FORMAT csv)", stream)
+        cur.execute(UPSERT_SQL)
+        inserted, updated = cur.fetchone()
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "skipped": stream.total - inserted - updated,
+        "total": stream.total,
+    }
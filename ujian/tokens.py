@@ -0,0 +1,124 @@
+"""
+Token validation with a short-lived shared cache.
+
+Proctor tokens are handed out per room and validated by everybody in that
+room at once, so validate() answers from the state backend (state.py)
+whenever it can; with a shared backend a token created or checked on one
+node is known to all of them:
+
+  - valid tokens are cached for TOKEN_CACHE_TTL seconds (never past their
+    expiry), expired ones likewise;
+  - unknown tokens are negatively cached for TOKEN_NEGATIVE_TTL seconds;
+  - a miss costs one indexed query on tokens(token_type, token, expires_at),
+    and misses are rate limited (TOKEN_MISS_RATE per second) so guessing
+    tokens cannot turn into unbounded database load. The limit is per
+    process, like the database pool it protects.
+
+An unreachable backend only costs the cache: validate() then asks the
+database.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import TOKEN_CACHE_TTL, TOKEN_NEGATIVE_TTL, TOKEN_MISS_RATE, TOKEN_MISS_CLIENTS
+from db import db_cursor
+from queries import execute, TOKEN_VALIDATE
+from state import state, StateError
+
+logger = logging.getLogger(__name__)
+
+VALID = "valid"
+INVALID = "invalid"
+EXPIRED = "expired"
+THROTTLED = "throttled"
+
+
+class TokenCache:
+    def __init__(self, ttl=TOKEN_CACHE_TTL, negative_ttl=TOKEN_NEGATIVE_TTL, miss_rate=TOKEN_MISS_RATE,
+                 max_clients=TOKEN_MISS_CLIENTS, backend=state):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.miss_rate = miss_rate
+        self.max_clients = max_clients
+        self.backend = backend  # "token:<type>:<token>" -> "<status> <expires_at>"
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # client -> (allowance, last refill), least recently used first
+        self.stats = {"hits": 0, "misses": 0, "throttled": 0}
+
+    @staticmethod
+    def _key(token_type, token):
+        return "token:%s:%s" % (token_type, token)
+
+    def _store(self, key, status, expires_at=None):
+        ttl = self.negative_ttl if status == INVALID else self.ttl
+        try:
+            self.backend.set(key, "%s %s" % (status, expires_at or 0), ttl=ttl)
+        except StateError as e:
+            logger.warning("Token not cached: %s", e)
+
+    def _lookup(self, key):
+        try:
+            value = self.backend.get(key)
+        except StateError as e:
+            logger.warning("Token cache unavailable: %s", e)
+            return None
+        if not value:
+            return None
+        status, _, expires_at = value.partition(" ")
+        return status, float(expires_at or 0)
+
+    def _take_miss(self, client):
+        with self._lock:
+            now = time.monotonic()
+            allowance, last = self._buckets.pop(client, (float(self.miss_rate), now))
+            allowance = min(self.miss_rate, allowance + (now - last) * self.miss_rate)
+            allowed = allowance >= 1
+            self._buckets[client] = (allowance - 1 if allowed else allowance, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def validate(self, token_type, token, client=None):
+        key = self._key(token_type, token)
+        hit = self._lookup(key)
+        if hit:
+            self.stats["hits"] += 1
+            status, expires_at = hit
+            if status == VALID and expires_at <= time.time():
+                status = EXPIRED
+            return status
+
+        if not self._take_miss(client):
+            self.stats["throttled"] += 1
+            return THROTTLED
+        self.stats["misses"] += 1
+        with db_cursor() as (conn, cur):
+            execute(cur, TOKEN_VALIDATE, (token_type, token))
+            row = cur.fetchone()
+        if not row:
+            self._store(key, INVALID)
+            return INVALID
+        status = VALID if row[0] else EXPIRED
+        self._store(key, status, float(row[1]))
+        return status
+
+    def put(self, token_type, token, expires_at):
+        """Record a freshly created token; expires_at is an aware datetime."""
+        self._store(self._key(token_type, token), VALID, expires_at.timestamp())
+
+    def clear(self):
+        try:
+            self.backend.delete_prefix("token:")
+        except StateError as e:
+            logger.warning("Token cache not cleared: %s", e)
+
+
+token_cache = TokenCache()
+
+
+def validate_token(token_type, token, client=None):
+    """Return VALID, INVALID, EXPIRED or THROTTLED; client (the remote address) picks the rate-limit bucket."""
+    return token_cache.validate(token_type, token, client)
@@ -0,0 +1,78 @@
+"""
+Client violation ingest.
+
+guard.js reports anti-cheat events (fullscreenExit, windowBlur,
+devToolsDetected, pasteAttempt, ...) in small batches, typically through
+navigator.sendBeacon. Events are queued in-process and, at flush time,
+coalesced per (session, event type) into one row carrying the number of
+occurrences and the first/last client timestamp. A whole room tripping
+over the same focus glitch therefore becomes a single multi-row insert.
+"""
+
+import time
+
+from psycopg2.extras import execute_values
+from answers import session_cache
+from batching import WriteBehindQueue
+from config import VIOLATION_FLUSH_INTERVAL
+from db import db_cursor
+
+MAX_EVENTS = 100
+MAX_TYPE_LENGTH = 64
+# client clocks are trusted only within this many seconds of the server's
+MAX_CLOCK_SKEW = 300
+
+
+def _coalesce(events):
+    rows = {}
+    for session_hash, nis, event_type, ts in events:
+        row = rows.get((session_hash, event_type))
+        if row is None:
+            rows[(session_hash, event_type)] = [session_hash, nis, event_type, 1, ts, ts]
+        else:
+            row[3] += 1
+            row[4] = min(row[4], ts)
+            row[5] = max(row[5], ts)
+    return list(rows.values())
+
+
+def _write_batch(events):
+    with db_cursor() as (conn, cur):
+        execute_values(
+            cur,
+            "INSERT INTO violations (session_hash, nis, event_type, occurrences, first_at, last_at) VALUES %s",
+            _coalesce(events),
+            template="(%s, %s, %s, %s, to_timestamp(%s), to_timestamp(%s))",
+        )
+
+
+violation_queue = WriteBehindQueue("violations", _write_batch, interval=VIOLATION_FLUSH_INTERVAL)
+
+
+def _event_time(value, now):
+    try:
+        ts = float(value) / 1000.0  # JS Date.now() milliseconds
+    except (TypeError, ValueError):
+        return now
+    return ts if abs(ts - now) <= MAX_CLOCK_SKEW else now
+
+
+def ingest(session_hash, nis, events):
+    """Queue a batch of client events. Returns the number accepted, None for an unknown session."""
+    if not isinstance(events, list):
+        raise ValueError("events must be a list")
+    if len(events) > MAX_EVENTS:
+        raise ValueError("too many events in one batch")
+    if session_cache.lookup(session_hash, nis) is None:
+        return None
+    now = time.time()
+    rows = []
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        # NUL cannot be stored in text; one such row would fail every flush
+        event_type = str(event.get("type") or "").replace("\x00", "").strip()[:MAX_TYPE_LENGTH]
+        if event_type:
+            rows.append((session_hash, nis, event_type, _event_time(event.get("ts"), now)))
+    violation_queue.extend(rows)
+    return len(rows)